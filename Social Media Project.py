@@ -1,132 +1,805 @@
 #Social Media Project 
 import tkinter as tk
 from tkinter import simpledialog, messagebox, scrolledtext
-from datetime import datetime
-from collections import deque
+from datetime import datetime, timedelta
+from array import array
+from itertools import accumulate
+import asyncio
+import atexit
+import bisect
+import functools
+import heapq
 import json
+import mmap
+import multiprocessing
+import os
+import random
+import re
+import secrets
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import zlib
+TIME_FORMAT = "%d-%m-%Y %H:%M:%S" # format used for every timestamp written to disk
 #Algorithms:
 #Node class used for chaining in the HashTable
 class Node:
+    __slots__ = ("key", "value", "next") # no per node __dict__, there is one node per user
     def __init__(self,key,value):
         self.key = key #key of the node
         self.value = value ##user object
         self.next = None #pointer to the next node in linked list
 
+# a value kept in the form it was saved as, HashTable.get turns it into the real value on first use
+class LazyRecord:
+    __slots__ = ("raw", "post_count", "storage")
+    def __init__(self,raw,post_count,storage):
+        self.raw = raw # whatever the storage needs to find the record again, bytes or a file offset
+        self.post_count = post_count # posts inside raw, known without parsing it
+        self.storage = storage # the snapshot storage that can decode raw
+
+# chains are never changed once a table holds them: inserts, updates and deletes copy the nodes in front of the one
+# they touch and swap the bucket in with one assignment, so a lookup racing a writer sees the bucket before or after
+# the change and never half of it, the one exception is a LazyRecord being replaced by the value it stands for
 class HashTable:
-    def __init__(self,size=50):
+    def __init__(self,size=50, load_factor=0.75, resizable=True):
         self.size = size  # number of buckets (slots inside the table where data is stored)
         self.table = [None] * size  # initialise empty buckets 
+        self.min_size = size # never shrink below the starting size
+        self.load_factor = load_factor # grow above this many items per bucket, shrink below a quarter of it
+        self.resizable = resizable
+        self.count = 0 # running number of items so size queries are O(1)
+        self.old_table = None # buckets still waiting to be moved while a resize is in progress
+        self.rehash_index = 0 # next bucket of old_table to move
+        self.resizes = 0 # resizes started so far, a lookup that overlapped one looks again
+        self.shared = False # the bucket lists belong to a snapshot too and are copied before the next write
+        self.loader = None # loader(key, lazy) builds the real value for a LazyRecord
+        self.lock = threading.RLock() # held while a LazyRecord is built, so it is built once
 
     # hash function to map key to index
     def hash(self,key):
         return hash(key) % self.size
-    
+
+    # a read only view of the table as it is now, O(1): the bucket lists are shared until the next write copies them
+    def snapshot(self):
+        view = HashTable.__new__(HashTable)
+        view.__dict__.update(self.__dict__)
+        self.shared = True
+        return view
+
+    # take private copies of the bucket lists before changing them, if a snapshot still uses them
+    def own(self):
+        if self.shared:
+            self.table = list(self.table)
+            if self.old_table is not None:
+                self.old_table = list(self.old_table)
+            self.shared = False
+
+    # moves a few buckets from the old table per operation so no single call pays for a whole resize
+    # the nodes are copied into the new table, a lookup may still be walking the old chains
+    def rehash_step(self, buckets=4):
+        self.own()
+        old = self.old_table
+        while buckets > 0 and self.rehash_index < len(old):
+            current = old[self.rehash_index]
+            while current: # copy every node of the bucket into the new table
+                index = self.hash(current.key)
+                node = Node(current.key, current.value)
+                node.next = self.table[index]
+                self.table[index] = node
+                current = current.next
+            old[self.rehash_index] = None # only once its nodes are reachable from the new table
+            self.rehash_index += 1
+            buckets -= 1
+        if self.rehash_index >= len(old):
+            self.old_table = None
+            self.check_load() # items may have come and gone while moving
+
+    # starts moving everything into a table of new_size buckets
+    def resize(self, new_size):
+        if self.old_table is not None: # finish the previous resize first
+            self.rehash_step(len(self.old_table))
+        self.own()
+        self.resizes += 1
+        self.old_table = self.table
+        self.rehash_index = 0
+        self.size = new_size
+        self.table = [None] * new_size
+
+    # grow or shrink when the load factor leaves its range
+    def check_load(self):
+        if not self.resizable or self.old_table is not None:
+            return
+        if self.count > self.size * self.load_factor:
+            self.resize(self.size * 2)
+        elif self.size > self.min_size and self.count < self.size * self.load_factor / 4:
+            self.resize(max(self.min_size, self.size // 2))
+
+    # find the node holding key in either table, safe to call while another thread writes
+    # the old table is looked at first: a node being moved is put into the new table before it leaves the old one
+    def find_node(self,key):
+        while True:
+            resizes = self.resizes
+            old, table = self.old_table, self.table
+            if old is not None:
+                current = old[hash(key) % len(old)]
+                while current:
+                    if current.key == key:
+                        return current
+                    current = current.next
+            current = table[hash(key) % len(table)]
+            while current:
+                if current.key == key:
+                    return current
+                current = current.next
+            if resizes == self.resizes: # no resize started meanwhile, so it really is not there
+                return None
+
+    # copy of the chain at table[index] with the node of key replaced by node (or dropped when node is None)
+    # the nodes in front of it are copied, the ones behind it are shared, returns False if key is not there
+    @staticmethod
+    def replace(table, index, key, node):
+        path = []
+        current = table[index]
+        while current and current.key != key:
+            path.append(current)
+            current = current.next
+        if current is None:
+            return False
+        rest = current.next
+        if node is not None:
+            node.next = rest
+            rest = node
+        for previous in reversed(path):
+            copy = Node(previous.key, previous.value)
+            copy.next = rest
+            rest = copy
+        table[index] = rest
+        return True
+
     #insert or update a key value pair
     def insert(self,key, value):
+        self.own()
+        if self.old_table is not None:
+            self.rehash_step()
         index = self.hash(key)
-        head = self.table[index]
-
-        current = head
-        while current: # traverse linked list to check if key exists
-            if current.key == key:
-                current.value = value # update value if key exists
-                return
-            current = current.next
+        if self.find_node(key):
+            if not self.replace(self.table, index, key, Node(key, value)): # update value if key exists
+                self.replace(self.old_table, hash(key) % len(self.old_table), key, Node(key, value)) # not moved yet
+            return
 
         new_node = Node(key,value) # otherwise make a new node
-        new_node.next = head
+        new_node.next = self.table[index]
         self.table[index] = new_node # insert at the head, this is chaining
+        self.count += 1
+        self.check_load()
+
+    #insert many key value pairs, the table is sized once up front instead of doubling repeatedly
+    def insert_many(self,items):
+        items = list(items)
+        if self.resizable:
+            new_size = self.size
+            while self.count + len(items) > new_size * self.load_factor:
+                new_size *= 2
+            if new_size != self.size:
+                self.resize(new_size)
+                self.rehash_step(len(self.old_table))
+        for key, value in items:
+            self.insert(key, value)
 
     #retrieve value by the key
+    # lookups never change the table, a resize is moved along by the writes only
     def get(self,key):
-        index = self.hash(key)
-        current = self.table[index]
-
-        while current:
-            if current.key == key:
-                return current.value # return value if key is matched
-            current = current.next
+        node = self.find_node(key)
+        if node:
+            if node.value.__class__ is LazyRecord: # stored unparsed, build it now
+                with self.lock:
+                    node = self.find_node(key) # again, another thread may have built it or copied the node meanwhile
+                    if node.value.__class__ is LazyRecord:
+                        node.value = self.loader(key, node.value)
+            return node.value # return value if key is matched
         return None # return none if not found
-    
+
+    # the stored value as it is, a LazyRecord is returned unbuilt
+    def peek(self,key):
+        node = self.find_node(key)
+        return node.value if node else None
+
     #delete key value pair
     def delete(self,key):
-        index = self.hash(key)
-        current = self.table[index]
-        previous = None
+        self.own()
+        if self.old_table is not None:
+            self.rehash_step()
+        found = self.replace(self.table, self.hash(key), key, None)
+        if not found and self.old_table is not None:
+            found = self.replace(self.old_table, hash(key) % len(self.old_table), key, None)
+        if not found:
+            return False # return false if key not found
+        self.count -= 1
+        self.check_load()
+        return True
 
-        while current:
-            if current.key == key:
-                if previous:
-                    previous.next = current.next
-                else:
-                    self.table[index] = current.next
-                return True
-            previous = current
-            current = current.next
+    # iterate over (key, value) pairs in both tables, the table must not change while iterating (a snapshot never does)
+    # values not looked up yet come out as their LazyRecord
+    def items(self):
+        tables = [self.table] if self.old_table is None else [self.old_table, self.table]
+        for table in tables:
+            for bucket in table:
+                current = bucket
+                while current:
+                    yield current.key, current.value
+                    current = current.next
 
-        return False # return false if key not found
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def __iter__(self):
+        for key, _ in self.items():
+            yield key
+
+    def __len__(self):
+        return self.count
     
     # count total users in the hash table
     def total_users(self):
-        count = 0
-        for bucket in self.table:
-            current = bucket
-            while current:
-                count +=1
-                current = current.next
-        return count
+        return self.count
     
     #count total items 
     def total_items(self):
-        count = 0
-        for bucket in self.table:
-            current = bucket
-            while current:
-                count+=1
-                current = current.next
-        return count
+        return self.count
 
-# Queue for notifications using deque for O(1) enqueue/dequeue
-class Queue:
-    def __init__(self):
-        self.items = deque()
+    # chain lengths for spotting a bad spread, walks every bucket so it is for reports and not hot paths
+    def stats(self):
+        histogram = {} # chain length -> buckets
+        longest = 0
+        buckets = self.table if self.old_table is None else self.table + self.old_table[self.rehash_index:]
+        for bucket in buckets:
+            length = 0
+            while bucket:
+                length += 1
+                bucket = bucket.next
+            histogram[length] = histogram.get(length, 0) + 1
+            longest = max(longest, length)
+        return {"buckets": len(buckets), "items": self.count, "load_factor": self.count / len(buckets),
+                "longest_chain": longest, "chain_histogram": dict(sorted(histogram.items())),
+                "resizing": self.old_table is not None}
 
-    def enqueue(self,item):
-        self.items.append(item) # adds notification to the end
+# one users notifications in a bounded ring buffer, the oldest are overwritten once it is full
+# every notification gets the next sequence number, reading moves a cursor instead of removing them
+class NotificationInbox:
+    def __init__(self,capacity=100):
+        self.capacity = capacity
+        self.items = [] # (seq, message), seq n lives at slot (n - 1) % capacity, grows up to capacity
+        self.next_seq = 1 # sequence number the next notification gets
+        self.first_seq = 1 # oldest notification still kept
+        self.read_seq = 0 # every notification up to here has been read
+
+    def push(self,message):
+        slot = (self.next_seq - 1) % self.capacity
+        if slot >= len(self.items):
+            self.items.extend([None] * (slot + 1 - len(self.items)))
+        self.items[slot] = (self.next_seq, message) # overwrites the oldest once full
+        self.next_seq += 1
+        self.first_seq = max(self.first_seq, self.next_seq - self.capacity)
+
+    # notifications newer than since (default: the read cursor) oldest first, O(returned)
+    def since(self, since=None, limit=None):
+        first = max(self.read_seq if since is None else since, self.first_seq - 1) + 1
+        last = self.next_seq if limit is None else min(self.next_seq, first + limit)
+        return [self.items[(seq - 1) % self.capacity] for seq in range(first, last)]
+
+    def mark_read(self,seq):
+        self.read_seq = max(self.read_seq, min(seq, self.next_seq - 1))
+
+    # what the next push or mark_read changes, including the slot push would overwrite
+    def mark(self):
+        slot = (self.next_seq - 1) % self.capacity
+        return (self.next_seq, self.first_seq, self.read_seq, self.items[slot] if slot < len(self.items) else None)
+
+    # back to a mark, undoing the pushes and reads made since then newest first one mark at a time
+    def restore(self, mark):
+        self.next_seq, self.first_seq, self.read_seq, item = mark
+        slot = (self.next_seq - 1) % self.capacity
+        if slot < len(self.items):
+            self.items[slot] = item
+
+    def unread(self):
+        return self.next_seq - max(self.read_seq + 1, self.first_seq)
 
-    def dequeue(self):
-        return self.items.popleft() if self.items else None # remove from front in O(1)
-    
-    def is_empty(self):
-        return len(self.items) == 0
-    
 #merge sort algorithm for sorting posts
+# natural merge sort: the runs already in order are found first, then neighbouring runs are merged bottom up
+# posts mostly arrive in time order, so the input is usually a few long runs and needs only a pass or two
+# every key is computed once up front and the merges move items between two buffers made once, no slicing
 class Sorter:
+    MIN_RUN = 32 # shorter runs are grown to this by binary insertion, so random input does not need log2(n) passes
+
     @staticmethod # this is because it does not receive self, its a regular function
-    #avoids making unnecessary objects
-    def merge_sort(arr, key=lambda x:x): # defines small function in one line
-        if len(arr) <= 1:
-            return arr
-        mid = len(arr) // 2
-        left = Sorter.merge_sort(arr[:mid], key)
-        right = Sorter.merge_sort(arr[mid:],key)
-
-        return Sorter.merge(left,right,key)
-    
+    def merge_sort(arr, key=lambda x:x): # stable, returns a new list
+        items = list(arr)
+        n = len(items)
+        if n <= 1:
+            return items
+        keys = [key(item) for item in items]
+        bounds = [0] # start of every run, then n
+        i = 0
+        while i < n:
+            j = i + 1
+            if j < n and keys[j] < keys[i]: # strictly descending, reversing it keeps the sort stable
+                while j + 1 < n and keys[j + 1] < keys[j]:
+                    j += 1
+                j += 1
+                keys[i:j] = keys[i:j][::-1]
+                items[i:j] = items[i:j][::-1]
+            else:
+                while j < n and keys[j - 1] <= keys[j]:
+                    j += 1
+            if j - i < Sorter.MIN_RUN and j < n:
+                end = min(n, i + Sorter.MIN_RUN)
+                run_keys, run_items = keys[i:j], items[i:j]
+                for x in range(j, end):
+                    at = bisect.bisect_right(run_keys, keys[x]) # after equal keys, so it stays stable
+                    run_keys.insert(at, keys[x])
+                    run_items.insert(at, items[x])
+                keys[i:end] = run_keys
+                items[i:end] = run_items
+                j = end
+            bounds.append(j)
+            i = j
+        other_keys, other_items = [None] * n, [None] * n
+        while len(bounds) > 2: # one pass halves the number of runs
+            merged = [0]
+            for r in range(0, len(bounds) - 1, 2):
+                lo, mid = bounds[r], bounds[r + 1]
+                hi = bounds[r + 2] if r + 2 < len(bounds) else mid
+                Sorter.merge(keys, items, other_keys, other_items, lo, mid, hi)
+                merged.append(hi)
+            keys, other_keys = other_keys, keys
+            items, other_items = other_items, items
+            bounds = merged
+        return items
+
+    # merge the runs [lo, mid) and [mid, hi) of keys/items into the same positions of the out lists
     @staticmethod # # groups related functions together
-    def merge(left,right,key):
-        result = []
-        i = j = 0
-        while i < len(left) and j < len(right):
-            if key(left[i]) <= key(right[j]):
-                result.append(left[i])
-                i+=1
+    def merge(keys, items, out_keys, out_items, lo, mid, hi):
+        if mid == hi or keys[mid - 1] <= keys[mid]: # nothing to interleave
+            out_keys[lo:hi] = keys[lo:hi]
+            out_items[lo:hi] = items[lo:hi]
+            return
+        i, j, k = lo, mid, lo
+        while i < mid and j < hi:
+            if keys[j] < keys[i]: # ties take the left run first so equal keys keep their order
+                out_keys[k] = keys[j]
+                out_items[k] = items[j]
+                j += 1
+            else:
+                out_keys[k] = keys[i]
+                out_items[k] = items[i]
+                i += 1
+            k += 1
+        if i < mid:
+            out_keys[k:hi] = keys[i:mid]
+            out_items[k:hi] = items[i:mid]
+        else:
+            out_keys[k:hi] = keys[j:hi]
+            out_items[k:hi] = items[j:hi]
+
+    # the k items with the largest keys, largest first, keeping a heap of k instead of sorting everything
+    @staticmethod
+    def top_k(items, k, key=lambda x:x):
+        return heapq.nlargest(k, items, key=key)
+
+# timestamps are kept as whole seconds since 1970 (naive, like the datetimes the app uses)
+class Epoch:
+    START = datetime(1970, 1, 1)
+    SECOND = timedelta(seconds=1)
+
+    @staticmethod
+    def from_datetime(dt):
+        return (dt - Epoch.START) // Epoch.SECOND
+
+    @staticmethod
+    def to_datetime(seconds):
+        return Epoch.START + timedelta(seconds=seconds)
+
+# stores many strings back to back in one bytearray, used for post contents in compact mode
+# deleted strings stay until the next restart
+class StringArena:
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("Q", [0]) # string i is data[offsets[i]:offsets[i + 1]]
+
+    def add(self,text):
+        self.data += text.encode("utf-8")
+        self.offsets.append(len(self.data))
+        return len(self.offsets) - 2
+
+    def get(self,index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]].decode("utf-8")
+
+# keeps posts sorted oldest first by (timestamp, id) using bisect, so they never have to be sorted again
+# the index is persistent: a change builds a new version that shares everything it did not touch with the old one
+# and publishes it with one assignment, every read takes the current version once and works on that alone
+# a version is the posts in chunks of up to CHUNK and a length, a change copies one chunk and the short per chunk
+# tuples, and an append to the last chunk only adds to its lists: older versions stop at their own length
+class TimelineIndex:
+    CHUNK = 512
+    EMPTY = ((), (), (), (), 0, False) # key chunks, post chunks, first key and start of each chunk, length, trimmed
+
+    def __init__(self, version=EMPTY):
+        self.version = version # a snapshot()s version is only read, its chunk lists are shared with newer versions
+
+    @staticmethod
+    def key(post):
+        return (post.epoch, post.id)
+
+    # the version made of these chunk lists, firsts, starts and length are worked out again from them
+    @staticmethod
+    def build(keys, posts, trimmed):
+        ends = tuple(accumulate(map(len, keys)))
+        if not ends:
+            return ((), (), (), (), 0, trimmed)
+        return (keys, posts, tuple(chunk[0] for chunk in keys), (0,) + ends[:-1], ends[-1], trimmed)
+
+    # build an index straight from posts already sorted by key
+    @staticmethod
+    def from_sorted(posts):
+        posts = list(posts)
+        chunks = tuple(posts[i:i + TimelineIndex.CHUNK] for i in range(0, len(posts), TimelineIndex.CHUNK))
+        keys = tuple(list(map(TimelineIndex.key, chunk)) for chunk in chunks)
+        return TimelineIndex(TimelineIndex.build(keys, chunks, False))
+
+    # this version frozen, O(1), later changes to the index do not show in it
+    def snapshot(self):
+        return TimelineIndex(self.version)
+
+    # older posts than the first one kept may exist elsewhere, set by trim
+    @property
+    def trimmed(self):
+        return self.version[5]
+
+    # key of the oldest post, None when empty
+    def first_key(self):
+        firsts = self.version[2]
+        return firsts[0] if firsts else None
+
+    # posts in chunk index of a version, its list can hold more: the posts newer versions appended to it
+    @staticmethod
+    def size(version, index):
+        starts = version[3]
+        return (starts[index + 1] if index + 1 < len(starts) else version[4]) - starts[index]
+
+    # position of key among all posts of a version, like bisect_left (or bisect_right) on one list of keys
+    @staticmethod
+    def position(version, key, right=False):
+        keys, posts, firsts, starts, length, trimmed = version
+        if not keys:
+            return 0
+        find = bisect.bisect_right if right else bisect.bisect_left
+        chunk = max(find(firsts, key) - 1, 0) # every key before this chunk is smaller, every key after it bigger
+        return starts[chunk] + find(keys[chunk], key, 0, TimelineIndex.size(version, chunk))
+
+    # the posts at positions start to end of a version
+    @staticmethod
+    def slice(version, start, end):
+        keys, posts, firsts, starts, length, trimmed = version
+        page = []
+        chunk = bisect.bisect_right(starts, start) - 1
+        while start < end:
+            offset = start - starts[chunk]
+            part = posts[chunk][offset:min(offset + end - start, TimelineIndex.size(version, chunk))]
+            page += part
+            start += len(part)
+            chunk += 1
+        return page
+
+    # publish a version where the chunk at index is replaced by blocks, a list of (keys, posts) chunks
+    def replace(self, version, index, blocks, trimmed):
+        keys, posts, firsts, starts, length, _ = version
+        self.version = self.build(keys[:index] + tuple(k for k, p in blocks) + keys[index + 1:],
+                                  posts[:index] + tuple(p for k, p in blocks) + posts[index + 1:], trimmed)
+
+    # new posts are usually the newest, so this is normally an append to the last chunk
+    # the current version always holds all of its last chunk, so the lists can be added to directly
+    def add(self,post):
+        key = self.key(post)
+        version = keys, posts, firsts, starts, length, trimmed = self.version
+        if not keys or key >= keys[-1][-1]:
+            if keys and len(keys[-1]) < self.CHUNK:
+                keys[-1].append(key) # not seen by anyone before the new version is published
+                posts[-1].append(post)
+                self.version = (keys, posts, firsts, starts, length + 1, trimmed)
+            else: # a new chunk
+                self.version = (keys + ([key],), posts + ([post],), firsts + (key,), starts + (length,), length + 1, trimmed)
+            return
+        chunk = max(bisect.bisect_right(firsts, key) - 1, 0)
+        index = bisect.bisect_right(keys[chunk], key)
+        block_keys = keys[chunk][:index] + [key] + keys[chunk][index:]
+        block_posts = posts[chunk][:index] + [post] + posts[chunk][index:]
+        half = len(block_keys) // 2
+        if len(block_keys) > self.CHUNK: # split it in two
+            blocks = [(block_keys[:half], block_posts[:half]), (block_keys[half:], block_posts[half:])]
+        else:
+            blocks = [(block_keys, block_posts)]
+        self.replace(version, chunk, blocks, trimmed)
+
+    def remove(self,post):
+        key = self.key(post)
+        version = keys, posts, firsts, starts, length, trimmed = self.version
+        if not keys:
+            return False
+        chunk = max(bisect.bisect_right(firsts, key) - 1, 0)
+        block = keys[chunk]
+        index = bisect.bisect_left(block, key)
+        if index == len(block) or block[index] != key:
+            return False
+        blocks = [(block[:index] + block[index + 1:], posts[chunk][:index] + posts[chunk][index + 1:])] if len(block) > 1 else []
+        self.replace(version, chunk, blocks, trimmed)
+        return True
+
+    # drop the oldest posts so at most limit are kept
+    def trim(self, limit):
+        keys, posts, firsts, starts, length, trimmed = self.version
+        extra = length - limit
+        if extra > 0:
+            if extra < length:
+                chunk = bisect.bisect_right(starts, extra) - 1 # the chunk holding the oldest post kept
+                offset = extra - starts[chunk]
+                keys = (keys[chunk][offset:],) + keys[chunk + 1:]
+                posts = (posts[chunk][offset:],) + posts[chunk + 1:]
+            else: # limit 0
+                keys = posts = ()
+            self.version = self.build(keys, posts, True) # older posts than the first key may exist elsewhere
+
+    # newest first page of at most limit posts, cursor is the last post of the previous page
+    def newest(self, limit=None, cursor=None):
+        version = self.version
+        end = version[4] if cursor is None else self.position(version, self.key(cursor))
+        start = 0 if limit is None else max(0, end - limit)
+        return self.slice(version, start, end)[::-1]
+
+    # lazily walk the posts newest first, starting after cursor
+    def iter_newest(self, cursor=None):
+        version = keys, posts, firsts, starts, length, trimmed = self.version
+        end = length if cursor is None else self.position(version, self.key(cursor))
+        chunk = bisect.bisect_left(starts, end) - 1 # the chunk holding position end - 1
+        while chunk >= 0:
+            block = posts[chunk]
+            for index in range(min(end, starts[chunk] + self.size(version, chunk)) - starts[chunk] - 1, -1, -1):
+                yield block[index]
+            chunk -= 1
+
+    # posts with start <= timestamp <= end oldest first, every post sharing a timestamp is included
+    def between(self, start, end):
+        version = self.version
+        low = self.position(version, (-((Epoch.START - start) // Epoch.SECOND),)) # start rounded up
+        high = self.position(version, (Epoch.from_datetime(end), float("inf")), right=True)
+        return self.slice(version, low, high)
+
+    # k-way heap merge of newest first streams, a post reached through two streams is kept once
+    @staticmethod
+    def merge_newest(streams, limit=None):
+        page = []
+        last = None
+        for post in heapq.merge(*streams, key=TimelineIndex.key, reverse=True):
+            if post is last:
+                continue
+            page.append(post)
+            last = post
+            if limit is not None and len(page) >= limit:
+                break
+        return page
+
+    def __getitem__(self, index):
+        keys, posts, firsts, starts, length, trimmed = self.version
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("timeline index out of range")
+        chunk = bisect.bisect_right(starts, index) - 1
+        return posts[chunk][index - starts[chunk]]
+
+    def __iter__(self):
+        version = keys, posts, firsts, starts, length, trimmed = self.version
+        for chunk, block in enumerate(posts):
+            yield from block[:self.size(version, chunk)]
+
+    def __len__(self):
+        return self.version[4]
+
+# inverted index from lowercase words to the sorted ids of the posts containing them
+# a search may run while posts are added and removed: a postings list only ever grows at its end in place, any
+# other change builds a new list and swaps it in, and terms is replaced the same way
+class InvertedIndex:
+    def __init__(self):
+        self.postings = {} # term -> ascending list of post ids, newer posts have bigger ids
+        self.terms = [] # every term in sorted order, for prefix lookups
+        self.new_terms = [] # terms added since terms was last sorted, folded in by the next lookup that needs order
+        self.terms_lock = threading.Lock() # new_terms is added to by the writer and folded in by lookups
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r"\w+", text.lower())
+
+    def add(self, post_id, terms):
+        for term in set(terms):
+            ids = self.postings.get(term)
+            if ids is None:
+                self.postings[term] = [post_id]
+                with self.terms_lock:
+                    self.new_terms.append(term) # an insort per new word would make bulk loads quadratic
+            elif ids[-1] < post_id:
+                ids.append(post_id) # the usual case, a new post
             else:
-                result.append(right[j])
-                j+=1
-        result.extend(left[i:])
-        result.extend(right[j:])
-        return result
+                index = bisect.bisect_left(ids, post_id)
+                self.postings[term] = ids[:index] + [post_id] + ids[index:]
+
+    # add many (post id, terms) at once, a list getting older ids is rebuilt once for all of them, not once each
+    def add_many(self, entries):
+        grouped = {}
+        for post_id, terms in entries:
+            for term in set(terms):
+                grouped.setdefault(term, []).append(post_id)
+        new_terms = []
+        for term, new in grouped.items():
+            new.sort()
+            ids = self.postings.get(term)
+            if ids is None:
+                self.postings[term] = new
+                new_terms.append(term)
+            elif ids[-1] < new[0]:
+                ids += new # appended in place like add does
+            else:
+                self.postings[term] = sorted(ids + new) # two sorted runs, merged in linear time
+        with self.terms_lock:
+            self.new_terms += new_terms
+
+    def remove(self, post_id, terms):
+        for term in set(terms):
+            ids = self.postings.get(term)
+            if ids is None:
+                continue
+            index = bisect.bisect_left(ids, post_id)
+            if index < len(ids) and ids[index] == post_id:
+                ids = self.postings[term] = ids[:index] + ids[index + 1:]
+            if not ids:
+                del self.postings[term]
+                with self.terms_lock:
+                    self.sort_terms()
+                    index = bisect.bisect_left(self.terms, term)
+                    self.terms = self.terms[:index] + self.terms[index + 1:]
+
+    # fold the new terms into terms, sort() sees two sorted runs and merges them in linear time
+    # called with terms_lock held
+    def sort_terms(self):
+        if self.new_terms:
+            self.new_terms.sort()
+            terms = self.terms + self.new_terms
+            terms.sort()
+            self.terms, self.new_terms = terms, []
+
+    # postings lists of every term that starts with prefix
+    def prefix_lists(self, prefix):
+        with self.terms_lock:
+            self.sort_terms()
+            terms = self.terms
+        start = bisect.bisect_left(terms, prefix)
+        end = bisect.bisect_left(terms, prefix + "\uffff")
+        return [ids for ids in map(self.postings.get, terms[start:end]) if ids]
+
+    @staticmethod
+    def contains(ids, post_id):
+        index = bisect.bisect_left(ids, post_id)
+        return index < len(ids) and ids[index] == post_id
+
+    # ids of posts containing every term and a term starting with every prefix, newest first
+    # the shortest list drives the intersection, a prefix is merged into one list only when that costs less
+    # than looking every candidate up in the lists of its terms (a common prefix against one author's posts)
+    def search(self, terms, prefixes=(), limit=None):
+        lists = [self.postings.get(term, []) for term in terms]
+        groups = [self.prefix_lists(prefix) for prefix in prefixes]
+        if not lists and not groups:
+            return []
+        groups.sort(key=lambda group: sum(map(len, group)))
+        if not lists:
+            lists.append(sorted(set().union(*groups.pop(0))))
+        shortest = min(map(len, lists))
+        checked = []
+        for group in groups:
+            if sum(map(len, group)) <= shortest * len(group):
+                lists.append(sorted(set().union(*group)))
+            else:
+                checked.append(group)
+        lists.sort(key=len)
+        results = []
+        for post_id in reversed(lists[0]):
+            if (all(self.contains(other, post_id) for other in lists[1:])
+                    and all(any(self.contains(ids, post_id) for ids in group) for group in checked)):
+                results.append(post_id)
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
+
+# Count-Min sketch: depth rows of width counters, an item adds to one counter in every row and its count is
+# the smallest of them, never below the true count and above it by at most 2 * total / width with
+# probability 1 - 2 ** -depth
+class CountMinSketch:
+    def __init__(self, width=512, depth=4):
+        self.width = width
+        self.depth = depth
+        self.counts = array("q", bytes(8 * width * depth)) # row after row
+        self.total = 0
+
+    # the counter of item in every row, double hashing off one hash so sketches of the same shape agree
+    def cells(self, item):
+        h = hash(item)
+        step = (h >> 32) | 1
+        return [row * self.width + (h + row * step) % self.width for row in range(self.depth)]
+
+    def add(self, item, count=1, cells=None):
+        for cell in cells or self.cells(item):
+            self.counts[cell] += count
+        self.total += count
+
+    def estimate(self, item, cells=None):
+        return min(self.counts[cell] for cell in cells or self.cells(item))
+
+    # estimate over sketches of the same shape as if their counters had been added up
+    @staticmethod
+    def estimate_sum(sketches, cells):
+        return min(sum(sketch.counts[cell] for sketch in sketches) for cell in cells)
+
+# Space-Saving heavy hitters: at most capacity counters, an item without one takes over the smallest and
+# starts from its count, so every item seen more than total / capacity times keeps a counter
+# and no count is more than errors[item] above the true one
+class SpaceSaving:
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.counts = {} # item -> count
+        self.errors = {} # item -> count it took over
+        self.heap = [] # (count, item), entries go stale as counts change and are fixed up when popped
+
+    def add(self, item, count=1):
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+            return
+        smallest = 0
+        if len(counts) >= self.capacity:
+            while True:
+                smallest, victim = heapq.heappop(self.heap)
+                current = counts.get(victim)
+                if current == smallest:
+                    break
+                if current is not None and current > smallest:
+                    heapq.heappush(self.heap, (current, victim))
+            del counts[victim]
+            del self.errors[victim]
+        counts[item] = smallest + count
+        self.errors[item] = smallest
+        heapq.heappush(self.heap, (counts[item], item))
+
+    # take back count occurrences of item, if it still has a counter
+    def remove(self, item, count=1):
+        current = self.counts.get(item)
+        if current is None:
+            return
+        if current <= count:
+            del self.counts[item]
+            del self.errors[item]
+        else:
+            self.counts[item] = current - count
+            heapq.heappush(self.heap, (current - count, item))
+        if len(self.heap) > 2 * self.capacity: # drop the stale entries
+            self.heap = [(c, i) for i, c in self.counts.items()]
+            heapq.heapify(self.heap)
+
 # search classes
 class Search:
     @staticmethod 
@@ -150,223 +823,2751 @@ class Search:
         return -1
 #FriendRequest object to store requests between users
 class FriendRequest:
+    __slots__ = ("sender", "receiver", "epoch")
     def __init__(self,sender,receiver,timestamp):
         self.sender = sender
         self.receiver = receiver
         self.timestamp = timestamp
 
+    @property
+    def timestamp(self):
+        return Epoch.to_datetime(self.epoch)
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self.epoch = Epoch.from_datetime(value)
+
+    # make a request from stored epoch seconds without going through a datetime
+    @staticmethod
+    def from_epoch(sender, receiver, epoch):
+        fr = FriendRequest.__new__(FriendRequest)
+        fr.sender = sender
+        fr.receiver = receiver
+        fr.epoch = epoch
+        return fr
+
 # User class to store information about each user
+# friends and friend_requests are never changed in place, a change puts a new frozenset or tuple in their place
+# so a reader walking them is not disturbed by a writer
 class User:
+    __slots__ = ("username", "password", "posts", "friends", "friend_requests", "inbox", "notifications")
     def __init__(self,username,password):
         self.username = username
         self.password = password
-        self.posts = [] # list of users posts
-        self.friends = [] # list of friend usernames
-        self.friend_requests = [] # list of incoming friend requests
+        self.posts = TimelineIndex() # users posts sorted by time
+        self.friends = frozenset() # friend usernames, the same set the SocialGraph keeps for this user
+        self.friend_requests = () # incoming friend requests, oldest first
+        self.inbox = None # home timeline of own and friends posts, built on first read
+        self.notifications = None # NotificationInbox, made when the first notification arrives
 
-    # add a friend if not already added
+    # add a friend if not already added, SocialGraph.befriend keeps the graph on the new set
     def add_friend(self,username):
-        if username not in self.friends:
-            self.friends.append(username)
+        self.friends = self.friends | {username}
+
+    def add_request(self, fr):
+        self.friend_requests += (fr,)
+
+    def remove_request(self, fr):
+        self.friend_requests = tuple(r for r in self.friend_requests if r is not fr)
 
     ##add a post to the users posts
     def add_post(self, post):
-        self.posts.append(post)
+        self.posts.add(post)
+
+# who is friends with whom as adjacency sets, plus every pending request keyed by (sender, receiver)
+class SocialGraph:
+    def __init__(self):
+        self.adjacency = {} # username -> frozenset of friend usernames
+        self.requests = {} # (sender, receiver) -> FriendRequest
+
+    # start tracking a user, their friends set is shared with User.friends
+    def add_user(self, user):
+        self.adjacency[user.username] = user.friends
+
+    # user gets username as a friend, the new friends set replaces the old one here too
+    def befriend(self, user, username):
+        user.add_friend(username)
+        self.adjacency[user.username] = user.friends
+
+    def add_request(self, fr):
+        self.requests[(fr.sender, fr.receiver)] = fr
+
+    def pop_request(self, sender, receiver):
+        return self.requests.pop((sender, receiver), None)
+
+    def has_request(self, sender, receiver):
+        return (sender, receiver) in self.requests
+
+    def are_friends(self, a, b):
+        return b in self.adjacency.get(a, ())
+
+    # friends a and b have in common
+    def mutual_friends(self, a, b):
+        small, large = self.adjacency.get(a, set()), self.adjacency.get(b, set())
+        if len(small) > len(large):
+            small, large = large, small
+        return {name for name in small if name in large}
+
+    # fewest friendship hops from a to b, -1 when they are not connected
+    # bidirectional BFS, always growing the smaller frontier
+    def degrees_of_separation(self, a, b):
+        if a not in self.adjacency or b not in self.adjacency:
+            return -1
+        if a == b:
+            return 0
+        seen_a, seen_b = {a}, {b}
+        frontier_a, frontier_b = {a}, {b}
+        depth = 0
+        while frontier_a and frontier_b:
+            if len(frontier_a) > len(frontier_b):
+                frontier_a, frontier_b = frontier_b, frontier_a
+                seen_a, seen_b = seen_b, seen_a
+            depth += 1
+            next_frontier = set()
+            for name in frontier_a:
+                for friend in self.adjacency[name]:
+                    if friend in seen_b:
+                        return depth
+                    if friend not in seen_a:
+                        seen_a.add(friend)
+                        next_frontier.add(friend)
+            frontier_a = next_frontier
+        return -1
+
+    # friends of friends ranked by how many mutual friends they have, as (username, mutual count)
+    def suggestions(self, username, limit=10):
+        friends = self.adjacency.get(username, set())
+        counts = {}
+        for friend in friends:
+            for candidate in self.adjacency[friend]:
+                if candidate != username and candidate not in friends:
+                    counts[candidate] = counts.get(candidate, 0) + 1
+        for candidate in list(counts):
+            if self.has_request(username, candidate) or self.has_request(candidate, username):
+                del counts[candidate] # already asked one way or the other
+        return heapq.nsmallest(limit, counts.items(), key=lambda item: (-item[1], item[0]))
 
 # post object to store posts made by users
+# the timestamp is stored as an int and the author string is interned so every post of a user shares it
 class Post:
-    def __init__(self,author, content, timestamp):
-        self.author = author
+    __slots__ = ("author", "text", "arena", "epoch", "id")
+    def __init__(self,author, content, timestamp, post_id=0, arena=None):
+        self.author = sys.intern(author)
+        self.arena = arena # shared StringArena in compact mode, text is then the slot of the content in it
         self.content = content
         self.timestamp = timestamp
+        self.id = post_id # tie breaker between posts made in the same second
+
+    @property
+    def content(self):
+        return self.text if self.arena is None else self.arena.get(self.text)
+
+    @content.setter
+    def content(self, value):
+        self.text = value if self.arena is None else self.arena.add(value)
+
+    @property
+    def timestamp(self):
+        return Epoch.to_datetime(self.epoch)
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self.epoch = Epoch.from_datetime(value)
+
+    # make a post from stored epoch seconds without going through a datetime
+    @staticmethod
+    def from_epoch(author, content, epoch, post_id, arena=None):
+        post = Post.__new__(Post)
+        post.author = sys.intern(author)
+        post.arena = arena
+        post.content = content
+        post.epoch = epoch
+        post.id = post_id
+        return post
+
+    # pickled as its plain fields, a post sent to another process leaves the arena behind
+    def __reduce__(self):
+        return Post.from_epoch, (self.author, self.content, self.epoch, self.id)
+
+# append only write ahead log, every mutation is one json line fsynced to disk
+class WriteAheadLog:
+    def __init__(self,path):
+        self.path = path
+        self.file = None # opened lazily in append mode
+        self.records = 0 # records written since the last snapshot
+        self.stats = {"writes": 0, "bytes": 0, "seconds": 0.0, "max_seconds": 0.0} # one write is one fsync
+
+    # read every complete record, a torn last line left by a crash is cut off
+    def read(self):
+        records = []
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return records
+        good = 0 # byte offset after the last complete record
+        with f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                good += len(line)
+        if good < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(good)
+        self.records = len(records)
+        return records
+
+    # append one record and make sure it reached the disk
+    def append(self,record):
+        self.append_many([record])
+
+    # append several records with a single fsync
+    def append_many(self,records):
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+        start = time.perf_counter()
+        data = "".join(json.dumps(record) + "\n" for record in records)
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records += len(records)
+        took = time.perf_counter() - start
+        self.stats["writes"] += 1
+        self.stats["bytes"] += len(data.encode())
+        self.stats["seconds"] += took
+        self.stats["max_seconds"] = max(self.stats["max_seconds"], took)
+
+    # empty the log once its records are part of a snapshot
+    def reset(self):
+        self.close()
+        with open(self.path, "w") as f:
+            os.fsync(f.fileno())
+        self.records = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# the users of a snapshot as they were at one seq, taken in O(1) and walked later by whoever writes it out
+# the table is a frozen HashTable view and the user objects in it keep changing, so before a writer changes a user
+# for the first time it saves their record here, and the walk takes that saved record over what it read itself
+class UsersSnapshot:
+    def __init__(self, users, record):
+        self.users = users # HashTable snapshot
+        self.record = record # record(user) -> (post count, saved record)
+        self.saved = {} # username -> (post count, record) from before their first change
+        self.done = False # walked to the end, nothing has to be saved any more
+
+    # called by the writer just before it changes user
+    def save(self, username, user):
+        if not self.done and username not in self.saved:
+            self.saved[username] = self.record(user)
+
+    # (username, post count, record) per user, users nobody looked at yet are passed on as their LazyRecord
+    def __iter__(self):
+        try:
+            for username, user in self.users.items():
+                if user.__class__ is LazyRecord:
+                    yield username, user.post_count, user
+                    continue
+                entry = self.record(user)
+                # looked up after reading, a save made while the user was read is always seen here
+                post_count, record = self.saved.get(username, entry)
+                yield username, post_count, record
+        finally:
+            self.done = True
+
+# writes log records and snapshots on a background thread so callers never wait for the disk
+# work arriving within the debounce window shares one write, and a queued snapshot makes
+# every record queued before it unnecessary since it already holds them
+class PersistenceWorker:
+    def __init__(self, wal, write_snapshot, debounce=0.05):
+        self.wal = wal
+        self.write_snapshot = write_snapshot # writes one snapshot dict to disk
+        self.debounce = debounce # seconds to wait for more work before writing
+        self.pending = [] # ("record", record) and ("snapshot", data) in commit order
+        self.condition = threading.Condition()
+        self.busy = False # a batch is being written right now
+        self.urgent = False # someone is waiting in flush, skip the debounce
+        self.stopped = False
+        self.error = None # first write error, raised from flush
+        self.thread = threading.Thread(target=self.run, name="persistence", daemon=True)
+        self.thread.start()
+
+    def submit(self, kind, item):
+        with self.condition:
+            self.pending.append((kind, item))
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if not self.pending:
+                    return # stopped with nothing left to write
+                deadline = time.monotonic() + self.debounce
+                while not self.urgent and not self.stopped and time.monotonic() < deadline:
+                    self.condition.wait(deadline - time.monotonic())
+                batch, self.pending = self.pending, []
+                self.busy = True
+            try:
+                self.write(batch)
+            except Exception as e: # keep going, the error is reported by flush
+                if self.error is None:
+                    self.error = e
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    def write(self, batch):
+        start = 0
+        for i, (kind, item) in enumerate(batch):
+            if kind == "snapshot":
+                start = i # only the newest snapshot matters
+        if batch[start][0] == "snapshot":
+            try:
+                self.write_snapshot(batch[start][1])
+            except Exception:
+                # the log is still the only copy of every record in the batch, not just of those after the snapshot
+                self.wal.append_many([item for kind, item in batch if kind == "record"])
+                raise
+            self.wal.reset()
+            start += 1
+        records = [item for kind, item in batch[start:]]
+        if records:
+            self.wal.append_many(records)
+
+    # block until everything submitted so far is on disk
+    def flush(self):
+        with self.condition:
+            self.urgent = True
+            self.condition.notify_all()
+            while self.pending or self.busy:
+                self.condition.wait()
+            self.urgent = False
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def stop(self):
+        self.flush()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+# snapshot formats, each one reads a file into a header plus one LazyRecord per user and writes a snapshot dict back
+# the json line format: a header line then one line per user: json username, tab, post count, tab, json record
+class JsonLinesStorage:
+    # None when there is no usable file, {"document": data} for the single indented json older versions wrote
+    def read(self, path):
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError: # no snapshot yet
+            return None
+        with f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                header = None
+            if not (isinstance(header, dict) and header.get("format") == 2):
+                f.seek(0)
+                try:
+                    return {"document": json.load(f)}
+                except ValueError:
+                    return None
+            users = []
+            for line in f: # keep every user line unparsed, this is all startup has to do
+                name, post_count, raw = line.rstrip(b"\n").split(b"\t", 2)
+                users.append((json.loads(name), LazyRecord(raw, int(post_count), self)))
+        return {"header": header, "users": users}
+
+    def decode(self, raw):
+        return json.loads(raw)
+
+    def write(self, path, data):
+        with open(path,"wb") as f: # opens the file and writes in
+            f.write(json.dumps(dict(data["header"], format=2)).encode() + b"\n")
+            for username, post_count, record in data["users"]:
+                if record.__class__ is LazyRecord:
+                    raw = record.raw if record.storage is self else json.dumps(record.storage.decode(record.raw)).encode()
+                else:
+                    raw = json.dumps(record).encode()
+                f.write(b"%s\t%d\t%s\n" % (json.dumps(username).encode(), post_count, raw))
+            f.flush()
+            os.fsync(f.fileno())
+
+# the binary format, little endian throughout:
+#   magic, last_seq q, next_post_id q, then the string table: name count I, byte lengths I[], utf-8 names
+#   user count I, then the directory as columns: name index I[], post count I[], record offset q[]
+#   the records, each a length I followed by
+#     password (length I, bytes), friends (count I, name index I[]),
+#     posts (count I, id q[], epoch q[], content length I[], utf-8 contents),
+#     requests (count I, sender I[], receiver I[], epoch q[]),
+#     notifications (flag B, then next_seq q, read_seq q, count I, per item seq q, length I, bytes)
+# the file is mapped instead of read so startup only touches the header, string table and directory
+class BinaryStorage:
+    MAGIC = b"SMPB\x01"
+
+    def __init__(self):
+        self.view = None # the mapped file records are decoded from
+        self.names = [] # string table, new names are only appended so records copied raw stay valid
+        self.name_ids = {} # username -> index in names
+
+    @staticmethod
+    def column(typecode, values):
+        col = array(typecode, values)
+        if sys.byteorder == "big":
+            col.byteswap()
+        return col.tobytes()
+
+    # read n values of a column starting at pos, returns them and the position after them
+    def read_column(self, typecode, pos, n):
+        col = array(typecode)
+        end = pos + n * col.itemsize
+        col.frombytes(self.view[pos:end])
+        if sys.byteorder == "big":
+            col.byteswap()
+        return col, end
+
+    def name_id(self, name):
+        index = self.name_ids.get(name)
+        if index is None:
+            index = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def read(self, path):
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError: # no snapshot yet
+            return None
+        with f:
+            if os.name == "nt": # windows cannot replace a file that is still mapped
+                self.view = memoryview(f.read())
+            else:
+                self.view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        pos = len(self.MAGIC)
+        last_seq, next_post_id, name_count = struct.unpack_from("<qqI", self.view, pos)
+        lengths, pos = self.read_column("I", pos + 20, name_count)
+        for length in lengths:
+            self.name_id(str(self.view[pos:pos + length], "utf-8"))
+            pos += length
+        user_count, = struct.unpack_from("<I", self.view, pos)
+        name_index, pos = self.read_column("I", pos + 4, user_count)
+        post_counts, pos = self.read_column("I", pos, user_count)
+        offsets, pos = self.read_column("q", pos, user_count)
+        users = [(self.names[i], LazyRecord(pos + offset, count, self))
+                 for i, count, offset in zip(name_index, post_counts, offsets)]
+        return {"header": {"last_seq": last_seq, "next_post_id": next_post_id}, "users": users}
+
+    # raw is the file offset of the record, gives back the same record the json line format holds
+    def decode(self, raw):
+        view = self.view
+        pos = raw + 4
+        length, = struct.unpack_from("<I", view, pos)
+        password = str(view[pos + 4:pos + 4 + length], "utf-8")
+        pos += 4 + length
+        count, = struct.unpack_from("<I", view, pos)
+        friends, pos = self.read_column("I", pos + 4, count)
+        count, = struct.unpack_from("<I", view, pos)
+        ids, pos = self.read_column("q", pos + 4, count)
+        epochs, pos = self.read_column("q", pos, count)
+        lengths, pos = self.read_column("I", pos, count)
+        end = pos + sum(lengths)
+        text = str(view[pos:end], "utf-8") # one decode for every content of the user
+        posts = []
+        if len(text) == end - pos: # plain ascii, byte lengths are character lengths
+            at = 0
+            for post_id, epoch, length in zip(ids, epochs, lengths):
+                posts.append([post_id, epoch, text[at:at + length]])
+                at += length
+        else:
+            for post_id, epoch, length in zip(ids, epochs, lengths):
+                posts.append([post_id, epoch, str(view[pos:pos + length], "utf-8")])
+                pos += length
+        pos = end
+        count, = struct.unpack_from("<I", view, pos)
+        senders, pos = self.read_column("I", pos + 4, count)
+        receivers, pos = self.read_column("I", pos, count)
+        epochs, pos = self.read_column("q", pos, count)
+        names = self.names
+        record = {"password": password,
+                  "friends": [names[i] for i in friends],
+                  "posts": posts,
+                  "friend_requests": [[names[s], names[r], e] for s, r, e in zip(senders, receivers, epochs)]}
+        if view[pos]:
+            next_seq, read_seq, count = struct.unpack_from("<qqI", view, pos + 1)
+            pos += 21
+            items = []
+            for _ in range(count):
+                seq, length = struct.unpack_from("<qI", view, pos)
+                items.append([seq, str(view[pos + 12:pos + 12 + length], "utf-8")])
+                pos += 12 + length
+            record["notifications"] = {"next_seq": next_seq, "read_seq": read_seq, "items": items}
+        return record
+
+    # one record in the layout described above, length prefix included
+    def encode(self, record):
+        column, name_id = self.column, self.name_id
+        password = record["password"].encode()
+        posts = record["posts"]
+        contents = [p[2].encode() for p in posts]
+        requests = record["friend_requests"]
+        parts = [struct.pack("<I", len(password)), password,
+                 struct.pack("<I", len(record["friends"])), column("I", [name_id(f) for f in record["friends"]]),
+                 struct.pack("<I", len(posts)), column("q", [p[0] for p in posts]), column("q", [p[1] for p in posts]),
+                 column("I", [len(c) for c in contents]), b"".join(contents),
+                 struct.pack("<I", len(requests)), column("I", [name_id(fr[0]) for fr in requests]),
+                 column("I", [name_id(fr[1]) for fr in requests]), column("q", [fr[2] for fr in requests])]
+        saved = record.get("notifications")
+        if saved:
+            parts.append(struct.pack("<BqqI", 1, saved["next_seq"], saved["read_seq"], len(saved["items"])))
+            for seq, message in saved["items"]:
+                message = message.encode()
+                parts += [struct.pack("<qI", seq, len(message)), message]
+        else:
+            parts.append(b"\0")
+        body = b"".join(parts)
+        return struct.pack("<I", len(body)) + body
+
+    def write(self, path, data):
+        records, name_index, post_counts, offsets = [], [], [], []
+        offset = 0
+        for username, post_count, record in data["users"]:
+            if record.__class__ is not LazyRecord:
+                raw = self.encode(record)
+            elif record.storage is self: # unchanged since it was read, copy it straight from the map
+                length, = struct.unpack_from("<I", self.view, record.raw)
+                raw = self.view[record.raw:record.raw + 4 + length]
+            else:
+                raw = self.encode(record.storage.decode(record.raw))
+            records.append(raw)
+            name_index.append(self.name_id(username))
+            post_counts.append(post_count)
+            offsets.append(offset)
+            offset += len(raw)
+        names = [name.encode() for name in self.names]
+        header = data["header"]
+        with open(path, "wb") as f:
+            f.write(self.MAGIC + struct.pack("<qqI", header["last_seq"], header["next_post_id"], len(names)))
+            f.write(self.column("I", [len(name) for name in names]))
+            f.write(b"".join(names))
+            f.write(struct.pack("<I", len(records)))
+            for typecode, values in (("I", name_index), ("I", post_counts), ("q", offsets)):
+                f.write(self.column(typecode, values))
+            f.writelines(records)
+            f.flush()
+            os.fsync(f.fileno())
+
+# call counts and timings per operation, a sampling profiler, and the numbers behind a metrics snapshot
+# timers are only wrapped around methods while enabled, so an app that never turns them on pays nothing
+class Metrics:
+    BUCKETS = 32 # latency histogram, bucket i counts calls that took less than 2**i microseconds
+
+    def __init__(self):
+        self.enabled = False
+        self.ops = {} # name -> [calls, total ns, max ns, failed calls, histogram]
+        self.samples = {} # profiler: "outer;...;inner" function stack -> times seen
+        self.profiling = False
+        self.profiler = None
+
+    def record(self, name, ns, failed=False):
+        op = self.ops.get(name)
+        if op is None:
+            op = self.ops[name] = [0, 0, 0, 0, [0] * self.BUCKETS]
+        op[0] += 1
+        op[1] += ns
+        if ns > op[2]:
+            op[2] = ns
+        if failed:
+            op[3] += 1
+        op[4][min(self.BUCKETS - 1, (ns // 1000).bit_length())] += 1
+
+    # function wrapped so every call is recorded under name
+    def timed(self, name, function):
+        clock = time.perf_counter_ns
+        def timed_call(*args, **kwargs):
+            start = clock()
+            failed = True
+            try:
+                result = function(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.record(name, clock() - start, failed)
+        return timed_call
+
+    def reset(self):
+        self.ops = {}
+        self.samples = {}
+
+    # upper bound in microseconds of the histogram bucket holding quantile q
+    @staticmethod
+    def quantile(histogram, calls, q):
+        seen = 0
+        for i, count in enumerate(histogram):
+            seen += count
+            if seen >= q * calls:
+                return 2 ** i
+        return 2 ** (len(histogram) - 1)
+
+    def snapshot(self):
+        ops = {}
+        for name, (calls, total, longest, failed, histogram) in sorted(self.ops.items()):
+            ops[name] = {"calls": calls, "failed": failed, "total_ms": total / 1e6, "mean_us": total / calls / 1000,
+                         "max_us": longest / 1000, "p50_us_under": self.quantile(histogram, calls, 0.5),
+                         "p99_us_under": self.quantile(histogram, calls, 0.99)}
+        return ops
+
+    # sample the stack of a thread (the main thread by default) every interval seconds until stop_profiler
+    def start_profiler(self, interval=0.005, thread=None):
+        if self.profiling:
+            return
+        target = (thread or threading.main_thread()).ident
+        self.profiling = True
+        def sample():
+            while self.profiling:
+                frame = sys._current_frames().get(target)
+                stack = []
+                while frame is not None:
+                    stack.append(getattr(frame.f_code, "co_qualname", frame.f_code.co_name))
+                    frame = frame.f_back
+                if stack:
+                    key = ";".join(reversed(stack))
+                    self.samples[key] = self.samples.get(key, 0) + 1
+                time.sleep(interval)
+        self.profiler = threading.Thread(target=sample, name="profiler", daemon=True)
+        self.profiler.start()
+
+    # stops sampling and returns the functions seen most, by samples spent in them (self) and under them (total)
+    # "stacks" is in the collapsed format flame graph tools read
+    def stop_profiler(self, limit=20):
+        self.profiling = False
+        if self.profiler is not None:
+            self.profiler.join()
+            self.profiler = None
+        own, total = {}, {}
+        for stack, count in list(self.samples.items()):
+            functions = stack.split(";")
+            own[functions[-1]] = own.get(functions[-1], 0) + count
+            for function in set(functions):
+                total[function] = total.get(function, 0) + count
+        return {"samples": sum(own.values()),
+                "self": Sorter.top_k(own.items(), limit, key=lambda item: item[1]),
+                "total": Sorter.top_k(total.items(), limit, key=lambda item: item[1]),
+                "stacks": dict(self.samples)}
+
+# one time bucket of Analytics: event counts plus a sketch and a heavy hitter summary per kind of item
+class AnalyticsBucket:
+    __slots__ = ("start", "counts", "sketches", "heavy")
+    def __init__(self, start, width, depth, capacity):
+        self.start = start # epoch seconds the bucket begins at
+        self.counts = dict.fromkeys(Analytics.SERIES, 0)
+        self.sketches = {kind: CountMinSketch(width, depth) for kind in Analytics.KINDS}
+        self.heavy = {kind: SpaceSaving(capacity) for kind in Analytics.KINDS}
+
+# live aggregates over sliding windows, updated as mutations are committed instead of rescanning posts
+# events are counted in minute buckets for the last hour, a minute leaving that hour is folded into its hour
+# bucket, and hour buckets are kept for two days; the words, hashtags and authors of posts go into a
+# Count-Min sketch and a Space-Saving summary of each bucket, so memory stays bounded however busy the app is
+# and a window query only reads the buckets it covers
+class Analytics:
+    SERIES = ("posts", "deleted_posts", "friend_requests", "accepted", "declined")
+    KINDS = ("words", "hashtags", "posters")
+    HASHTAG = re.compile(r"#(\w+)")
+
+    def __init__(self, minutes=60, hours=48, width=512, depth=4, capacity=64):
+        self.minutes = minutes # minute buckets kept
+        self.hours = hours # hour buckets kept
+        self.minute_buckets = {} # start epoch -> AnalyticsBucket
+        self.hour_buckets = {}
+        self.latest = 0 # start of the newest minute bucket
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+
+    @staticmethod
+    def now():
+        return Epoch.from_datetime(datetime.now())
+
+    def new_bucket(self, start):
+        return AnalyticsBucket(start, self.width, self.depth, self.capacity)
+
+    # the bucket an event at epoch is counted in, made if create and the epoch is recent enough to be kept
+    def bucket(self, epoch, create):
+        start = epoch - epoch % 60
+        bucket = self.minute_buckets.get(start)
+        if bucket is not None:
+            return bucket
+        if start > self.latest - 60 * self.minutes: # newer than the oldest minute kept
+            if not create:
+                return None
+            bucket = self.minute_buckets[start] = self.new_bucket(start)
+            if start > self.latest:
+                self.latest = start
+                for old in sorted(s for s in self.minute_buckets if s <= start - 60 * self.minutes):
+                    self.fold(self.minute_buckets.pop(old))
+                for old in [s for s in self.hour_buckets if s <= start - 3600 * self.hours]:
+                    del self.hour_buckets[old]
+            return bucket
+        hour = epoch - epoch % 3600
+        bucket = self.hour_buckets.get(hour)
+        if bucket is None and create and hour > self.latest - 3600 * self.hours:
+            bucket = self.hour_buckets[hour] = self.new_bucket(hour)
+        return bucket
+
+    # add a minute bucket that left the last hour to its hour bucket
+    def fold(self, minute):
+        hour = minute.start - minute.start % 3600
+        bucket = self.hour_buckets.get(hour)
+        if bucket is None:
+            bucket = self.hour_buckets[hour] = self.new_bucket(hour)
+        for series, count in minute.counts.items():
+            bucket.counts[series] += count
+        for kind in self.KINDS:
+            counts, added = bucket.sketches[kind].counts, minute.sketches[kind].counts
+            for cell, count in enumerate(added):
+                if count:
+                    counts[cell] += count
+            bucket.sketches[kind].total += minute.sketches[kind].total
+            heavy = bucket.heavy[kind]
+            for item, count in minute.heavy[kind].counts.items():
+                heavy.add(item, count)
+
+    # count an event of series at epoch, a post also counts its author, words and hashtags
+    # weight -1 takes an event back from the bucket it went into, if that is still kept
+    def add(self, series, epoch, author=None, content=None, weight=1):
+        bucket = self.bucket(epoch, weight > 0)
+        if bucket is None:
+            return
+        bucket.counts[series] += weight
+        if content is None:
+            return
+        hashtags = set(self.HASHTAG.findall(content.lower()))
+        words = set(InvertedIndex.tokenize(self.HASHTAG.sub(" ", content)))
+        for kind, items in (("posters", (author,)), ("words", words), ("hashtags", hashtags)):
+            sketch, heavy = bucket.sketches[kind], bucket.heavy[kind]
+            for item in items:
+                sketch.add(item, weight)
+                if weight > 0:
+                    heavy.add(item, weight)
+                else:
+                    heavy.remove(item, -weight)
+
+    # the buckets of the last minutes, the one now falls in included: minute buckets if the window fits in
+    # them, otherwise the hour buckets it reaches plus every minute bucket, so windows round up to whole buckets
+    def window(self, minutes, now=None):
+        now = self.now() if now is None else now
+        seconds = 60 if minutes <= self.minutes else 3600
+        end = now - now % seconds # start of the bucket now is in
+        first = end - (minutes * 60 - 1) // seconds * seconds
+        buckets = [bucket for start, bucket in sorted(self.minute_buckets.items()) if first <= start <= now]
+        if seconds == 3600:
+            buckets = [bucket for start, bucket in sorted(self.hour_buckets.items()) if first <= start <= end] + buckets
+        return buckets
+
+    # events of every series in the last minutes
+    def totals(self, minutes=60, now=None):
+        totals = dict.fromkeys(self.SERIES, 0)
+        for bucket in self.window(minutes, now):
+            for series, count in bucket.counts.items():
+                totals[series] += count
+        return totals
+
+    # (bucket start, events) for every minute (or hour, beyond the minutes kept) of the window, quiet ones as 0
+    def timeline(self, series, minutes=60, now=None):
+        now = self.now() if now is None else now
+        seconds = 60 if minutes <= self.minutes else 3600
+        counts = {}
+        for bucket in self.window(minutes, now):
+            start = bucket.start - bucket.start % seconds
+            counts[start] = counts.get(start, 0) + bucket.counts[series]
+        end = now - now % seconds
+        first = end - (minutes * 60 - 1) // seconds * seconds
+        return [(start, counts.get(start, 0)) for start in range(first, end + 1, seconds)]
+
+    # the heaviest items of the buckets by their Space-Saving counts added up, with the count the
+    # sketches estimate for the whole window, costs buckets * capacity however many items there are
+    def candidates(self, kind, buckets):
+        summed = {}
+        for bucket in buckets:
+            for item, count in bucket.heavy[kind].counts.items():
+                summed[item] = summed.get(item, 0) + count
+        sketches = [bucket.sketches[kind] for bucket in buckets]
+        if not sketches:
+            return {}
+        items = heapq.nlargest(self.capacity, summed, key=summed.get)
+        return {item: CountMinSketch.estimate_sum(sketches, sketches[0].cells(item)) for item in items}
+
+    # the k words, hashtags or posters seen most in the last minutes, as (item, estimated count)
+    def top(self, kind, minutes=60, k=10, now=None):
+        counts = self.candidates(kind, self.window(minutes, now))
+        return Sorter.top_k([(item, count) for item, count in counts.items() if count > 0], k, key=lambda item: item[1])
+
+    # the k items most above their usual rate, comparing the last minutes with everything kept
+    # as (item, count in the window, count divided by the count the usual rate predicts plus one)
+    def trending(self, kind, minutes=15, k=10, now=None):
+        now = self.now() if now is None else now
+        counts = self.candidates(kind, self.window(minutes, now))
+        history = list(self.hour_buckets.values()) + list(self.minute_buckets.values())
+        if not history:
+            return []
+        span = (now - min(bucket.start for bucket in history)) / 60 or 1 # minutes the history covers
+        sketches = [bucket.sketches[kind] for bucket in history]
+        scored = []
+        for item, count in counts.items():
+            if count > 0:
+                expected = CountMinSketch.estimate_sum(sketches, sketches[0].cells(item)) * min(minutes, span) / span
+                scored.append((item, count, round(count / (expected + 1), 3)))
+        return Sorter.top_k(scored, k, key=lambda item: item[2])
+
+    # longest window the kept buckets cover
+    def max_minutes(self):
+        return 60 * self.hours
+
+    # everything a dashboard shows, as json, minutes is brought into 1 .. max_minutes()
+    def snapshot(self, minutes=60, k=10, now=None):
+        now = self.now() if now is None else now
+        minutes = max(1, min(minutes, self.max_minutes()))
+        totals = self.totals(minutes, now)
+        return {"minutes": minutes, "totals": totals,
+                "per_minute": {series: count / minutes for series, count in totals.items()},
+                "timeline": {series: self.timeline(series, minutes, now) for series in self.SERIES},
+                "top": {kind: self.top(kind, minutes, k, now) for kind in self.KINDS},
+                "trending": {kind: self.trending(kind, min(minutes, 15), k, now) for kind in self.KINDS}}
+
+# mutations run one at a time under the app's write_lock, reads never take it
+def writer(method):
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.write_lock:
+            return method(self, *args, **kwargs)
+    return locked
+
+# raised when a batch is undone, index is the op that failed if there is one
+class BatchError(Exception):
+    def __init__(self, message, index=None):
+        super().__init__(message)
+        self.index = index
+
+# context manager returned by SocialMediaApp.batch()
+class Batch:
+    def __init__(self, app):
+        self.app = app
+
+    def __enter__(self):
+        self.app.begin_batch()
+        return self.app
+
+    def __exit__(self, kind, error, traceback):
+        self.app.end_batch(error is None)
+        return False # the error, if any, carries on
 
 #Main Social Media App Logic System
 class SocialMediaApp:
-    def __init__(self):
-        self.users = HashTable() # Users stored in hash table
-        self.posts = [] # all posts across all users
-        self.notification_queue = Queue() # Queue for notifications
+    def __init__(self, db_path="database.json", compact_every=500, inbox_limit=500, fanout_limit=1000, compact=False,
+                 notification_limit=100, background_writes=True, storage=None, metrics=False, analytics=False):
+        self.db_path = db_path # snapshot file
+        self.storage = storage or self.detect_storage(db_path) # snapshot format, JsonLinesStorage or BinaryStorage
+        self.wal = WriteAheadLog(os.path.splitext(db_path)[0] + ".log") # mutations since the snapshot
+        self.compact_every = compact_every # log records before they are folded into a new snapshot
+        self.inbox_limit = inbox_limit # posts kept in each home timeline
+        self.fanout_limit = fanout_limit # authors with more friends are merged in on read instead of pushed
+        self.arena = StringArena() if compact else None # compact mode keeps post contents in one shared buffer
+        self.notification_limit = notification_limit # notifications kept per user
+        self.batch_records = None # mutations of the open batch, None outside a batch
+        self.batch_undo = None # what each of them changed, see undo_info
+        self.batch_depth = 0 # nested batches join the outermost one
+        self.batch_failed = False # an inner batch failed, the outermost one has to roll back
+        self.save_after_batch = False # save_data was called inside a batch, it runs once the batch is logged
+        self.batch_events = [] # analytics events of the open batch, counted once it went through
+        self.analytics = Analytics() if analytics else None # live windowed counts, only of mutations made from now on
+        self.write_lock = threading.RLock() # one writer at a time, readers work on immutable versions and never wait
+        self.snapshots = [] # UsersSnapshots possibly still being written, see capture
+        self.reset_state()
+        self.metrics = Metrics()
+        self.snapshot_stats = {"writes": 0, "bytes": 0, "seconds": 0.0, "max_seconds": 0.0}
+        if metrics:
+            self.enable_metrics()
         self.load_data() # Loads saved data if it only exists
+        self.worker = None # disk writes happen inline without a worker
+        if background_writes:
+            self.worker = PersistenceWorker(self.wal, self.write_snapshot)
+            atexit.register(self.close) # scripts that forget close() still get their last writes
 
-    # saves all users, posts, and requests to json file
+    # empty in memory data, load_data fills it
+    def reset_state(self):
+        self.seq = 0 # sequence number of the last applied mutation
+        self.log_records = 0 # mutations committed since the last snapshot
+        self.users = HashTable() # Users stored in hash table
+        self.posts = TimelineIndex() # all posts across all users, sorted by time
+        self.posts_by_id = {} # post id -> post
+        self.search_index = InvertedIndex() # words of every post plus one author term per post
+        self.next_post_id = 1
+        self.post_count = 0 # posts in total, including those of users not loaded yet
+        self.timeline_complete = True # false while users from the snapshot are still unparsed
+        self.users.loader = self.hydrate_user
+        self.users.lock = self.write_lock # building a user adds to the shared indexes, so it counts as a write
+        self.graph = SocialGraph() # friendships and pending friend requests
+        if self.arena is not None:
+            self.arena = StringArena()
+
+    STORAGES = {"lines": JsonLinesStorage, "binary": BinaryStorage}
+    # what the mutators answer when they went through
+    SUCCESS = {"User registered", "post has been uploaded", "post has been delete", "Friend Request sent",
+               "friend request accepted", "friend request has been declined"}
+    MUTATORS = ("register", "create_post", "delete_post", "delete_post_by_id", "send_friend_request",
+                "accept_friend_request", "decline_friend_request")
+    # public methods timed while metrics are enabled
+    TIMED = ("register", "login", "create_post", "get_notifications", "unread_notifications", "send_friend_request",
+             "accept_friend_request", "decline_friend_request", "mutual_friends", "degrees_of_separation",
+             "suggest_friends", "get_feed", "get_global_feed", "search_user_posts", "search_posts",
+             "search_post_by_timestamp", "search_posts_by_timestamp", "delete_post", "delete_post_by_id",
+             "save_data", "flush")
+
+    # time every public call from now on, the timed versions shadow the methods on this instance only
+    def enable_metrics(self):
+        self.metrics.enabled = True
+        for name in self.TIMED:
+            setattr(self, name, self.metrics.timed(name, getattr(type(self), name).__get__(self)))
+
+    def disable_metrics(self):
+        self.metrics.enabled = False
+        for name in self.TIMED:
+            self.__dict__.pop(name, None)
+
+    # everything the app knows about its own performance, json serialisable
+    def metrics_snapshot(self):
+        persistence = {"log": dict(self.wal.stats), "snapshots": dict(self.snapshot_stats),
+                       "log_records_since_snapshot": self.log_records,
+                       "queued_writes": len(self.worker.pending) if self.worker else 0}
+        return {"enabled": self.metrics.enabled, "ops": self.metrics.snapshot(), "users_table": self.users.stats(),
+                "persistence": persistence, "users": self.total_users(), "posts": self.post_count}
+
+    def export_metrics(self, path):
+        with open(path, "w") as f:
+            json.dump(self.metrics_snapshot(), f, indent=4)
+
+    # the format an existing snapshot was written in, new files get json lines
+    @staticmethod
+    def detect_storage(path):
+        try:
+            with open(path, "rb") as f:
+                magic = f.read(len(BinaryStorage.MAGIC))
+        except FileNotFoundError:
+            magic = b""
+        return BinaryStorage() if magic == BinaryStorage.MAGIC else JsonLinesStorage()
+
+    # rewrite the snapshot (and log) at src as dst in another format: "lines", "binary" or "json"
+    # any format can be read, "json" is the single indented document kept for import and export
+    @staticmethod
+    def convert(src, dst, fmt="binary"):
+        app = SocialMediaApp(src, background_writes=False)
+        try:
+            if fmt == "json":
+                app.export_json(dst)
+            else:
+                app.write_snapshot(app.snapshot_data(), dst, SocialMediaApp.STORAGES[fmt]())
+        finally:
+            app.close()
+
+    # writes a full snapshot of all users, posts, and requests to the snapshot file and empties the log
+    # with background writes only an O(1) snapshot is taken here, the worker reads it and writes it while the app
+    # carries on, call flush() to wait for it
+    # inside a batch it waits for the batch to end, a snapshot of its unlogged records under the seq before them
+    # would have them applied again on load and keep them after a rollback
+    @writer
     def save_data(self):
-        data = {"users":{},
-                "posts":[]}
-        for bucket in self.users.table:
-            current = bucket # (slots inside the table where data is stored)
-            while current:
-                user = current.value
-                data["users"][user.username]= {
-                    "password": user.password,
-                    "friends": user.friends,
-                    "posts": [
-                        {
-                            "content": p.content, # post variable 
-                            "timestamp": p.timestamp.strftime("%d-%m-%Y %H:%M:%S") 
-                        }
-                        for p in user.posts
-                    ],
-                    "friend_requests":[
-                        {
-                            "sender": fr.sender, # friendrequest variable
-                            "receiver": fr.receiver,
-                            "timestamp": fr.timestamp.strftime("%d-%m-%Y %H:%M:%S") # formats date and time to readable string
-                        }
-                        for fr in user.friend_requests
-                    ]
-                }
-                current = current.next
-        for p in self.posts:
-            data["posts"].append({
-                "author":p.author,
-                "content":p.content,
-                "timestamp":p.timestamp.strftime("%d-%m-%Y %H:%M:%S") 
-            })
-        with open("database.json","w") as f: # opens json file and writes in
-            json.dump(data, f, indent=4) 
-
-    # loads data from json file
+        if self.batch_depth:
+            self.save_after_batch = True
+            return
+        data = self.snapshot_data()
+        if self.worker:
+            self.worker.submit("snapshot", data)
+        else:
+            self.write_snapshot(data)
+            self.wal.reset()
+        self.log_records = 0
+
+    # everything needed to rebuild the app: a header and one (username, post count, record) per user
+    # the users are a UsersSnapshot of the table as it is now, read when the snapshot is written
+    def snapshot_data(self):
+        header = {"last_seq": self.seq, # log records up to here are already in this snapshot
+                  "next_post_id": self.next_post_id}
+        users = UsersSnapshot(self.users.snapshot(), self.user_record)
+        self.open_snapshots().append(users)
+        return {"header": header, "users": users}
+
+    # the saved form of a user as (post count, record)
+    def user_record(self, user):
+        posts = user.posts.snapshot()
+        record = {
+            "password": user.password,
+            "friends": sorted(user.friends),
+            "posts": [[p.id, p.epoch, p.content] for p in posts],
+            "friend_requests": [[fr.sender, fr.receiver, fr.epoch] for fr in user.friend_requests]
+        }
+        if user.notifications:
+            record["notifications"] = {
+                "next_seq": user.notifications.next_seq,
+                "read_seq": user.notifications.read_seq,
+                "items": user.notifications.since(0)
+            }
+        return len(posts), record
+
+    # snapshots that may still be walked, snapshots are written in order so once one is done every older one
+    # was written or skipped by the worker
+    def open_snapshots(self):
+        for index in range(len(self.snapshots) - 1, -1, -1):
+            if self.snapshots[index].done:
+                del self.snapshots[:index + 1]
+                break
+        return self.snapshots
+
+    # record is about to change the users it names, snapshots still being written keep them as they are now
+    def capture(self, record):
+        snapshots = self.open_snapshots()
+        if not snapshots:
+            return
+        for field in ("username", "author", "sender", "receiver"):
+            name = record.get(field)
+            user = self.users.get(name) if name is not None else None
+            if user is not None:
+                for snapshot in snapshots:
+                    snapshot.save(name, user)
+
+    # write a snapshot aside and rename it over the old one so a crash never leaves half a file
+    def write_snapshot(self, data, path=None, storage=None):
+        path = path or self.db_path
+        tmp_path = path + ".tmp"
+        start = time.perf_counter()
+        (storage or self.storage).write(tmp_path, data)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        self.sync_directory(path)
+        took = time.perf_counter() - start
+        self.snapshot_stats["writes"] += 1
+        self.snapshot_stats["bytes"] += size
+        self.snapshot_stats["seconds"] += took
+        self.snapshot_stats["max_seconds"] = max(self.snapshot_stats["max_seconds"], took)
+
+    # a rename is only durable once the directory holding it is, so this runs before the log is emptied
+    # windows cannot open a directory to fsync it
+    @staticmethod
+    def sync_directory(path):
+        if os.name == "nt":
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # loads the snapshot then replays the log on top of it
+    # users are only split out of the file here, each one is parsed on its first users.get
     def load_data(self):
+        snapshot = self.storage.read(self.db_path)
+        if snapshot is None: # no snapshot yet
+            pass
+        elif "document" in snapshot: # the single indented json document older versions wrote
+            self.load_json(snapshot["document"])
+        else:
+            self.load_lazy(snapshot["header"], snapshot["users"])
+
+        for record in self.wal.read():
+            if record["seq"] > self.seq: # skip records a snapshot already holds
+                self.apply_record(record)
+                self.seq = record["seq"]
+                self.log_records += 1
+
+    # take the users still unparsed, they are built by hydrate_user when first looked up
+    def load_lazy(self, header, lazy):
+        self.seq = header["last_seq"]
+        self.next_post_id = header["next_post_id"]
+        self.post_count += sum(record.post_count for name, record in lazy)
+        if lazy:
+            self.timeline_complete = False
+        self.users.insert_many(lazy) # sized once for every user instead of growing step by step
+
+    # write everything as one indented json document, the format load_json reads
+    def export_json(self, path):
+        users = {}
+        for username in [name for name, value in self.users.items()]:
+            user = self.users.get(username)
+            udata = {
+                "password": user.password,
+                "friends": sorted(user.friends),
+                "posts": [{"id": p.id, "content": p.content, "timestamp": p.timestamp.strftime(TIME_FORMAT)}
+                          for p in user.posts],
+                "friend_requests": [{"sender": fr.sender, "receiver": fr.receiver,
+                                     "timestamp": fr.timestamp.strftime(TIME_FORMAT)} for fr in user.friend_requests]
+            }
+            if user.notifications:
+                udata["notifications"] = {"next_seq": user.notifications.next_seq,
+                                          "read_seq": user.notifications.read_seq,
+                                          "items": user.notifications.since(0)}
+            users[username] = udata
+        with open(path, "w") as f:
+            json.dump({"last_seq": self.seq, "next_post_id": self.next_post_id, "users": users}, f, indent=4)
+
+    # load an old style snapshot where everything is in one json document
+    def load_json(self, data):
+        self.seq = data.get("last_seq", 0)
+        self.next_post_id = data.get("next_post_id", 1)
+        loaded = {}
+        loaded_posts = []
+        for username, udata in data["users"].items():
+            loaded[username], posts = self.build_user(username, udata)
+            loaded_posts += posts
+        self.users.insert_many(loaded.items())
+        self.post_count += len(loaded_posts)
+        # files saved before posts had ids get them in time order so a bigger id always means a newer post
+        for post in Sorter.merge_sort([p for p in loaded_posts if not p.id], key=lambda p: p.epoch):
+            post.id = self.next_post_id
+            self.next_post_id += 1
+        # oldest first so every index insert is an append
+        for post in Sorter.merge_sort(loaded_posts, key=TimelineIndex.key):
+            loaded[post.author].add_post(post)
+            self.index_post(post)
+
+    # build a user from its saved record, returns the user and its posts (not added anywhere yet)
+    def build_user(self, username, udata):
+        user = User(username,udata["password"]) 
+        user.friends = frozenset(udata["friends"])
+        self.graph.add_user(user)
+
+        posts = []
+        for p in udata["posts"]:
+            if isinstance(p, list): # [id, epoch, content]
+                post = Post.from_epoch(username, p[2], p[1], p[0], self.arena)
+            else: # older files store dicts with formatted timestamps
+                post = Post(username,p["content"], datetime.strptime(p["timestamp"], TIME_FORMAT), p.get("id", 0), self.arena)
+            self.next_post_id = max(self.next_post_id, post.id + 1)
+            posts.append(post)
+        
+        for fr in udata["friend_requests"]:
+            if isinstance(fr, list): # [sender, receiver, epoch]
+                req = FriendRequest.from_epoch(fr[0], fr[1], fr[2])
+            else:
+                req = FriendRequest(fr["sender"], fr["receiver"], datetime.strptime(fr["timestamp"], TIME_FORMAT))
+            if self.graph.has_request(req.sender, req.receiver):
+                continue # older files could hold the same request several times
+            user.add_request(req)
+            self.graph.add_request(req)
+
+        if "notifications" in udata:
+            saved = udata["notifications"]
+            user.notifications = NotificationInbox(self.notification_limit)
+            user.notifications.next_seq = user.notifications.first_seq = saved["next_seq"] - len(saved["items"])
+            for seq, message in saved["items"]:
+                user.notifications.push(message)
+            user.notifications.read_seq = saved["read_seq"]
+        return user, posts
+
+    # HashTable loader, parses a user the first time they are looked up
+    # the global timeline is left alone, it is rebuilt once by load_everything
+    def hydrate_user(self, username, lazy):
+        return self.build_lazy([(username, lazy)])[0]
+
+    # users from (username, LazyRecord) pairs, their posts go into the search index together
+    def build_lazy(self, lazy):
+        users = []
+        for username, record in lazy:
+            user, posts = self.build_user(username, record.storage.decode(record.raw))
+            for post in posts: # saved oldest first so these are appends
+                user.add_post(post)
+                self.posts_by_id[post.id] = post
+            users.append(user)
+        self.search_index.add_many([(post.id, self.post_terms(post)) for user in users for post in user.posts])
+        return users
+
+    # parse every user still waiting and build the global timeline, for queries over the whole system
+    def load_everything(self):
+        if self.timeline_complete:
+            return
+        with self.write_lock:
+            if self.timeline_complete: # another reader got here first
+                return
+            lazy = [(name, value) for name, value in self.users.items() if value.__class__ is LazyRecord]
+            for user in self.build_lazy(lazy): # all at once, so every postings list is rebuilt once
+                self.users.find_node(user.username).value = user # the same swap users.get makes
+            posts = [post for user in self.users.values() for post in user.posts]
+            self.posts = TimelineIndex.from_sorted(Sorter.merge_sort(posts, key=TimelineIndex.key))
+            self.timeline_complete = True
+
+    # logs a mutation, applies it in memory and compacts the log when it gets long
+    # inside a batch it is only applied, the batch is logged as a whole when it ends
+    def commit(self, record):
+        if self.snapshots:
+            self.capture(record)
+        if self.analytics is not None:
+            self.observe(record)
+        if self.batch_records is not None:
+            self.batch_undo.append(self.undo_info(record))
+            self.apply_record(record)
+            self.batch_records.append(record)
+            return
+        self.log_record(record)
+        self.apply_record(record)
+        self.compact_if_due()
+
+    def log_record(self, record):
+        self.seq += 1
+        record["seq"] = self.seq
+        if self.worker:
+            self.worker.submit("record", record)
+        else:
+            self.wal.append(record)
+        self.log_records += 1
+
+    def compact_if_due(self):
+        if self.log_records >= self.compact_every:
+            self.save_data()
+
+    # with app.batch(): ... groups every mutation made in the block, each is checked and applied as it is made
+    # so later ones see earlier ones, and they reach the disk together in one write when the block ends
+    # an exception in the block undoes all of them, nested batches are part of the outermost one
+    def batch(self):
+        return Batch(self)
+
+    def begin_batch(self):
+        self.write_lock.acquire() # the whole batch is one write, released by end_batch
+        if self.batch_depth == 0:
+            self.batch_records = []
+            self.batch_undo = []
+            self.batch_events = []
+            self.batch_failed = False
+        self.batch_depth += 1
+
+    def end_batch(self, ok):
         try:
-            with open("database.json", "r") as f: # f is file
-                data = json.load(f) # loads all data from the file
-        except (FileNotFoundError, json.JSONDecodeError): # shows errors up if file not there
-            return #no data found
+            self.batch_depth -= 1
+            if not ok:
+                self.batch_failed = True
+            if self.batch_depth:
+                return
+            records, self.batch_records = self.batch_records, None
+            undo, self.batch_undo = self.batch_undo, None
+            save, self.save_after_batch = self.save_after_batch, False
+            if self.batch_failed:
+                self.rollback(records, undo)
+                if ok: # the block itself finished, so the failure was swallowed inside it
+                    raise BatchError("an inner batch failed, the whole batch was undone")
+                return
+            self.count_batch_events()
+            if save or len(records) >= self.compact_every: # a snapshot holds them all and is cheaper than a huge log line
+                self.save_data()
+            elif records:
+                self.log_record({"op": "batch", "records": records}) # one line, so a crash keeps all or none
+                self.compact_if_due()
+        finally:
+            self.write_lock.release()
+
+    def count_batch_events(self):
+        for event in self.batch_events:
+            self.analytics.add(*event)
+        self.batch_events = []
+
+    # take back the records of a failed batch newest first, nothing the batch did not touch is looked at
+    # the disk never saw them, so only the in memory data changes
+    def rollback(self, records, undo):
+        for record, info in zip(reversed(records), reversed(undo)):
+            self.undo_record(record, info)
+        self.batch_events = []
+
+    # what record is about to change, taken before it is applied inside a batch: the state of the users it names,
+    # the next post id and the post it deletes
+    def undo_info(self, record):
+        users = []
+        for field in ("username", "author", "sender", "receiver"):
+            user = self.users.get(record[field]) if field in record else None
+            if user is not None:
+                inbox = user.notifications
+                users.append((user, user.friends, user.friend_requests, inbox, inbox.mark() if inbox else None))
+        return users, self.next_post_id, self.posts_by_id.get(record.get("id"))
+
+    # the opposite of apply_record, for a record applied in a batch that failed
+    def undo_record(self, record, info):
+        users, next_post_id, deleted = info
+        op = record["op"]
+        if op == "register":
+            self.users.delete(record["username"])
+            del self.graph.adjacency[record["username"]]
+        elif op == "post":
+            post = self.posts_by_id[record["id"]]
+            author = self.users.get(post.author)
+            author.posts.remove(post)
+            self.unindex_post(post)
+            self.post_count -= 1
+            self.next_post_id = next_post_id
+            self.drop_inboxes(author)
+        elif op == "delete_post":
+            user = self.users.get(deleted.author)
+            user.posts.add(deleted)
+            self.index_post(deleted)
+            self.post_count += 1
+            self.drop_inboxes(user)
+        for user, friends, requests, inbox, mark in users: # friendships, requests and notifications
+            for fr in user.friend_requests:
+                self.graph.pop_request(fr.sender, user.username)
+            user.friend_requests = requests
+            for fr in requests:
+                self.graph.add_request(fr)
+            user.friends = self.graph.adjacency[user.username] = friends
+            user.notifications = inbox
+            if inbox is not None:
+                inbox.restore(mark)
+
+    # run many mutations as one batch, ops are (method name, arguments...) like ("register", "ann", "pw")
+    # every op has to succeed, the first that does not undoes the batch and raises BatchError
+    # returns the answer of every op
+    def apply_batch(self, ops):
+        answers = []
+        with self.batch():
+            for index, (name, *args) in enumerate(ops):
+                if name not in self.MUTATORS:
+                    raise BatchError(f"op {index}: {name} is not a mutation", index)
+                answer = getattr(self, name)(*args)
+                if answer not in self.SUCCESS:
+                    raise BatchError(f"op {index}: {name} failed: {answer}", index)
+                answers.append(answer)
+        return answers
+
+    # applies one already validated mutation to the in memory data, used live and on replay
+    def apply_record(self, record):
+        op = record["op"]
+        if op == "register":
+            user = User(record["username"], record["password"])
+            self.users.insert(user.username, user)
+            self.graph.add_user(user)
+        elif op == "post":
+            post = Post(record["author"], record["content"], datetime.strptime(record["timestamp"], TIME_FORMAT),
+                        record.get("id", self.next_post_id), self.arena) # older log records have no id
+            self.next_post_id = max(self.next_post_id, post.id + 1)
+            author = self.users.get(record["author"])
+            author.add_post(post)
+            self.index_post(post)
+            self.post_count += 1
+            self.fan_out(author, post)
+        elif op == "delete_post":
+            user = self.users.get(record["username"])
+            if "id" in record:
+                post = self.posts_by_id[record["id"]]
+            else: # older log records point at the position in the users posts
+                post = user.posts[record["index"]]
+            user.posts.remove(post)
+            self.unindex_post(post)
+            self.post_count -= 1
+            for inbox in self.built_inboxes(user):
+                inbox.remove(post)
+        elif op == "friend_request":
+            fr = FriendRequest(record["sender"], record["receiver"], datetime.strptime(record["timestamp"], TIME_FORMAT))
+            self.users.get(record["receiver"]).add_request(fr)
+            self.graph.add_request(fr)
+            self.notify(record["receiver"], f"{record['sender']} sent a friend request to {record['receiver']}")
+        elif op == "accept":
+            user = self.users.get(record["receiver"])
+            user.remove_request(self.graph.pop_request(record["sender"], record["receiver"]))
+            sender = self.users.get(record["sender"])
+            self.graph.befriend(user, sender.username)
+            self.graph.befriend(sender, user.username)
+            user.inbox = sender.inbox = None # rebuilt with the new friend's posts on next read
+            self.notify(sender.username, f"{user.username} accepted {sender.username}'s friend request")
+        elif op == "decline":
+            user = self.users.get(record["receiver"]) # loaded first, so their requests are in the graph
+            user.remove_request(self.graph.pop_request(record["sender"], record["receiver"]))
+            self.notify(record["sender"], f"{record['receiver']} declined {record['sender']}'s friend request")
+        elif op == "read_notifications":
+            self.users.get(record["username"]).notifications.mark_read(record["read"])
+        elif op == "batch":
+            for inner in record["records"]:
+                self.apply_record(inner)
+
+    # hand a mutation to the analytics before it is applied, while a deleted post can still be looked up
+    # inside a batch the events wait for it to go through
+    def observe(self, record):
+        op = record["op"]
+        if op == "post":
+            events = [("posts", Epoch.from_datetime(datetime.strptime(record["timestamp"], TIME_FORMAT)),
+                       record["author"], record["content"])]
+        elif op == "delete_post":
+            post = self.find_post(record["id"])
+            events = [("posts", post.epoch, post.author, post.content, -1), ("deleted_posts", Analytics.now())]
+        elif op == "friend_request":
+            events = [("friend_requests", Epoch.from_datetime(datetime.strptime(record["timestamp"], TIME_FORMAT)))]
+        elif op in ("accept", "decline"):
+            events = [({"accept": "accepted", "decline": "declined"}[op], Analytics.now())]
+        else:
+            return
+        if self.batch_depth:
+            self.batch_events += events
+        else:
+            for event in events:
+                self.analytics.add(*event)
+
+    def find_post(self, post_id):
+        return self.posts_by_id.get(post_id)
+
+    # add a notification to a users inbox, notifications come from applied records so the log replays them too
+    def notify(self, username, message):
+        user = self.users.get(username)
+        if user.notifications is None:
+            user.notifications = NotificationInbox(self.notification_limit)
+        user.notifications.push(message)
+
+    # words of a post for the search index, the author term cannot come out of tokenize
+    @staticmethod
+    def post_terms(post):
+        return InvertedIndex.tokenize(post.content) + ["@" + post.author]
+
+    # add a post to the global lookups
+    def index_post(self, post):
+        if self.timeline_complete: # otherwise load_everything picks it up from the users posts
+            self.posts.add(post)
+        self.posts_by_id[post.id] = post
+        self.search_index.add(post.id, self.post_terms(post))
+
+    def unindex_post(self, post):
+        self.posts.remove(post)
+        del self.posts_by_id[post.id]
+        self.search_index.remove(post.id, self.post_terms(post))
+
+    # the user followed by every friend
+    def timeline_members(self, user):
+        return [user] + [self.users.get(name) for name in user.friends]
+
+    # authors with this many friends are too expensive to push to, their posts are merged on read
+    def is_heavy(self, user):
+        return len(user.friends) > self.fanout_limit
+
+    # home timelines already built among the user and their friends
+    # friends not parsed yet cannot have one, so they are only peeked at and stay unparsed
+    def built_inboxes(self, user):
+        members = [user] + [self.users.peek(name) for name in user.friends]
+        return [u.inbox for u in members if u.__class__ is User and u.inbox is not None]
+
+    # forget the home timelines built for the user and their friends, they are made again on their next read
+    # for a post taken back, a trimmed home timeline may no longer hold a post the taken back one pushed out
+    def drop_inboxes(self, user):
+        for member in [user] + [self.users.peek(name) for name in user.friends]:
+            if member.__class__ is User:
+                member.inbox = None
+
+    # push a new post into the home timelines already built for the author and their friends
+    def fan_out(self, author, post):
+        if self.is_heavy(author): # their friends merge their posts in on read
+            inboxes = [author.inbox] if author.inbox is not None else []
+        else:
+            inboxes = self.built_inboxes(author)
+        for inbox in inboxes:
+            inbox.add(post)
+            inbox.trim(self.inbox_limit)
+
+    # the home timeline of a user, built by merging own and pushed friends posts the first time it is read
+    # built under the write lock so no post is pushed while it is half made, and published whole
+    def home_timeline(self, user):
+        if user.inbox is None:
+            with self.write_lock:
+                if user.inbox is None:
+                    members = [u for u in self.timeline_members(user) if u is user or not self.is_heavy(u)]
+                    streams = [u.posts.iter_newest() for u in members]
+                    inbox = TimelineIndex.from_sorted(TimelineIndex.merge_newest(streams, self.inbox_limit + 1)[::-1])
+                    inbox.trim(self.inbox_limit)
+                    user.inbox = inbox
+        return user.inbox
+
+    # closes the log file
+    # wait until every mutation so far is on disk
+    def flush(self):
+        if self.worker:
+            self.worker.flush()
+
+    # writes out everything still pending and closes the log file, safe to call twice
+    def close(self):
+        if self.worker:
+            self.worker.stop()
+            self.worker = None
+            atexit.unregister(self.close)
+        self.wal.close()
+
+    # register a new user            
+    @writer
+    def register(self, username, password):
+        if self.users.get(username):
+            return "Username already taken"
+        self.commit({"op": "register", "username": username, "password": password})
+        return "User registered"
+    #login check
+    def login(self,username,password):
+        user = self.users.get(username)
+        if user and user.password == password:
+            return "Log in succesful"
+        return "Invalid Information"
+    #create a post
+    @writer
+    def create_post(self,username,content):
+        user = self.users.get(username)
+        if not user:
+            return "user not found"
+        self.commit({"op": "post", "author": username, "content": content, "id": self.next_post_id,
+                     "timestamp": datetime.now().strftime(TIME_FORMAT)})
+        return "post has been uploaded"
+    # get a users notifications as (seq, message) oldest first
+    # without since the unread ones are returned and marked read, with since everything newer than that seq
+    @writer
+    def get_notifications(self, username, since=None, limit=None):
+        user = self.users.get(username)
+        if not user or user.notifications is None:
+            return []
+        notifications = user.notifications.since(since, limit)
+        if since is None and notifications:
+            self.commit({"op": "read_notifications", "username": username, "read": notifications[-1][0]})
+        return notifications
+    # number of notifications the user has not read yet
+    def unread_notifications(self, username):
+        user = self.users.get(username)
+        if not user or user.notifications is None:
+            return 0
+        return user.notifications.unread()
+    #send friend request to another user
+    @writer
+    def send_friend_request(self,sender,receiver):
+        sender_user = self.users.get(sender)
+        receiver_user = self.users.get(receiver)
+
+        if not sender_user or not receiver_user:
+            return "User not found"
+        if sender == receiver:
+            return "You cannot add yourself"
+        if self.graph.are_friends(sender, receiver):
+            return "Already friends"
+        if self.graph.has_request(sender, receiver):
+            return "Friend request already sent"
+        if self.graph.has_request(receiver, sender):
+            return f"{receiver} already sent you a friend request"
         
-        for username, udata in data["users"].items():
-            user = User(username,udata["password"]) 
-            user.friends = udata["friends"]
+        self.commit({"op": "friend_request", "sender": sender, "receiver": receiver,
+                     "timestamp": datetime.now().strftime(TIME_FORMAT)})
+        return "Friend Request sent"
+    #accept friend request
+    @writer
+    def accept_friend_request(self, receiver, sender):
+        user = self.users.get(receiver)
+        if not user:
+            return "user not been found"
+        if self.graph.has_request(sender, receiver):
+            self.commit({"op": "accept", "receiver": receiver, "sender": sender})
+            return "friend request accepted"
+            
+        return "friend request not found"
+    #decline a driend request
+    @writer
+    def decline_friend_request(self,receiver,sender):
+        user = self.users.get(receiver)
+        if not user:
+            return "user not been found"
+        
+        if self.graph.has_request(sender, receiver):
+            self.commit({"op": "decline", "receiver": receiver, "sender": sender})
+            return "friend request has been declined"
+        return "friend request not found"
+    # friends two users have in common
+    def mutual_friends(self, username, other):
+        if not self.users.get(username) or not self.users.get(other):
+            return []
+        return sorted(self.graph.mutual_friends(username, other))
+    # fewest friendship hops between two users, -1 if they are not connected
+    def degrees_of_separation(self, username, other):
+        self.load_everything()
+        return self.graph.degrees_of_separation(username, other)
+    # people you may know, as (username, mutual friends) best first
+    def suggest_friends(self, username, limit=10):
+        user = self.users.get(username)
+        if not user:
+            return []
+        for friend in self.timeline_members(user)[1:]: # load everyone two hops away
+            for name in friend.friends:
+                self.users.get(name)
+        return self.graph.suggestions(username, limit)
+    # get the users and their friends posts sorted by timestamp (recent first)
+    # pass the last post of a page as cursor to get the next one
+    def get_feed(self,username, limit=None, cursor=None):
+        user = self.users.get(username)
+        if not user:
+            return []
+        inbox = self.home_timeline(user).snapshot() # one version for the whole page
+        members = self.timeline_members(user)
+        streams = [inbox.iter_newest(cursor)]
+        streams += [u.posts.iter_newest(cursor) for u in members[1:] if self.is_heavy(u)]
+        page = TimelineIndex.merge_newest(streams, limit)
+        if inbox.trimmed and (limit is None or len(page) < limit or inbox.first_key() is None
+                              or TimelineIndex.key(page[-1]) < inbox.first_key()):
+            # the inbox only keeps the newest posts, pages reaching past it are pulled from everyone
+            streams = [u.posts.iter_newest(cursor) for u in members]
+            page = TimelineIndex.merge_newest(streams, limit)
+        return page
+    # every post in the system sorted by timestamp (recent first)
+    def get_global_feed(self, limit=None, cursor=None):
+        self.load_everything()
+        return self.posts.newest(limit, cursor)
+    # search posts of a user containing every word of keyword (or a word starting with it), newest first
+    def search_user_posts(self,username, keyword):
+        user = self.users.get(username)
+        if not user:
+            return []
+        return self.search_posts(keyword, prefix=True, author=username)
+    # search every post for all words of query, newest first
+    # words ending in * (or every word with prefix=True) match any word starting with them
+    def search_posts(self, query, limit=None, prefix=False, author=None):
+        terms = []
+        prefixes = []
+        for word in query.split():
+            tokens = InvertedIndex.tokenize(word)
+            if tokens and (prefix or word.endswith("*")):
+                prefixes.append(tokens.pop())
+            terms += tokens
+        if author is not None:
+            terms.append("@" + author) # their own posts drive the intersection, not every post with a prefix
+            self.users.get(author) # their posts are indexed once they are loaded
+        else:
+            self.load_everything()
+        if not terms and not prefixes:
+            return []
+        ids = self.search_index.search(terms, prefixes, limit)
+        posts = [self.posts_by_id.get(post_id) for post_id in ids]
+        return [post for post in posts if post is not None] # None if deleted since the search read its ids
+    #search a post by exact timestamp using binary serach
+    def search_post_by_timestamp(self,username, target_timestamp):
+        #binary search in the users time index, returns the oldest post at that timestamp if found, else none
+        posts = self.search_posts_by_timestamp(username, target_timestamp)
+        return posts[0] if posts else None
+    # every post of a user made between start and end (both included) oldest first, end defaults to start
+    def search_posts_by_timestamp(self, username, start, end=None):
+        user = self.users.get(username)
+        if not user:
+            return []
+        return user.posts.between(start, start if end is None else end)
+    # delete a post by timestamp, post_id picks one when several posts share the timestamp
+    @writer
+    def delete_post(self, username, timestamp, post_id=None):
+        user = self.users.get(username)
+        if not user:
+            return "user not found"
+        matches = self.search_posts_by_timestamp(username, timestamp)
+        if post_id is not None:
+            matches = [p for p in matches if p.id == post_id]
+        if not matches:
+            return "post not been found"
+        if len(matches) > 1:
+            return "several posts have that timestamp, choose one by id"
+        self.commit({"op": "delete_post", "username": username, "id": matches[0].id})
+        return "post has been delete"
+    # delete a post by its id
+    @writer
+    def delete_post_by_id(self, username, post_id):
+        if not self.users.get(username):
+            return "user not found"
+        post = self.posts_by_id.get(post_id)
+        if not post or post.author != username:
+            return "post not been found"
+        self.commit({"op": "delete_post", "username": username, "id": post_id})
+        return "post has been delete"
+    # total number of users
+    def total_users(self) -> int:
+        return self.users.total_users()
+    #total number of posts
+    def total_posts(self) -> int:
+        return self.post_count
+
+# read only views of the sqlite tables shaped like the dicts SocialGraph keeps, so its algorithms run unchanged
+class SqliteFriends:
+    def __init__(self, app):
+        self.app = app
+
+    def __getitem__(self, username):
+        return {row[0] for row in self.app.db.execute("SELECT friend FROM friendships WHERE username = ?", (username,))}
+
+    def __contains__(self, username):
+        return self.app.db.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone() is not None
+
+    def get(self, username, default=None):
+        return self[username] if username in self else default
+
+class SqliteRequests:
+    def __init__(self, app):
+        self.app = app
+
+    def __contains__(self, pair):
+        return self.app.db.execute("SELECT 1 FROM friend_requests WHERE sender = ? AND receiver = ?", pair).fetchone() is not None
+
+# users.get for code written against the HashTable, builds a whole User so it is meant for single lookups
+class SqliteUsers:
+    def __init__(self, app):
+        self.app = app
+
+    def get(self, username):
+        db = self.app.db
+        row = db.execute("SELECT password FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return None
+        user = User(username, row[0])
+        user.friends = self.app.graph.adjacency[username]
+        user.posts = TimelineIndex.from_sorted(list(self.app.post_rows(
+            "SELECT id, author, epoch, content FROM posts WHERE author = ? ORDER BY epoch, id", (username,))))
+        user.friend_requests = tuple(FriendRequest.from_epoch(*row) for row in db.execute(
+            "SELECT sender, receiver, epoch FROM friend_requests WHERE receiver = ? ORDER BY epoch", (username,)))
+        return user
+
+    def total_users(self):
+        return self.app.db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+# SocialMediaApp kept in a sqlite database instead of memory, so the data can outgrow RAM
+# mutations are the same records as the json app applied as sql, the database's own write ahead log
+# replaces the json one, and writes are grouped into one transaction per batch_size mutations or
+# batch_seconds, whichever comes first, checked on each mutation (flush or close commit straight away)
+# when no mutation comes after it, a background thread commits the transaction once it is batch_seconds old
+# mutations come from the thread that opened the app, the only one using its connection (and the open
+# transaction on it), any other thread reads through a read only connection of its own, which in WAL mode
+# sees the last commit and never waits for the writer, so db_path has to be a file and not ":memory:"
+# every query below is a fixed string with ? parameters so sqlite3 prepares it once and reuses it
+class SqliteSocialMediaApp(SocialMediaApp):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT NOT NULL,
+                                          next_seq INTEGER NOT NULL DEFAULT 1, read_seq INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS posts (id INTEGER PRIMARY KEY AUTOINCREMENT, author TEXT NOT NULL,
+                                          epoch INTEGER NOT NULL, content TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS posts_author_time ON posts (author, epoch, id);
+        CREATE INDEX IF NOT EXISTS posts_time ON posts (epoch, id);
+        CREATE TABLE IF NOT EXISTS friendships (username TEXT NOT NULL, friend TEXT NOT NULL,
+                                                PRIMARY KEY (username, friend)) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS friend_requests (sender TEXT NOT NULL, receiver TEXT NOT NULL, epoch INTEGER NOT NULL,
+                                                    PRIMARY KEY (sender, receiver)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS requests_receiver ON friend_requests (receiver, epoch);
+        CREATE TABLE IF NOT EXISTS notifications (username TEXT NOT NULL, seq INTEGER NOT NULL, message TEXT NOT NULL,
+                                                  PRIMARY KEY (username, seq)) WITHOUT ROWID;
+    """
+    # newest first posts of one author, starting after a (epoch, id) cursor
+    # epoch <= ? is the part the index seeks on, the rest only filters the posts sharing the cursor's second
+    AUTHOR_NEWEST = """SELECT id, author, epoch, content FROM posts WHERE author = ? AND epoch <= ? AND (epoch < ? OR id < ?)
+                       ORDER BY epoch DESC, id DESC"""
+    ALL_NEWEST = """SELECT id, author, epoch, content FROM posts WHERE epoch <= ? AND (epoch < ? OR id < ?)
+                    ORDER BY epoch DESC, id DESC LIMIT ?"""
+
+    def __init__(self, db_path="database.db", notification_limit=100, batch_size=500, batch_seconds=0.05, analytics=False):
+        self.db_path = db_path
+        self.notification_limit = notification_limit # notifications kept per user
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.pending = 0 # mutations in the open transaction
+        self.batch_started = 0.0
+        self.batch_depth = 0 # inside app.batch(), the transaction is only ended by end_batch
+        self.batch_failed = False
+        self.batch_events = []
+        self.analytics = Analytics() if analytics else None
+        self.write_lock = threading.RLock() # held by a mutation or batch, so the commit thread never ends one halfway
+        self.due = threading.Condition(self.write_lock) # wakes the commit thread when a transaction begins
+        # transactions are managed here, the commit thread commits on this connection too
+        self.conn = sqlite3.connect(db_path, isolation_level=None, cached_statements=256, check_same_thread=False)
+        self.owner = threading.get_ident() # the writing thread
+        self.readers = threading.local() # the read only connection of every other thread
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL") # with WAL a commit only waits for the log write
+        self.db.executescript(self.SCHEMA)
+        self.users = SqliteUsers(self)
+        self.graph = SocialGraph()
+        self.graph.adjacency = SqliteFriends(self)
+        self.graph.requests = SqliteRequests(self)
+        self.metrics = Metrics()
+        self.commit_stats = {"writes": 0, "mutations": 0, "seconds": 0.0, "max_seconds": 0.0} # one write is one transaction
+        self.closed = False
+        threading.Thread(target=self.commit_when_due, name="sqlite-commit", daemon=True).start()
+        atexit.register(self.close)
+
+    # the connection of the calling thread
+    @property
+    def db(self):
+        if threading.get_ident() == self.owner:
+            return self.conn
+        db = getattr(self.readers, "db", None)
+        if db is None:
+            db = self.readers.db = sqlite3.connect(self.db_path, isolation_level=None, cached_statements=256)
+            db.execute("PRAGMA query_only=ON")
+        return db
+
+    def check_writer(self):
+        if threading.get_ident() != self.owner:
+            raise RuntimeError("SqliteSocialMediaApp only takes mutations from the thread that opened it")
+
+    # Post objects for rows of (id, author, epoch, content), pulled from the cursor as they are needed
+    def post_rows(self, sql, params):
+        for post_id, author, epoch, content in self.db.execute(sql, params):
+            yield Post.from_epoch(author, content, epoch, post_id)
+
+    def exists(self, username):
+        return username in self.graph.adjacency
+
+    def find_post(self, post_id):
+        return next(self.post_rows("SELECT id, author, epoch, content FROM posts WHERE id = ?", (post_id,)), None)
+
+    # apply a mutation inside the open transaction, committing it once the batch is full or old enough
+    @writer
+    def commit(self, record):
+        self.check_writer()
+        if self.analytics is not None:
+            self.observe(record)
+        if self.batch_depth:
+            self.apply_record(record)
+            return
+        if self.pending == 0:
+            self.conn.execute("BEGIN")
+            self.batch_started = time.monotonic()
+        self.apply_record(record)
+        self.pending += 1
+        if self.pending >= self.batch_size or time.monotonic() - self.batch_started >= self.batch_seconds:
+            self.flush()
+        elif self.pending == 1:
+            self.due.notify() # a new transaction, the commit thread ends it if nothing else does
+
+    # commit thread: commits the open transaction batch_seconds after it began if no mutation has by then
+    def commit_when_due(self):
+        with self.write_lock:
+            while not self.closed:
+                wait = None
+                if self.pending:
+                    wait = self.batch_started + self.batch_seconds - time.monotonic()
+                    if wait <= 0:
+                        self.flush()
+                        continue
+                self.due.wait(wait)
+
+    def apply_record(self, record):
+        op = record["op"]
+        db = self.conn # mutations run on the writer thread
+        if op == "register":
+            db.execute("INSERT INTO users (username, password) VALUES (?, ?)", (record["username"], record["password"]))
+        elif op == "post":
+            epoch = Epoch.from_datetime(datetime.strptime(record["timestamp"], TIME_FORMAT))
+            db.execute("INSERT INTO posts (author, epoch, content) VALUES (?, ?, ?)", (record["author"], epoch, record["content"]))
+        elif op == "delete_post":
+            db.execute("DELETE FROM posts WHERE id = ? AND author = ?", (record["id"], record["username"]))
+        elif op == "friend_request":
+            epoch = Epoch.from_datetime(datetime.strptime(record["timestamp"], TIME_FORMAT))
+            db.execute("INSERT INTO friend_requests VALUES (?, ?, ?)", (record["sender"], record["receiver"], epoch))
+            self.notify(record["receiver"], f"{record['sender']} sent a friend request to {record['receiver']}")
+        elif op == "accept":
+            db.execute("DELETE FROM friend_requests WHERE sender = ? AND receiver = ?", (record["sender"], record["receiver"]))
+            db.executemany("INSERT OR IGNORE INTO friendships VALUES (?, ?)",
+                           [(record["sender"], record["receiver"]), (record["receiver"], record["sender"])])
+            self.notify(record["sender"], f"{record['receiver']} accepted {record['sender']}'s friend request")
+        elif op == "decline":
+            db.execute("DELETE FROM friend_requests WHERE sender = ? AND receiver = ?", (record["sender"], record["receiver"]))
+            self.notify(record["sender"], f"{record['receiver']} declined {record['sender']}'s friend request")
+        elif op == "read_notifications":
+            db.execute("UPDATE users SET read_seq = MAX(read_seq, ?) WHERE username = ?", (record["read"], record["username"]))
+
+    # same numbering as NotificationInbox, only the newest notification_limit rows are kept
+    def notify(self, username, message):
+        seq, = self.conn.execute("SELECT next_seq FROM users WHERE username = ?", (username,)).fetchone()
+        self.conn.execute("INSERT INTO notifications VALUES (?, ?, ?)", (username, seq, message))
+        self.conn.execute("UPDATE users SET next_seq = ? WHERE username = ?", (seq + 1, username))
+        self.conn.execute("DELETE FROM notifications WHERE username = ? AND seq <= ?", (username, seq - self.notification_limit))
+
+    # app.batch() is one sql transaction here, rolled back by sqlite itself on failure
+    def begin_batch(self):
+        self.check_writer()
+        self.write_lock.acquire() # released by end_batch
+        if self.batch_depth == 0:
+            self.flush()
+            self.conn.execute("BEGIN")
+            self.batch_events = []
+            self.batch_failed = False
+        self.batch_depth += 1
+
+    def end_batch(self, ok):
+        try:
+            self.batch_depth -= 1
+            if not ok:
+                self.batch_failed = True
+            if self.batch_depth:
+                return
+            if self.batch_failed:
+                self.conn.execute("ROLLBACK")
+                if ok:
+                    raise BatchError("an inner batch failed, the whole batch was undone")
+            else:
+                self.conn.execute("COMMIT")
+                self.count_batch_events()
+        finally:
+            self.write_lock.release()
+
+    # the database is always current, saving just commits the open transaction
+    def save_data(self):
+        self.flush()
+
+    @writer
+    def flush(self):
+        if self.pending:
+            start = time.perf_counter()
+            self.conn.execute("COMMIT") # from the writer or the commit thread
+            took = time.perf_counter() - start
+            self.commit_stats["writes"] += 1
+            self.commit_stats["mutations"] += self.pending
+            self.commit_stats["seconds"] += took
+            self.commit_stats["max_seconds"] = max(self.commit_stats["max_seconds"], took)
+            self.pending = 0
+
+    def metrics_snapshot(self):
+        pages, = self.db.execute("PRAGMA page_count").fetchone()
+        page_size, = self.db.execute("PRAGMA page_size").fetchone()
+        persistence = {"transactions": dict(self.commit_stats), "database_bytes": pages * page_size,
+                       "mutations_in_open_transaction": self.pending}
+        return {"enabled": self.metrics.enabled, "ops": self.metrics.snapshot(), "persistence": persistence,
+                "users": self.total_users(), "posts": self.total_posts()}
 
-            for p in udata["posts"]:
-                post = Post(username,p["content"], datetime.strptime(p["timestamp"], "%d-%m-%Y %H:%M:%S"))
-                user.posts.append(post)
-                self.posts.append(post)
-            
-            for fr in udata["friend_requests"]:
-                req = FriendRequest(fr["sender"], fr["receiver"], datetime.strptime(fr["timestamp"], "%d-%m-%Y %H:%M:%S"))
-                user.friend_requests.append(req)
+    @writer
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.conn.close()
+        self.closed = True
+        self.due.notify() # the commit thread sees closed and ends
+        atexit.unregister(self.close)
 
-            self.users.insert(username,user)
-    # register a new user            
     def register(self, username, password):
-        if self.users.get(username):
+        if self.exists(username):
             return "Username already taken"
-        new_user = User(username, password)
-        self.users.insert(username, new_user)
-        self.save_data()
+        self.commit({"op": "register", "username": username, "password": password})
         return "User registered"
-    #login check
-    def login(self,username,password):
-        user = self.users.get(username)
-        if user and user.password == password:
+
+    def login(self, username, password):
+        row = self.db.execute("SELECT password FROM users WHERE username = ?", (username,)).fetchone()
+        if row and row[0] == password:
             return "Log in succesful"
         return "Invalid Information"
-    #create a post
-    def create_post(self,username,content):
-        user = self.users.get(username)
-        if not user:
+
+    def create_post(self, username, content):
+        if not self.exists(username):
             return "user not found"
-        post = Post(username, content, datetime.now())
-        user.add_post(post)
-        self.posts.append(post)
-        self.save_data()
+        self.commit({"op": "post", "author": username, "content": content,
+                     "timestamp": datetime.now().strftime(TIME_FORMAT)})
         return "post has been uploaded"
-    #get all notifications and clear queue
-    def get_notifications(self):
-        notifications = []
-        while not self.notification_queue.is_empty():
-            notifications.append(self.notification_queue.dequeue())
+
+    def get_notifications(self, username, since=None, limit=None):
+        row = self.db.execute("SELECT read_seq FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return []
+        notifications = self.db.execute("SELECT seq, message FROM notifications WHERE username = ? AND seq > ? ORDER BY seq LIMIT ?",
+                                        (username, row[0] if since is None else since, -1 if limit is None else limit)).fetchall()
+        if since is None and notifications:
+            self.commit({"op": "read_notifications", "username": username, "read": notifications[-1][0]})
         return notifications
-    #send friend request to another user
-    def send_friend_request(self,sender,receiver):
-        sender_user = self.users.get(sender)
-        receiver_user = self.users.get(receiver)
 
-        if not sender_user or not receiver_user:
+    def unread_notifications(self, username):
+        row = self.db.execute("""SELECT COUNT(*) FROM notifications JOIN users USING (username)
+                                 WHERE username = ? AND seq > read_seq""", (username,)).fetchone()
+        return row[0]
+
+    def send_friend_request(self, sender, receiver):
+        if not self.exists(sender) or not self.exists(receiver):
             return "User not found"
-        
-        fr = FriendRequest(sender,receiver,datetime.now())
-        receiver_user.friend_requests.append(fr)
-        self.notification_queue.enqueue(f"{sender} sent a friend request to {receiver}")
-        self.save_data()
+        if sender == receiver:
+            return "You cannot add yourself"
+        if self.graph.are_friends(sender, receiver):
+            return "Already friends"
+        if self.graph.has_request(sender, receiver):
+            return "Friend request already sent"
+        if self.graph.has_request(receiver, sender):
+            return f"{receiver} already sent you a friend request"
+        self.commit({"op": "friend_request", "sender": sender, "receiver": receiver,
+                     "timestamp": datetime.now().strftime(TIME_FORMAT)})
         return "Friend Request sent"
-    #accept friend request
+
     def accept_friend_request(self, receiver, sender):
-        user = self.users.get(receiver)
-        if not user:
+        if not self.exists(receiver):
             return "user not been found"
-        for fr in user.friend_requests:
-            if fr.sender == sender:
-                user.friend_requests.remove(fr)
-                user.add_friend(sender)
-                self.users.get(sender).add_friend(receiver)
-                self.notification_queue.enqueue(f"{receiver} accepted {sender}'s friend request")
-                self.save_data()
-                return "friend request accepted"
-            
+        if self.graph.has_request(sender, receiver):
+            self.commit({"op": "accept", "receiver": receiver, "sender": sender})
+            return "friend request accepted"
         return "friend request not found"
-    #decline a driend request
-    def decline_friend_request(self,receiver,sender):
-        user = self.users.get(receiver)
-        if not user:
+
+    def decline_friend_request(self, receiver, sender):
+        if not self.exists(receiver):
             return "user not been found"
-        
-        for fr in user.friend_requests:
-            if fr.sender == sender:
-                user.friend_requests.remove(fr)
-                self.notification_queue.enqueue(f"{receiver} declined {sender}'s friend request")
-                self.save_data()
-                return "friend request has been declined"
+        if self.graph.has_request(sender, receiver):
+            self.commit({"op": "decline", "receiver": receiver, "sender": sender})
+            return "friend request has been declined"
         return "friend request not found"
-    # get feed sorted by timestamp (recent first)
-    def get_feed(self,username):
-        user = self.users.get(username)
-        if not user:
+
+    def mutual_friends(self, username, other):
+        if not self.exists(username) or not self.exists(other):
             return []
-        sorted_posts = Sorter.merge_sort(self.posts,key=lambda p: p.timestamp)
-        return sorted_posts[::-1]
-    # search posts of a user containing keyword
-    def search_user_posts(self,username, keyword):
-        user = self.users.get(username)
-        if not user:
+        return sorted(self.graph.mutual_friends(username, other))
+
+    def degrees_of_separation(self, username, other):
+        return self.graph.degrees_of_separation(username, other)
+
+    def suggest_friends(self, username, limit=10):
+        if not self.exists(username):
             return []
-        results = []
-        for post in user.posts:
-            if keyword.lower() in post.content.lower():
-                results.append(post)
-        return results
-    #search a post by exact timestamp using binary serach
-    def search_post_by_timestamp(self,username, target_timestamp):
-        #uses binary search to find post by the timestamp, returns post object if found, else none
+        return self.graph.suggestions(username, limit)
+
+    # one index range scan per member merged newest first, each scan only reads the rows the page needs
+    def get_feed(self, username, limit=None, cursor=None):
+        if not self.exists(username):
+            return []
+        epoch, post_id = TimelineIndex.key(cursor) if cursor else (2 ** 62, 0)
+        members = [username] + sorted(self.graph.adjacency[username])
+        streams = [self.post_rows(self.AUTHOR_NEWEST, (member, epoch, epoch, post_id)) for member in members]
+        return TimelineIndex.merge_newest(streams, limit)
+
+    def get_global_feed(self, limit=None, cursor=None):
+        epoch, post_id = TimelineIndex.key(cursor) if cursor else (2 ** 62, 0)
+        return list(self.post_rows(self.ALL_NEWEST, (epoch, epoch, post_id, -1 if limit is None else limit)))
+
+    # users.get would read every post of the user just to see that they exist
+    def search_user_posts(self, username, keyword):
+        if not self.exists(username):
+            return []
+        return self.search_posts(keyword, prefix=True, author=username)
+
+    # rows are narrowed by the author index and a LIKE per word, then checked word by word like InvertedIndex does
+    def search_posts(self, query, limit=None, prefix=False, author=None):
+        terms = []
+        prefixes = []
+        for word in query.split():
+            tokens = InvertedIndex.tokenize(word)
+            if tokens and (prefix or word.endswith("*")):
+                prefixes.append(tokens.pop())
+            terms += tokens
+        if author is None and not terms and not prefixes:
+            return []
+        sql = "SELECT id, author, epoch, content FROM posts WHERE 1"
+        params = []
+        if author is not None:
+            sql += " AND author = ?"
+            params.append(author)
+        for word in terms + prefixes:
+            if word.isascii(): # LIKE only folds case for ascii
+                sql += " AND content LIKE ? ESCAPE '\\'"
+                params.append("%" + word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        sql += " ORDER BY epoch DESC, id DESC"
+        found = []
+        for post in self.post_rows(sql, params):
+            words = InvertedIndex.tokenize(post.content)
+            if all(t in words for t in terms) and all(any(w.startswith(p) for w in words) for p in prefixes):
+                found.append(post)
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    def search_posts_by_timestamp(self, username, start, end=None):
+        end = start if end is None else end
+        return list(self.post_rows("SELECT id, author, epoch, content FROM posts WHERE author = ? AND epoch BETWEEN ? AND ? ORDER BY epoch, id",
+                                   (username, -((Epoch.START - start) // Epoch.SECOND), Epoch.from_datetime(end))))
+
+    def delete_post(self, username, timestamp, post_id=None):
+        if not self.exists(username):
+            return "user not found"
+        matches = self.search_posts_by_timestamp(username, timestamp)
+        if post_id is not None:
+            matches = [p for p in matches if p.id == post_id]
+        if not matches:
+            return "post not been found"
+        if len(matches) > 1:
+            return "several posts have that timestamp, choose one by id"
+        self.commit({"op": "delete_post", "username": username, "id": matches[0].id})
+        return "post has been delete"
+
+    def delete_post_by_id(self, username, post_id):
+        if not self.exists(username):
+            return "user not found"
+        if not self.db.execute("SELECT 1 FROM posts WHERE id = ? AND author = ?", (post_id, username)).fetchone():
+            return "post not been found"
+        self.commit({"op": "delete_post", "username": username, "id": post_id})
+        return "post has been delete"
+
+    def total_users(self) -> int:
+        return self.users.total_users()
+
+    def total_posts(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+# one shard of a sharded deployment, a SocialMediaApp holding only the users whose name hashes to it
+# runs in its own process and answers the calls ShardedSocialMediaApp sends over a pipe
+# friends and friend requests can name users of other shards, they are kept as plain names:
+# a request is stored with its receiver only, and each side of a friendship has the other's name in its friends set
+class SocialMediaShard(SocialMediaApp):
+    def __init__(self, db_path, shard, shards, **options):
+        self.shard = shard # index of this shard
+        self.shards = shards # number of shards
+        super().__init__(db_path, **options)
+
+    # process entry point, answers lists of (method name, arguments) with lists of (ok, result or exception)
+    # None stops it after writing everything out
+    @staticmethod
+    def main(conn, db_path, shard, shards, options):
+        app = SocialMediaShard(db_path, shard, shards, **options)
+        while True:
+            calls = conn.recv()
+            if calls is None:
+                break
+            answers = []
+            for name, args in calls:
+                try:
+                    answers.append((True, getattr(app, name)(*args)))
+                except Exception as e: # raised again in the router
+                    answers.append((False, e))
+            conn.send(answers)
+        app.close()
+
+    # the smallest post id not used here, the router numbers posts above that of every shard
+    def next_id(self):
+        return self.next_post_id
+
+    # the router hands every post its id and time, so the posts of all shards order like those of one app
+    # the same second is broken by id, which is the order the router got the posts in
+    @writer
+    def create_post(self, username, content, post_id=None, timestamp=None):
+        if post_id is None:
+            return super().create_post(username, content)
+        if not self.users.get(username):
+            return "user not found"
+        self.commit({"op": "post", "author": username, "content": content, "id": post_id, "timestamp": timestamp})
+        return "post has been uploaded"
+
+    # the halves of cross shard friend operations, each touches only the local user
+    def apply_record(self, record):
+        op = record["op"]
+        if op == "accept_in": # receiver side of an accepted request
+            user = self.users.get(record["receiver"])
+            user.remove_request(self.graph.pop_request(record["sender"], record["receiver"]))
+            self.graph.befriend(user, record["sender"])
+            user.inbox = None
+        elif op == "accept_out": # sender side, also drops a request the receiver sent back meanwhile
+            user = self.users.get(record["sender"])
+            self.graph.befriend(user, record["receiver"])
+            user.inbox = None
+            crossed = self.graph.pop_request(record["receiver"], record["sender"])
+            if crossed:
+                user.remove_request(crossed)
+            self.notify(record["sender"], f"{record['receiver']} accepted {record['sender']}'s friend request")
+        elif op == "decline_in":
+            user = self.users.get(record["receiver"]) # loaded first, so their requests are in the graph
+            user.remove_request(self.graph.pop_request(record["sender"], record["receiver"]))
+        elif op == "decline_out":
+            self.notify(record["sender"], f"{record['receiver']} declined {record['sender']}'s friend request")
+        else:
+            super().apply_record(record)
+
+    # friends on other shards are not in users, their posts are merged in by the router
+    def timeline_members(self, user):
+        members = [user]
+        for name in user.friends:
+            friend = self.users.get(name)
+            if friend:
+                members.append(friend)
+        return members
+
+    # the local part of a feed plus the friends living elsewhere grouped by shard, None for an unknown user
+    def feed_part(self, username, limit=None, cursor=None):
         user = self.users.get(username)
         if not user:
             return None
-        sorted_posts = Sorter.merge_sort(user.posts, key=lambda p: p.timestamp)
+        remote = {}
+        for name in user.friends:
+            shard = ShardedSocialMediaApp.shard_of(name, self.shards)
+            if shard != self.shard:
+                remote.setdefault(shard, []).append(name)
+        return self.get_feed(username, limit, cursor), remote
+
+    # newest posts of the given local users, merged
+    def posts_of(self, names, limit=None, cursor=None):
+        streams = []
+        for name in names:
+            user = self.users.get(name)
+            if user:
+                streams.append(user.posts.iter_newest(cursor))
+        return TimelineIndex.merge_newest(streams, limit)
 
-        index = Search.binary_search(sorted_posts, target_timestamp, key=lambda p: p.timestamp)
-        if index != -1:
-            return sorted_posts[index]
+    # name -> (friends, senders of pending requests) for the local users among names
+    def friend_info(self, names):
+        info = {}
+        for name in names:
+            user = self.users.get(name)
+            if user:
+                info[name] = (list(user.friends), [fr.sender for fr in user.friend_requests])
+        return info
+
+    # the local users among names that have a pending request from sender
+    def requests_from(self, sender, names):
+        return [name for name in names if self.graph.has_request(sender, name)]
+
+    # friend request to a user on another shard, step 1 on the sender's shard: checks without writing
+    def check_sender(self, sender, receiver):
+        if not self.users.get(sender):
+            return "User not found"
+        if self.graph.are_friends(sender, receiver):
+            return "Already friends"
+        if self.graph.has_request(receiver, sender):
+            return f"{receiver} already sent you a friend request"
         return None
-    # delete a post by timestamp 
-    def delete_post(self, username, timestamp):
-        user = self.users.get(username)
+
+    # step 2 on the receiver's shard, checks the receiver's side and stores the request
+    def receive_request(self, sender, receiver):
+        if not self.users.get(receiver):
+            return "User not found"
+        if self.graph.are_friends(receiver, sender):
+            return "Already friends"
+        if self.graph.has_request(sender, receiver):
+            return "Friend request already sent"
+        self.commit({"op": "friend_request", "sender": sender, "receiver": receiver,
+                     "timestamp": datetime.now().strftime(TIME_FORMAT)})
+        return "Friend Request sent"
+
+    # accepting a request from a user on another shard, step 1 on the receiver's shard
+    # on recovery (resume) a request that is gone but already turned into a friendship counts as accepted
+    # both steps are on disk before they answer, the router forgets the operation only after step 2
+    def accept_incoming(self, receiver, sender, resume=False):
+        user = self.users.get(receiver)
         if not user:
-            return "user not found"
-        
-        for p in user.posts:
-            if p.timestamp == timestamp:
-                user.posts.remove(p)
-                self.posts.remove(p)
-                self.save_data()
-                return "post has been delete"
-            
-        return "post not been found"
-    # total number of users
+            return "user not been found"
+        if self.graph.has_request(sender, receiver):
+            self.commit({"op": "accept_in", "receiver": receiver, "sender": sender})
+        elif not (resume and sender in user.friends):
+            return "friend request not found"
+        self.flush()
+        return "friend request accepted"
+
+    # step 2 on the sender's shard, repeating it changes nothing
+    def accept_outgoing(self, sender, receiver):
+        user = self.users.get(sender)
+        if user and receiver not in user.friends:
+            self.commit({"op": "accept_out", "sender": sender, "receiver": receiver})
+        self.flush()
+
+    def decline_incoming(self, receiver, sender):
+        if not self.users.get(receiver):
+            return "user not been found"
+        if not self.graph.has_request(sender, receiver):
+            return "friend request not found"
+        self.commit({"op": "decline_in", "receiver": receiver, "sender": sender})
+        self.flush()
+        return "friend request has been declined"
+
+    def decline_outgoing(self, sender, receiver):
+        if self.users.get(sender):
+            self.commit({"op": "decline_out", "sender": sender, "receiver": receiver})
+        self.flush()
+
+# the router of a sharded deployment: users are spread over shards worker processes by a hash of their name,
+# and every call is forwarded over a pipe to the shards that hold the users it involves
+# it has the same methods as SocialMediaApp, run_many runs lots of operations at once so all shards work in parallel
+#
+# cross shard protocol:
+# - a friend request is checked on the sender's shard (check_sender) and then checked again and stored on
+#   the receiver's shard (receive_request), the only place it is kept
+# - accept and decline run on the receiver's shard first (accept_incoming, decline_incoming) and, if that found the
+#   request, on the sender's shard (accept_outgoing, decline_outgoing); the router logs the operation before
+#   step 1 and forgets it after step 2, a restart finishes any it still has logged
+# - a feed is the home shard's feed of the user and their local friends (feed_part) merged with the newest posts
+#   of the friends on each other shard (posts_of), global searches and feeds are asked of every shard and merged
+# - mutual friends, suggestions and degrees of separation fetch friend sets shard by shard (friend_info)
+# - posts are numbered and timed by the router (do_create_post), so merged pages break ties the way one app does
+class ShardedSocialMediaApp:
+    # answered by the home shard of their first argument alone
+    ROUTED = ("register", "login", "get_notifications", "unread_notifications", "search_user_posts",
+              "search_post_by_timestamp", "search_posts_by_timestamp", "delete_post", "delete_post_by_id")
+
+    def __init__(self, db_path="database.json", shards=None, **options):
+        self.shards = int(shards or os.cpu_count() or 1)
+        self.intents = WriteAheadLog(os.path.splitext(db_path)[0] + ".router.log") # cross shard operations in flight
+        self.open_intents = set()
+        self.last_intent = 0
+        self.conns = []
+        self.processes = []
+        for shard in range(self.shards):
+            conn, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=SocialMediaShard.main, daemon=True,
+                                              args=(child, self.shard_path(db_path, shard), shard, self.shards, options))
+            process.start()
+            self.conns.append(conn)
+            self.processes.append(process)
+        atexit.register(self.close)
+        self.next_post_id = max(self.call(self.everywhere("next_id"))) # posts are numbered here, see do_create_post
+        self.recover()
+
+    # HashTable.hash one level up, crc32 because str hash() is salted differently in every process
+    @staticmethod
+    def shard_of(username, shards):
+        return zlib.crc32(username.encode()) % shards
+
+    @staticmethod
+    def shard_path(db_path, shard):
+        root, ext = os.path.splitext(db_path)
+        return f"{root}.shard{shard}{ext}"
+
+    def home(self, username):
+        return self.shard_of(username, self.shards)
+
+    # split the snapshot and log at src into the shard snapshots of a sharded deployment at dst
+    # python "Social Media Project.py" split <src> <dst> <shards>
+    @staticmethod
+    def split(src, dst, shards):
+        shards = int(shards)
+        app = SocialMediaApp(src, background_writes=False)
+        app.load_everything()
+        data = app.snapshot_data()
+        app.close()
+        parts = [[] for _ in range(shards)]
+        for entry in data["users"]:
+            parts[ShardedSocialMediaApp.shard_of(entry[0], shards)].append(entry)
+        header = {"last_seq": 0, "next_post_id": data["header"]["next_post_id"]}
+        for shard, users in enumerate(parts):
+            path = ShardedSocialMediaApp.shard_path(dst, shard)
+            JsonLinesStorage().write(path, {"header": header, "users": users})
+            WriteAheadLog(os.path.splitext(path)[0] + ".log").reset()
+
+    # run tasks, generators that yield lists of (shard, method, arguments) and get back the answers
+    # every round sends each shard one list with the calls of all tasks, so the shards work on them in parallel
+    # calls to one shard run in task order, at most window tasks are in flight
+    # returns what each task returned
+    def gather(self, tasks, window=512):
+        tasks = iter(tasks)
+        results = []
+        ready = [] # (slot, task, answers or exception to resume it with)
+        more = True
+        while True:
+            while more and len(ready) < window:
+                task = next(tasks, None)
+                if task is None:
+                    more = False
+                else:
+                    results.append(None)
+                    ready.append((len(results) - 1, task, None))
+            if not ready:
+                return results
+            batches = [[] for _ in range(self.shards)]
+            parked = []
+            for slot, task, value in ready:
+                try:
+                    calls = task.throw(value) if isinstance(value, BaseException) else task.send(value)
+                except StopIteration as stop:
+                    results[slot] = stop.value
+                    continue
+                for shard, name, args in calls:
+                    batches[shard].append((name, args))
+                parked.append((slot, task, calls))
+            for conn, batch in zip(self.conns, batches):
+                if batch:
+                    conn.send(batch)
+            replies = [iter(conn.recv()) if batch else None for conn, batch in zip(self.conns, batches)]
+            ready = []
+            for slot, task, calls in parked:
+                answers = []
+                error = None
+                for shard, name, args in calls:
+                    ok, value = next(replies[shard])
+                    answers.append(value)
+                    if not ok:
+                        error = value
+                ready.append((slot, task, error or answers))
+
+    def call(self, task):
+        return self.gather([task])[0]
+
+    # run ops, (method name, arguments...) like apply_batch takes, concurrently and return their answers
+    # each op sees the shards as they are when its steps reach them, like requests to a server
+    def run_many(self, ops, window=512):
+        return self.gather((self.task(name, *args) for name, *args in ops), window)
+
+    def task(self, name, *args):
+        if name in self.ROUTED:
+            return self.routed(name, *args)
+        return getattr(self, "do_" + name)(*args)
+
+    def routed(self, name, username, *args):
+        answer, = yield [(self.home(username), name, (username,) + args)]
+        return answer
+
+    def everywhere(self, name, *args):
+        return (yield [(shard, name, args) for shard in range(self.shards)])
+
+    # names grouped by their shard
+    def group(self, names):
+        groups = {}
+        for name in names:
+            groups.setdefault(self.home(name), []).append(name)
+        return groups
+
+    def gather_friend_info(self, names):
+        info = {}
+        for answer in (yield [(shard, "friend_info", (group,)) for shard, group in self.group(names).items()]):
+            info.update(answer)
+        return info
+
+    # log a cross shard operation before its first step, it is finished on restart if step 2 never ran
+    def open_intent(self, record):
+        self.last_intent += 1
+        record["id"] = self.last_intent
+        self.intents.append(record)
+        self.open_intents.add(self.last_intent)
+        return self.last_intent
+
+    def close_intent(self, intent):
+        self.open_intents.discard(intent)
+        if self.open_intents:
+            self.intents.append({"op": "done", "id": intent})
+        else:
+            self.intents.reset()
+
+    # finish the cross shard operations a crash left half done
+    def recover(self):
+        records = self.intents.read()
+        done = {record["id"] for record in records if record["op"] == "done"}
+        unfinished = [record for record in records if record["op"] != "done" and record["id"] not in done]
+        self.gather(self.finish_accept(r["receiver"], r["sender"], True) if r["op"] == "accept"
+                    else self.finish_decline(r["receiver"], r["sender"]) for r in unfinished)
+        self.intents.reset()
+
+    def finish_accept(self, receiver, sender, resume=False):
+        answer, = yield [(self.home(receiver), "accept_incoming", (receiver, sender, resume))]
+        if answer == "friend request accepted":
+            yield [(self.home(sender), "accept_outgoing", (sender, receiver))]
+        return answer
+
+    def finish_decline(self, receiver, sender):
+        answer, = yield [(self.home(receiver), "decline_incoming", (receiver, sender))]
+        if answer == "friend request has been declined":
+            yield [(self.home(sender), "decline_outgoing", (sender, receiver))]
+        return answer
+
+    # ids and times are given out here in the order posts arrive, one counter for every shard
+    # a post refused by its shard leaves a gap, ids only have to grow
+    def do_create_post(self, username, content):
+        post_id = self.next_post_id
+        self.next_post_id += 1
+        answer, = yield [(self.home(username), "create_post",
+                          (username, content, post_id, datetime.now().strftime(TIME_FORMAT)))]
+        return answer
+
+    def do_send_friend_request(self, sender, receiver):
+        if self.home(sender) == self.home(receiver):
+            return (yield from self.routed("send_friend_request", sender, receiver))
+        refusal, = yield [(self.home(sender), "check_sender", (sender, receiver))]
+        if refusal:
+            return refusal
+        answer, = yield [(self.home(receiver), "receive_request", (sender, receiver))]
+        return answer
+
+    def do_accept_friend_request(self, receiver, sender):
+        if self.home(sender) == self.home(receiver):
+            return (yield from self.routed("accept_friend_request", receiver, sender))
+        intent = self.open_intent({"op": "accept", "receiver": receiver, "sender": sender})
+        answer = yield from self.finish_accept(receiver, sender)
+        self.close_intent(intent)
+        return answer
+
+    def do_decline_friend_request(self, receiver, sender):
+        if self.home(sender) == self.home(receiver):
+            return (yield from self.routed("decline_friend_request", receiver, sender))
+        intent = self.open_intent({"op": "decline", "receiver": receiver, "sender": sender})
+        answer = yield from self.finish_decline(receiver, sender)
+        self.close_intent(intent)
+        return answer
+
+    def do_get_feed(self, username, limit=None, cursor=None):
+        part, = yield [(self.home(username), "feed_part", (username, limit, cursor))]
+        if part is None:
+            return []
+        page, remote = part
+        pages = yield [(shard, "posts_of", (names, limit, cursor)) for shard, names in remote.items()]
+        return TimelineIndex.merge_newest([page] + pages, limit)
+
+    def do_get_global_feed(self, limit=None, cursor=None):
+        return TimelineIndex.merge_newest((yield from self.everywhere("get_global_feed", limit, cursor)), limit)
+
+    def do_search_posts(self, query, limit=None, prefix=False, author=None):
+        if author is not None:
+            answer, = yield [(self.home(author), "search_posts", (query, limit, prefix, author))]
+            return answer
+        return TimelineIndex.merge_newest((yield from self.everywhere("search_posts", query, limit, prefix)), limit)
+
+    def do_mutual_friends(self, username, other):
+        info = yield from self.gather_friend_info([username, other])
+        if username not in info or other not in info:
+            return []
+        return sorted(set(info[username][0]) & set(info[other][0]))
+
+    # SocialGraph.suggestions over friend sets fetched from the shards
+    def do_suggest_friends(self, username, limit=10):
+        info = yield from self.gather_friend_info([username])
+        if username not in info:
+            return []
+        friends, asked = set(info[username][0]), set(info[username][1])
+        counts = {}
+        for their_friends, _ in (yield from self.gather_friend_info(friends)).values():
+            for candidate in their_friends:
+                if candidate != username and candidate not in friends:
+                    counts[candidate] = counts.get(candidate, 0) + 1
+        for answer in (yield [(shard, "requests_from", (username, group)) for shard, group in self.group(counts).items()]):
+            asked.update(answer)
+        ranked = [(name, count) for name, count in counts.items() if name not in asked]
+        return heapq.nsmallest(limit, ranked, key=lambda item: (-item[1], item[0]))
+
+    # SocialGraph.degrees_of_separation fetching the friends of each frontier from the shards
+    def do_degrees_of_separation(self, a, b):
+        friends = {name: info[0] for name, info in (yield from self.gather_friend_info([a, b])).items()}
+        if a not in friends or b not in friends:
+            return -1
+        if a == b:
+            return 0
+        seen_a, seen_b = {a}, {b}
+        frontier_a, frontier_b = {a}, {b}
+        depth = 0
+        while frontier_a and frontier_b:
+            if len(frontier_a) > len(frontier_b):
+                frontier_a, frontier_b = frontier_b, frontier_a
+                seen_a, seen_b = seen_b, seen_a
+            depth += 1
+            missing = [name for name in frontier_a if name not in friends]
+            for name, info in (yield from self.gather_friend_info(missing)).items():
+                friends[name] = info[0]
+            next_frontier = set()
+            for name in frontier_a:
+                for friend in friends.get(name, ()):
+                    if friend in seen_b:
+                        return depth
+                    if friend not in seen_a:
+                        seen_a.add(friend)
+                        next_frontier.add(friend)
+            frontier_a = next_frontier
+        return -1
+
+    def do_total_users(self):
+        return sum((yield from self.everywhere("total_users")))
+
+    def do_total_posts(self):
+        return sum((yield from self.everywhere("total_posts")))
+
+    def register(self, username, password):
+        return self.call(self.routed("register", username, password))
+
+    def login(self, username, password):
+        return self.call(self.routed("login", username, password))
+
+    def create_post(self, username, content):
+        return self.call(self.do_create_post(username, content))
+
+    def get_notifications(self, username, since=None, limit=None):
+        return self.call(self.routed("get_notifications", username, since, limit))
+
+    def unread_notifications(self, username):
+        return self.call(self.routed("unread_notifications", username))
+
+    def send_friend_request(self, sender, receiver):
+        return self.call(self.do_send_friend_request(sender, receiver))
+
+    def accept_friend_request(self, receiver, sender):
+        return self.call(self.do_accept_friend_request(receiver, sender))
+
+    def decline_friend_request(self, receiver, sender):
+        return self.call(self.do_decline_friend_request(receiver, sender))
+
+    def mutual_friends(self, username, other):
+        return self.call(self.do_mutual_friends(username, other))
+
+    def degrees_of_separation(self, username, other):
+        return self.call(self.do_degrees_of_separation(username, other))
+
+    def suggest_friends(self, username, limit=10):
+        return self.call(self.do_suggest_friends(username, limit))
+
+    def get_feed(self, username, limit=None, cursor=None):
+        return self.call(self.do_get_feed(username, limit, cursor))
+
+    def get_global_feed(self, limit=None, cursor=None):
+        return self.call(self.do_get_global_feed(limit, cursor))
+
+    def search_user_posts(self, username, keyword):
+        return self.call(self.routed("search_user_posts", username, keyword))
+
+    def search_posts(self, query, limit=None, prefix=False, author=None):
+        return self.call(self.do_search_posts(query, limit, prefix, author))
+
+    def search_post_by_timestamp(self, username, target_timestamp):
+        return self.call(self.routed("search_post_by_timestamp", username, target_timestamp))
+
+    def search_posts_by_timestamp(self, username, start, end=None):
+        return self.call(self.routed("search_posts_by_timestamp", username, start, end))
+
+    def delete_post(self, username, timestamp, post_id=None):
+        return self.call(self.routed("delete_post", username, timestamp, post_id))
+
+    def delete_post_by_id(self, username, post_id):
+        return self.call(self.routed("delete_post_by_id", username, post_id))
+
     def total_users(self) -> int:
-        return self.users.total_users()
-    #total number of posts
+        return self.call(self.do_total_users())
+
     def total_posts(self) -> int:
-        return len(self.posts)
+        return self.call(self.do_total_posts())
+
+    def flush(self):
+        self.call(self.everywhere("flush"))
+
+    def save_data(self):
+        self.call(self.everywhere("save_data"))
+
+    # stops every shard after it wrote everything out, safe to call twice
+    def close(self):
+        if not self.processes:
+            return
+        for conn in self.conns:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+        self.processes = []
+        self.intents.close()
+        atexit.unregister(self.close)
+
+# shows a feed in a Text widget one window at a time, one line per post
+# pages are fetched from the app as the user scrolls down, and only max_lines posts are kept in the widget,
+# the ones scrolled far out of view are dropped and put back from posts when scrolled to again
+class FeedView:
+    def __init__(self, text, fetch, page=50, max_lines=250, metrics=None):
+        self.text = text
+        self.metrics = metrics # Metrics the time spent changing the widget goes to, as "gui.render"
+        self.fetch = fetch # fetch(limit, cursor) -> the next posts newest first
+        self.page = page # posts fetched and drawn at a time
+        self.max_lines = max_lines # visible window plus buffer on both sides
+        self.set_scrollbar = text.vbar.set
+        text.configure(yscrollcommand=self.scrolled, state=tk.DISABLED) # read only, lines must stay one per post
+        self.posts = [] # every post fetched so far, newest first
+        self.first = 0 # index in posts of the first line in the widget
+        self.shown = 0 # lines in the widget
+        self.complete = False # nothing older than posts[-1] is left to fetch
+        self.checking = False # a scroll check is already scheduled
+
+    @staticmethod
+    def line(post):
+        stamp = time.strftime(TIME_FORMAT, time.gmtime(post.epoch)) # epochs are naive seconds, gmtime keeps them as is
+        return f"{post.author} [{stamp}]: {post.content.replace(chr(10), ' ')}\n"
+
+    # Text line number of the first visible line
+    def top_line(self):
+        return int(self.text.index("@0,0").split(".")[0])
+
+    def edit(self, change):
+        start = time.perf_counter_ns()
+        self.text.configure(state=tk.NORMAL)
+        change()
+        self.text.configure(state=tk.DISABLED)
+        if self.metrics is not None and self.metrics.enabled:
+            self.metrics.record("gui.render", time.perf_counter_ns() - start)
+
+    def clear(self):
+        self.edit(lambda: self.text.delete("1.0", tk.END))
+        self.posts = []
+        self.first = self.shown = 0
+        self.complete = False
+
+    # start again from the newest posts
+    def reset(self):
+        self.clear()
+        self.show_below()
+
+    # the Text scrolled, keep the scrollbar in step and look at what to draw once Tk is idle
+    def scrolled(self, top, bottom):
+        self.set_scrollbar(top, bottom)
+        if not self.checking:
+            self.checking = True
+            self.text.after_idle(self.check)
+
+    def check(self):
+        self.checking = False
+        top, bottom = self.text.yview()
+        if bottom > 0.9:
+            self.show_below()
+        elif top < 0.1 and self.first > 0:
+            self.show_above()
+
+    # draw the next page under the last line, fetching it first if it is not loaded yet
+    def show_below(self):
+        end = self.first + self.shown
+        if end == len(self.posts) and not self.complete:
+            more = self.fetch(self.page, self.posts[-1] if self.posts else None)
+            self.complete = len(more) < self.page
+            self.posts += more
+        chunk = self.posts[end:end + self.page]
+        if not chunk:
+            return
+        top = self.top_line()
+        extra = max(0, self.shown + len(chunk) - self.max_lines)
+        def change():
+            self.text.insert(tk.END, "".join(map(self.line, chunk))) # one insert for the whole page
+            if extra:
+                self.text.delete("1.0", f"{extra + 1}.0")
+                self.text.yview(f"{max(1, top - extra)}.0") # keep the same lines in view
+        self.edit(change)
+        self.first += extra
+        self.shown += len(chunk) - extra
+
+    # draw the page above the first line again from posts
+    def show_above(self):
+        count = min(self.page, self.first)
+        top = self.top_line()
+        self.first -= count
+        chunk = self.posts[self.first:self.first + count]
+        extra = max(0, self.shown + count - self.max_lines)
+        def change():
+            self.text.insert("1.0", "".join(map(self.line, chunk)))
+            if extra:
+                self.text.delete(f"{self.shown + count - extra + 1}.0", tk.END)
+            self.text.yview(f"{top + count}.0")
+        self.edit(change)
+        self.shown += count - extra
+
+    # put posts newer than the newest one fetched on top, leaving the rest alone
+    def add_newer(self):
+        if not self.posts:
+            return self.reset()
+        key = TimelineIndex.key(self.posts[0])
+        newest = [post for post in self.fetch(self.page, None) if TimelineIndex.key(post) > key]
+        if len(newest) == self.page: # there may be even more in between, start over
+            return self.reset()
+        self.posts[:0] = newest
+        if self.first > 0 or not newest: # the top is not drawn, they show up when scrolled to
+            self.first += len(newest)
+            return
+        extra = max(0, self.shown + len(newest) - self.max_lines)
+        def change():
+            self.text.insert("1.0", "".join(map(self.line, newest)))
+            if extra:
+                self.text.delete(f"{self.shown + len(newest) - extra + 1}.0", tk.END)
+        self.edit(change)
+        self.shown += len(newest) - extra
+
+    # take one post out of the feed, deleting its line if it is drawn
+    def remove(self, post_id):
+        for index, post in enumerate(self.posts):
+            if post.id == post_id:
+                break
+        else:
+            return
+        del self.posts[index]
+        if index < self.first:
+            self.first -= 1
+        elif index < self.first + self.shown:
+            line = index - self.first + 1
+            self.edit(lambda: self.text.delete(f"{line}.0", f"{line + 1}.0"))
+            self.shown -= 1
 
 #Social media GUI
 class SocialMediaGUI:
@@ -406,10 +3607,13 @@ class SocialMediaGUI:
         #display for post feed
         self.feed_box = scrolledtext.ScrolledText(self.frame_bottom,width =60, height =20)
         self.feed_box.pack()
+        self.feed = FeedView(self.feed_box, lambda limit, cursor: self.app.get_feed(self.current_user, limit, cursor),
+                             metrics=self.app.metrics)
 
         #screen buttons
         tk.Button(self.root, text ="Send Friend Request", command = self.send_friend_request).pack(pady=5)
         tk.Button(self.root, text ="Show Friend Requests",command = self.show_friend_requests).pack(pady=5)
+        tk.Button(self.root, text ="People You May Know", command = self.suggest_friends_gui).pack(pady=5)
         tk.Button(self.root, text ="Show Notifications", command = self.show_notifications).pack(pady=5)
         tk.Button(self.root, text="Search Post By Timestamp", command = self.search_post_gui).pack(pady=5)
         tk.Button(self.root, text ="Search User by username", command= self.search_user_gui).pack(pady=5)
@@ -445,6 +3649,7 @@ class SocialMediaGUI:
         if messagebox.askyesno("Logout","Are you sure you want to log out?"):
             self.current_user = None
             self.label_current_user.config(text="Not signed in")
+            self.feed.clear()
             messagebox.showinfo("Logged out", "You have been logged out")
                 
     #create a post through GUI
@@ -456,7 +3661,7 @@ class SocialMediaGUI:
         msg = self.app.create_post(self.current_user,content)
         messagebox.showinfo("Post",msg)
         self.entry_post.delete(0, tk.END)
-        self.refresh_feed()
+        self.feed.add_newer()
     #delete post through GUI
     def delete_post_gui(self):
         if not self.current_user:
@@ -471,9 +3676,17 @@ class SocialMediaGUI:
         except ValueError:
             messagebox.showerror("Error", "Invalid timestamp format")
             return
-        msg = self.app.delete_post(self.current_user,target_ts)
+        matches = self.app.search_posts_by_timestamp(self.current_user, target_ts)
+        post_id = None
+        if len(matches) > 1: # several posts in the same second, ask which one
+            listing = "\n".join(f"{p.id}: {p.content}" for p in matches)
+            post_id = simpledialog.askinteger("Delete Post", f"Several posts have that timestamp, enter the id to delete:\n{listing}")
+            if post_id is None:
+                return
+        msg = self.app.delete_post(self.current_user,target_ts, post_id)
         messagebox.showinfo("Delete Post", msg)
-        self.refresh_feed()
+        if msg == "post has been delete":
+            self.feed.remove(matches[0].id if post_id is None else post_id)
     #search for post through GUI
     def search_post_gui(self):
         #GUI interface to search for post by timestamp
@@ -488,9 +3701,9 @@ class SocialMediaGUI:
         except ValueError:
             messagebox.showerror("Error", "Invalid timestamp formatting")
             return
-        post = self.app.search_post_by_timestamp(self.current_user, target_ts)
-        if post:
-            messagebox.showinfo("Post found",f"{post.author} [{post.timestamp.strftime('%d-%m-%Y %H:%M:%S')}]: {post.content}")#
+        posts = self.app.search_posts_by_timestamp(self.current_user, target_ts)
+        if posts:
+            messagebox.showinfo("Post found","\n".join(f"{post.author} [{post.timestamp.strftime('%d-%m-%Y %H:%M:%S')}]: {post.content}" for post in posts))#
         else:
             messagebox.showinfo("Post not found", "No post at that current timestamp")
     #search user through GUI
@@ -507,15 +3720,11 @@ class SocialMediaGUI:
             messagebox.showinfo(f"User: {username}", f"Friends: {friends}\nPosts:\n{posts}")
         else:
             messagebox.showinfo("Not found", f"No user found with username '{username}'")
-    ## refresh feedbox
+    ## refresh feedbox, reloads from the newest post, the rest comes in as the user scrolls
     def refresh_feed(self):
         if not self.current_user:
             return
-        posts = self.app.get_feed(self.current_user)
-        self.feed_box.delete("1.0",tk.END)
-
-        for p in posts:
-            self.feed_box.insert(tk.END,f"{p.author} [{p.timestamp.strftime('%d-%m-%Y %H:%M:%S')}]: {p.content}\n")
+        self.feed.reset()
     #send friend request through GUI
     def send_friend_request(self):
         if not self.current_user:
@@ -533,21 +3742,894 @@ class SocialMediaGUI:
             return
         user_obj = self.app.users.get(self.current_user)
         requests = user_obj.friend_requests
-        for fr in requests.copy(): # makes copy so it doesnt amend
-            answer = messagebox.askyesno("Friend Request", f"{fr.sender} sent you a request. Accept?")
-            if answer:
-                self.app.accept_friend_request(self.current_user, fr.sender)
-            else:
-                self.app.decline_friend_request(self.current_user, fr.sender)
+        with self.app.batch(): # every answer is written in one go
+            for fr in requests: # answering puts a new tuple on the user, this one stays as it is
+                answer = messagebox.askyesno("Friend Request", f"{fr.sender} sent you a request. Accept?")
+                if answer:
+                    self.app.accept_friend_request(self.current_user, fr.sender)
+                else:
+                    self.app.decline_friend_request(self.current_user, fr.sender)
         self.refresh_feed()
+    #friend suggestions through GUI
+    def suggest_friends_gui(self):
+        if not self.current_user:
+            messagebox.showwarning("Not logged in", "please login first")
+            return
+        suggestions = self.app.suggest_friends(self.current_user)
+        if suggestions:
+            messagebox.showinfo("People You May Know", "\n".join(f"{name} ({count} mutual friends)" for name, count in suggestions))
+        else:
+            messagebox.showinfo("People You May Know", "No suggestions yet")
     #show notifications
     def show_notifications(self):
-        notifications = self.app.get_notifications()
+        if not self.current_user:
+            messagebox.showwarning("Not logged in", "please login first")
+            return
+        notifications = self.app.get_notifications(self.current_user)
         if notifications:
-            messagebox.showinfo("Notifications", "\n".join(notifications))
+            messagebox.showinfo("Notifications", "\n".join(message for _, message in notifications))
         else:
             messagebox.showinfo("Notifcations", "No new notifications")
+# headless HTTP/JSON api over an app, run with: python "Social Media Project.py" serve [port]
+# GET /metrics gives the app's metrics snapshot, POST /profiler starts sampling and DELETE /profiler stops it
+# and returns what it saw, bind to a public host only behind something that keeps those to operators
+# every request is handled on the event loop thread, so the app only ever sees one caller at a time:
+# the loop is the single writer and the readers never see a half applied mutation,
+# disk writes already happen on the persistence thread so nothing here waits for the disk
+# log in with POST /login and send the token back as "Authorization: Bearer <token>"
+class ApiServer:
+    MAX_BODY = 1 << 20
+    MAX_PAGE = 1000 # most posts, notifications or rows one request returns
+    MAX_SESSIONS = 100_000 # logging in past this drops the oldest session
+    SESSION_SECONDS = 24 * 3600 # a token works this long after its login
+    REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+               500: "Internal Server Error"}
+    SUCCESS = SocialMediaApp.SUCCESS # answers that went through, anything else is reported as a 400
+    # (method, path with * for a parameter, handler, needs a logged in user)
+    ROUTES = [
+        ("POST", ("register",), "register", False),
+        ("POST", ("login",), "login", False),
+        ("POST", ("logout",), "logout", True),
+        ("POST", ("posts",), "create_post", True),
+        ("DELETE", ("posts", "*"), "delete_post", True),
+        ("GET", ("feed",), "feed", True),
+        ("GET", ("search",), "search", False),
+        ("GET", ("friend-requests",), "friend_requests", True),
+        ("POST", ("friend-requests",), "send_friend_request", True),
+        ("POST", ("friend-requests", "*", "accept"), "accept_friend_request", True),
+        ("POST", ("friend-requests", "*", "decline"), "decline_friend_request", True),
+        ("GET", ("notifications",), "notifications", True),
+        ("GET", ("metrics",), "metrics", False),
+        ("GET", ("analytics",), "analytics", False),
+        ("POST", ("profiler",), "start_profiler", False),
+        ("DELETE", ("profiler",), "stop_profiler", False),
+    ]
+
+    def __init__(self, app, host="127.0.0.1", port=8080):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.sessions = {} # token -> (username, monotonic time it expires), oldest first
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1] # the real port when 0 was asked for
+        return self.server
+
+    def run(self):
+        async def main():
+            async with await self.start():
+                print(f"serving on http://{self.host}:{self.port}")
+                await self.server.serve_forever()
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass
+
+    # one connection, requests are answered in order and the connection is kept open between them
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = headers.get("content-length", "0")
+                body = None # no body was read, so the connection is closed after the answer
+                if len(request) != 3 or not request[2].startswith("HTTP/"):
+                    status, payload = 400, {"error": "malformed request line"}
+                elif not (length.isascii() and length.isdigit()): # also refuses a negative length
+                    status, payload = 400, {"error": f"bad content-length: {length!r}"}
+                elif int(length) > self.MAX_BODY:
+                    status, payload = 413, {"error": "body too large"}
+                else:
+                    method, target, version = request
+                    body = await reader.readexactly(int(length))
+                    status, payload = self.dispatch(method, target, headers, body)
+                data = json.dumps(payload).encode()
+                keep_alive = body is not None and version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n%s\r\n%s"
+                             % (status, self.REASONS[status].encode(), len(data),
+                                b"" if keep_alive else b"Connection: close\r\n", data))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError): # client went away or the line was too long
+            pass
+        finally:
+            writer.close()
+
+    # find the route and call its handler, returns (status, json payload)
+    def dispatch(self, method, target, headers, body):
+        url = urllib.parse.urlsplit(target)
+        parts = tuple(urllib.parse.unquote(part) for part in url.path.strip("/").split("/"))
+        status = 404
+        for route_method, pattern, name, needs_user in self.ROUTES:
+            if len(pattern) != len(parts) or any(p != "*" and p != part for p, part in zip(pattern, parts)):
+                continue
+            if route_method != method:
+                status = 405 # the path exists with another method
+                continue
+            args = [part for p, part in zip(pattern, parts) if p == "*"]
+            user = None
+            if needs_user:
+                user = self.session_user(headers.get("authorization", "")[len("Bearer "):])
+                if user is None:
+                    return 401, {"error": "log in first"}
+            try:
+                data = json.loads(body) if body else {}
+                query = dict(urllib.parse.parse_qsl(url.query))
+                return getattr(self, name)(user, data, query, *args)
+            except (KeyError, TypeError, ValueError) as e:
+                return 400, {"error": f"bad request: {e!r}"}
+            except Exception as e: # keep serving, the client gets a 500
+                print(f"{method} {target} failed: {e!r}", file=sys.stderr)
+                return 500, {"error": "internal error"}
+        return status, {"error": "no such endpoint" if status == 404 else "method not allowed"}
+
+    def reply(self, message):
+        return (200 if message in self.SUCCESS else 400), {"message": message}
+
+    @staticmethod
+    def post_json(post):
+        return {"id": post.id, "author": post.author, "content": post.content,
+                "timestamp": time.strftime(TIME_FORMAT, time.gmtime(post.epoch))}
+
+    # a page of posts plus the cursor of the next page, a cursor is just "epoch-id" of the last post
+    def page(self, posts, limit):
+        following = f"{posts[-1].epoch}-{posts[-1].id}" if posts and limit is not None and len(posts) == limit else None
+        return 200, {"posts": [self.post_json(post) for post in posts], "next": following}
+
+    @staticmethod
+    def cursor(query):
+        if "cursor" not in query:
+            return None
+        epoch, post_id = query["cursor"].split("-")
+        return Post.from_epoch("", "", int(epoch), int(post_id)) # only its (epoch, id) key is used
+
+    # ?limit= of a page, from 1 up to MAX_PAGE, anything below 1 is a bad request (a ValueError, so a 400)
+    @classmethod
+    def limit(cls, query, default=50):
+        limit = int(query.get("limit", default))
+        if limit < 1:
+            raise ValueError(f"limit must be at least 1, got {limit}")
+        return min(limit, cls.MAX_PAGE)
+
+    def register(self, user, data, query):
+        return self.reply(self.app.register(str(data["username"]), str(data["password"])))
+
+    # the user a token belongs to, None when it is unknown or has expired
+    def session_user(self, token):
+        session = self.sessions.get(token)
+        if session is None or session[1] <= time.monotonic():
+            return None
+        return session[0]
+
+    # sessions are kept in login order and all live as long, so the expired ones are always at the front
+    def add_session(self, username):
+        now = time.monotonic()
+        while self.sessions:
+            oldest = next(iter(self.sessions))
+            if self.sessions[oldest][1] > now and len(self.sessions) < self.MAX_SESSIONS:
+                break
+            del self.sessions[oldest]
+        token = secrets.token_hex(16)
+        self.sessions[token] = (username, now + self.SESSION_SECONDS)
+        return token
+
+    def login(self, user, data, query):
+        username = str(data["username"])
+        message = self.app.login(username, str(data["password"]))
+        if "succesful" not in message:
+            return 401, {"error": message}
+        return 200, {"message": message, "token": self.add_session(username)}
+
+    # ends every session of the user, not only the one the request came with
+    def logout(self, user, data, query):
+        for token in [t for t, (name, expires) in self.sessions.items() if name == user]:
+            del self.sessions[token]
+        return 200, {"message": "logged out"}
+
+    def create_post(self, user, data, query):
+        return self.reply(self.app.create_post(user, str(data["content"])))
+
+    def delete_post(self, user, data, query, post_id):
+        return self.reply(self.app.delete_post_by_id(user, int(post_id)))
+
+    def feed(self, user, data, query):
+        limit = self.limit(query)
+        return self.page(self.app.get_feed(user, limit, self.cursor(query)), limit)
+
+    def search(self, user, data, query):
+        limit = self.limit(query)
+        posts = self.app.search_posts(query.get("q", ""), limit, query.get("prefix") == "1", query.get("author"))
+        return 200, {"posts": [self.post_json(post) for post in posts]}
+
+    def friend_requests(self, user, data, query):
+        requests = self.app.users.get(user).friend_requests
+        return 200, {"requests": [{"sender": fr.sender, "timestamp": fr.timestamp.strftime(TIME_FORMAT)} for fr in requests]}
+
+    def send_friend_request(self, user, data, query):
+        return self.reply(self.app.send_friend_request(user, str(data["receiver"])))
+
+    def accept_friend_request(self, user, data, query, sender):
+        return self.reply(self.app.accept_friend_request(user, sender))
+
+    def decline_friend_request(self, user, data, query, sender):
+        return self.reply(self.app.decline_friend_request(user, sender))
+
+    def metrics(self, user, data, query):
+        return 200, self.app.metrics_snapshot()
+
+    # trending words, hashtags and posters and event rates, over the last minutes (default 60)
+    def analytics(self, user, data, query):
+        if self.app.analytics is None:
+            return 404, {"error": "analytics are off"}
+        minutes = int(query.get("minutes", 60))
+        if not 1 <= minutes <= self.app.analytics.max_minutes():
+            raise ValueError(f"minutes must be from 1 to {self.app.analytics.max_minutes()}, got {minutes}")
+        return 200, self.app.analytics.snapshot(minutes, self.limit(query, 10))
+
+    def start_profiler(self, user, data, query):
+        self.app.metrics.start_profiler(float(query.get("interval", 0.005)))
+        return 200, {"message": "profiling"}
+
+    def stop_profiler(self, user, data, query):
+        return 200, self.app.metrics.stop_profiler(self.limit(query, 20))
+
+    # without since the unread ones are returned and marked read, like get_notifications
+    def notifications(self, user, data, query):
+        since = int(query["since"]) if "since" in query else None
+        limit = self.limit(query) if "limit" in query else None
+        notifications = self.app.get_notifications(user, since, limit)
+        return 200, {"notifications": [{"seq": seq, "message": message} for seq, message in notifications],
+                     "unread": self.app.unread_notifications(user)}
+
+#Benchmarks, run with: python "Social Media Project.py" bench <name>
+class Benchmarks:
+    # lookup latency of the resizing table against the old fixed 50 bucket table
+    @staticmethod
+    def hashtable(sizes=(1000, 100000, 1000000), lookups=2000):
+        print(f"{'keys':>9} {'fixed ns/get':>14} {'resizing ns/get':>16} {'buckets':>9}")
+        for n in sizes:
+            keys = [f"user{i}" for i in range(n)]
+            fixed = HashTable(resizable=False)
+            for key in keys: # keys are unique so chain them directly, insert() would walk every chain first
+                index = fixed.hash(key)
+                node = Node(key, key)
+                node.next = fixed.table[index]
+                fixed.table[index] = node
+            fixed.count = n
+            resizing = HashTable()
+            for key in keys: # one by one so the incremental growth is part of the picture
+                resizing.insert(key, key)
+            sample = random.sample(keys, min(lookups, n))
+            results = []
+            for table in (fixed, resizing):
+                start = time.perf_counter()
+                for key in sample:
+                    table.get(key)
+                results.append((time.perf_counter() - start) / len(sample) * 1e9)
+            print(f"{n:>9} {results[0]:>14.0f} {results[1]:>16.0f} {resizing.size:>9}")
+
+    # bytes per post of the old dict based Post against the slotted Post, with and without the string arena
+    @staticmethod
+    def memory(n=100000):
+        n = int(n)
+        class LegacyPost: # the Post class before __slots__, with a datetime per post
+            def __init__(self,author, content, timestamp):
+                self.author = author
+                self.content = content
+                self.timestamp = timestamp
+        now = datetime.now().replace(microsecond=0)
+        text = "post number {} about nothing in particular"
+        builds = [
+            ("legacy", lambda i, arena: LegacyPost("someone", text.format(i), now + timedelta(seconds=i))),
+            ("slots", lambda i, arena: Post("someone", text.format(i), now + timedelta(seconds=i), i)),
+            ("slots+arena", lambda i, arena: Post("someone", text.format(i), now + timedelta(seconds=i), i, arena)),
+        ]
+        print(f"python {sys.version.split()[0]}, {n} posts")
+        for name, build in builds:
+            tracemalloc.start()
+            arena = StringArena()
+            posts = [build(i, arena) for i in range(n)]
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print(f"{name:>12} {used / n:>8.1f} bytes/post")
+            del posts, arena
+
+    # the recursive merge sort this project used to have against the natural merge sort, with sorted() for scale
+    # the inputs are the shapes the app sorts: one timeline in order, nearly in order, every users timeline
+    # one after another (load_everything), plus random and reversed, all sorted by TimelineIndex.key
+    @staticmethod
+    def sort(n=200000, users=1000):
+        n, users = int(n), int(users)
+        def legacy_sort(arr, key):
+            if len(arr) <= 1:
+                return arr
+            mid = len(arr) // 2
+            left, right = legacy_sort(arr[:mid], key), legacy_sort(arr[mid:], key)
+            result = []
+            i = j = 0
+            while i < len(left) and j < len(right):
+                if key(left[i]) <= key(right[j]):
+                    result.append(left[i])
+                    i += 1
+                else:
+                    result.append(right[j])
+                    j += 1
+            result.extend(left[i:])
+            result.extend(right[j:])
+            return result
+        rng = random.Random(1)
+        posts = [Post.from_epoch("someone", "", 1700000000 + i // 3, i) for i in range(n)]
+        nearly = list(posts)
+        for _ in range(n // 100):
+            i, j = rng.randrange(n), rng.randrange(n)
+            nearly[i], nearly[j] = nearly[j], nearly[i]
+        shuffled = rng.sample(posts, n)
+        inputs = [("sorted", posts), ("nearly sorted", nearly),
+                  (f"{users} timelines", [p for u in range(users) for p in posts[u::users]]),
+                  ("random", shuffled), ("reversed", posts[::-1])]
+        print(f"{n} posts")
+        print(f"{'input':>16} {'recursive s':>12} {'natural s':>10} {'sorted() s':>11}")
+        for name, data in inputs:
+            times = []
+            for sort in (lambda: legacy_sort(data, TimelineIndex.key), lambda: Sorter.merge_sort(data, TimelineIndex.key),
+                         lambda: sorted(data, key=TimelineIndex.key)):
+                began = time.perf_counter()
+                sort()
+                times.append(time.perf_counter() - began)
+            print(f"{name:>16} {times[0]:>12.3f} {times[1]:>10.3f} {times[2]:>11.3f}")
+        for k in (20, 100):
+            began = time.perf_counter()
+            Sorter.top_k(shuffled, k, TimelineIndex.key)
+            heap = time.perf_counter() - began
+            began = time.perf_counter()
+            Sorter.merge_sort(shuffled, TimelineIndex.key)[-k:]
+            full = time.perf_counter() - began
+            print(f"newest {k} of random: top_k {heap:.3f} s, full sort {full:.3f} s")
+
+    # startup time of the old single json document against the lazy line per user snapshot
+    @staticmethod
+    def startup(sizes=(10000, 100000, 1000000), posts_per_user=10):
+        print(f"{'posts':>9} {'json load s':>12} {'lazy load s':>12} {'first feed ms':>14}")
+        for n in sizes:
+            folder = tempfile.mkdtemp()
+            users = max(1, n // posts_per_user)
+            start = Epoch.from_datetime(datetime(2024, 1, 1))
+            legacy = {"users": {}}
+            header = {"format": 2, "last_seq": 0, "next_post_id": n + 1}
+            with open(os.path.join(folder, "lazy.json"), "wb") as f:
+                f.write(json.dumps(header).encode() + b"\n")
+                for u in range(users):
+                    name = f"user{u}"
+                    friends = [f"user{(u + k) % users}" for k in (1, 2, 3) if (u + k) % users != u]
+                    ids = range(u * posts_per_user + 1, (u + 1) * posts_per_user + 1)
+                    posts = [[i, start + i, f"post {i} from {name}"] for i in ids]
+                    record = {"password": "pw", "friends": friends, "posts": posts, "friend_requests": []}
+                    f.write(b"%s\t%d\t%s\n" % (json.dumps(name).encode(), len(posts), json.dumps(record).encode()))
+                    legacy["users"][name] = {"password": "pw", "friends": friends, "friend_requests": [],
+                                             "posts": [{"id": i, "content": c, "timestamp": Epoch.to_datetime(t).strftime(TIME_FORMAT)}
+                                                       for i, t, c in posts]}
+            with open(os.path.join(folder, "legacy.json"), "w") as f:
+                json.dump(legacy, f, indent=4)
+            del legacy
+            times = []
+            for name in ("legacy.json", "lazy.json"):
+                began = time.perf_counter()
+                app = SocialMediaApp(os.path.join(folder, name), background_writes=False)
+                times.append(time.perf_counter() - began)
+                if name == "lazy.json":
+                    began = time.perf_counter()
+                    app.login("user0", "pw")
+                    app.get_feed("user0", limit=20)
+                    times.append((time.perf_counter() - began) * 1000)
+                app.close()
+                del app
+            print(f"{n:>9} {times[0]:>12.2f} {times[1]:>12.2f} {times[2]:>14.1f}")
+            shutil.rmtree(folder)
+
+    # file size, startup, decoding every user and saving the json line snapshot against the binary one
+    @staticmethod
+    def formats(n=200000, posts_per_user=10):
+        n, posts_per_user = int(n), int(posts_per_user)
+        folder = tempfile.mkdtemp()
+        users = max(1, n // posts_per_user)
+        start = Epoch.from_datetime(datetime(2024, 1, 1))
+        lines = os.path.join(folder, "lines.json")
+        with open(lines, "wb") as f:
+            f.write(json.dumps({"format": 2, "last_seq": 0, "next_post_id": n + 1}).encode() + b"\n")
+            for u in range(users):
+                name = f"user{u}"
+                friends = [f"user{(u + k) % users}" for k in (1, 2, 3) if (u + k) % users != u]
+                ids = range(u * posts_per_user + 1, (u + 1) * posts_per_user + 1)
+                record = {"password": "pw", "friends": friends, "friend_requests": [],
+                          "posts": [[i, start + i, f"post {i} from {name}"] for i in ids]}
+                f.write(b"%s\t%d\t%s\n" % (json.dumps(name).encode(), posts_per_user, json.dumps(record).encode()))
+        binary = os.path.join(folder, "binary.bin")
+        SocialMediaApp.convert(lines, binary, "binary")
+        print(f"{n} posts")
+        print(f"{'format':>8} {'MB':>7} {'open s':>8} {'decode all s':>13} {'save s':>8}")
+        for name, path in (("lines", lines), ("binary", binary)):
+            size = os.path.getsize(path) / 1e6
+            began = time.perf_counter()
+            app = SocialMediaApp(path, background_writes=False)
+            opened = time.perf_counter() - began
+            began = time.perf_counter()
+            for lazy in app.users.values(): # decoding only, building users costs the same for both
+                lazy.storage.decode(lazy.raw)
+            parsed = time.perf_counter() - began
+            began = time.perf_counter()
+            app.save_data()
+            saved = time.perf_counter() - began
+            app.close()
+            del app
+            print(f"{name:>8} {size:>7.1f} {opened:>8.2f} {parsed:>13.2f} {saved:>8.2f}")
+        shutil.rmtree(folder)
+
+    # sqlite engine: posts per second with one transaction per post against batched ones, then feed and search latency
+    @staticmethod
+    def sqlite(n=100000, users=1000, friends=20):
+        n, users, friends = int(n), int(users), int(friends)
+        folder = tempfile.mkdtemp()
+        app = SqliteSocialMediaApp(os.path.join(folder, "bench.db"), batch_size=1)
+        names = [f"user{u}" for u in range(users)]
+        for name in names:
+            app.register(name, "pw")
+        app.flush()
+        app.batch_size = 1000
+        for u, name in enumerate(names): # a ring where everyone has the next friends users as friends
+            for k in range(1, friends // 2 + 1):
+                app.commit({"op": "friend_request", "sender": name, "receiver": names[(u + k) % users],
+                            "timestamp": datetime.now().strftime(TIME_FORMAT)})
+                app.commit({"op": "accept", "sender": name, "receiver": names[(u + k) % users]})
+        app.flush()
+        print(f"{n} posts, {users} users with {friends} friends each")
+        for batch_size in (1, 1000):
+            app.batch_size = batch_size
+            count = 1000 if batch_size == 1 else n
+            began = time.perf_counter()
+            for i in range(count):
+                app.create_post(names[i % users], f"post {i} about nothing in particular")
+            app.flush()
+            print(f"batch {batch_size:>5}: {count / (time.perf_counter() - began):>9.0f} posts/s")
+        for name, run in (("get_feed 20", lambda u: app.get_feed(u, 20)),
+                          ("search_user_posts", lambda u: app.search_user_posts(u, "nothing")),
+                          ("search_post_by_timestamp", lambda u: app.search_post_by_timestamp(u, datetime.now()))):
+            sample = random.sample(names, 200)
+            began = time.perf_counter()
+            for u in sample:
+                run(u)
+            print(f"{name:>24}: {(time.perf_counter() - began) / len(sample) * 1000:>7.2f} ms")
+        app.close()
+        shutil.rmtree(folder)
+
+    # synthetic snapshot in the json line format, returns the usernames, how many friends each has and some (author, epoch)
+    # friendships come from preferential attachment, every new user befriends `links` users picked in proportion
+    # to the friends they already have, so a few users are very popular and most have a handful (a power law)
+    # posts per user follow a pareto distribution around posts_per_user, spread over the last year, with words
+    # drawn from a zipf weighted vocabulary so some terms are everywhere and most are rare
+    @staticmethod
+    def generate(path, users=10000, posts_per_user=20, links=5, seed=1):
+        rng = random.Random(seed)
+        names = [f"user{u}" for u in range(users)]
+        friends = [set() for _ in range(users)]
+        ends = [] # both users of every friendship, a uniform pick from it is a pick by number of friends
+        for u in range(users):
+            targets = set(range(u)) if u <= links else set()
+            while len(targets) < min(links, u):
+                targets.add(rng.choice(ends))
+            for v in targets:
+                friends[u].add(v)
+                friends[v].add(u)
+                ends += (u, v)
+        vocabulary = [f"word{i}" for i in range(5000)] + [f"#tag{i}" for i in range(200)]
+        weights = list(accumulate(1 / (i + 1) for i in range(len(vocabulary))))
+        now = Epoch.from_datetime(datetime.now())
+        posts = [] # (epoch, author)
+        for u in range(users):
+            count = int(posts_per_user / 2 * rng.paretovariate(2)) # pareto(2) has mean 2
+            posts += [(now - rng.randrange(365 * 86400), u) for _ in range(count)]
+        posts.sort()
+        by_user = [[] for _ in range(users)]
+        for post_id, (epoch, u) in enumerate(posts, 1):
+            by_user[u].append([post_id, epoch, " ".join(rng.choices(vocabulary, cum_weights=weights, k=8))])
+        data = {"header": {"last_seq": 0, "next_post_id": len(posts) + 1},
+                "users": [(names[u], len(by_user[u]), {"password": "pw", "friends": sorted(names[v] for v in friends[u]),
+                                                       "posts": by_user[u], "friend_requests": []})
+                          for u in range(users)]}
+        JsonLinesStorage().write(path, data)
+        samples = [(names[u], epoch) for epoch, u in rng.sample(posts, min(10000, len(posts)))]
+        return names, [len(f) for f in friends], samples
+
+    # operation mix of the replay, relative weights
+    MIX = {"login": 10, "get_feed": 35, "get_feed_next_page": 5, "create_post": 15, "search_user_posts": 6,
+           "search_posts": 4, "search_post_by_timestamp": 5, "send_friend_request": 5, "accept_friend_request": 3,
+           "get_notifications": 6, "delete_post": 2, "suggest_friends": 2, "mutual_friends": 2}
+
+    # replay a mix of operations against an app loaded from a generated snapshot and save the results as json
+    # users are picked in proportion to their friends, popular users are the active ones
+    # per operation: count, throughput (calls per second spent in it), p50/p99 latency and the peak memory
+    # one call allocated (tracemalloc, measured in a second smaller pass so it does not slow the timings)
+    # also times startup, save_data, load_everything and the building blocks: HashTable, merge_sort, binary_search
+    # python "Social Media Project.py" bench run [out.json] [users] [ops]
+    @staticmethod
+    def run(out="bench.json", users=10000, ops=20000, posts_per_user=20, seed=1, memory_samples=50):
+        users, ops = int(users), int(ops)
+        rng = random.Random(seed)
+        folder = tempfile.mkdtemp()
+        path = os.path.join(folder, "bench.json")
+        results = {"config": {"users": users, "ops": ops, "posts_per_user": posts_per_user, "seed": seed},
+                   "python": sys.version.split()[0], "platform": sys.platform,
+                   "date": datetime.now().strftime(TIME_FORMAT), "ops": {}, "steps": {}, "components": {}}
+        began = time.perf_counter()
+        names, degrees, samples = Benchmarks.generate(path, users, posts_per_user, seed=seed)
+        results["steps"]["generate_s"] = time.perf_counter() - began
+
+        began = time.perf_counter()
+        app = SocialMediaApp(path)
+        results["steps"]["startup_s"] = time.perf_counter() - began
+        cum = list(accumulate(d + 1 for d in degrees))
+        pick = lambda: rng.choices(names, cum_weights=cum)[0]
+        pending = [] # (sender, receiver) sent during the replay
+        created = [] # (author, post id) made during the replay
+        pages = {} # username -> last post of the first feed page they read
+        words = [f"word{i}" for i in range(50)] + ["#tag1", "word1 word2", "word3 word4 word5"]
+
+        def feed(u):
+            page = app.get_feed(u, 20)
+            if len(page) == 20:
+                pages[u] = page[-1]
+        def create(u):
+            app.create_post(u, " ".join(rng.sample(words, 3)))
+            created.append((u, app.next_post_id - 1))
+        def send(u):
+            v = pick()
+            if app.send_friend_request(u, v) == "Friend Request sent":
+                pending.append((u, v))
+        def accept(u):
+            if pending:
+                sender, receiver = pending.pop(rng.randrange(len(pending)))
+                app.accept_friend_request(receiver, sender)
+        def delete(u):
+            if created:
+                author, post_id = created.pop(rng.randrange(len(created)))
+                app.delete_post_by_id(author, post_id)
+        def by_timestamp(u):
+            author, epoch = rng.choice(samples)
+            app.search_post_by_timestamp(author, Epoch.to_datetime(epoch))
+        operations = {
+            "login": lambda u: app.login(u, "pw"),
+            "get_feed": feed,
+            "get_feed_next_page": lambda u: app.get_feed(u, 20, pages.get(u)),
+            "create_post": create,
+            "search_user_posts": lambda u: app.search_user_posts(u, rng.choice(words)),
+            "search_posts": lambda u: app.search_posts(rng.choice(words), limit=20),
+            "search_post_by_timestamp": by_timestamp,
+            "send_friend_request": send,
+            "accept_friend_request": accept,
+            "get_notifications": lambda u: app.get_notifications(u),
+            "delete_post": delete,
+            "suggest_friends": lambda u: app.suggest_friends(u),
+            "mutual_friends": lambda u: app.mutual_friends(u, pick()),
+        }
+        mix = list(Benchmarks.MIX)
+        mix_cum = list(accumulate(Benchmarks.MIX.values()))
+        latencies = {name: [] for name in mix}
+        clock = time.perf_counter_ns
+        began = time.perf_counter()
+        for name in rng.choices(mix, cum_weights=mix_cum, k=ops):
+            u = pick()
+            start = clock()
+            operations[name](u)
+            latencies[name].append(clock() - start)
+        app.flush() # whatever the worker still has belongs to the replay
+        results["steps"]["replay_s"] = time.perf_counter() - began
+        results["steps"]["ops_per_s"] = ops / (time.perf_counter() - began)
+
+        peaks = {}
+        tracemalloc.start()
+        for name in mix:
+            peak = 0
+            for _ in range(memory_samples):
+                u = pick()
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                operations[name](u)
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+            peaks[name] = peak
+        tracemalloc.stop()
+        app.flush()
+
+        for name in mix:
+            times = sorted(latencies[name])
+            if not times:
+                continue
+            results["ops"][name] = {"count": len(times),
+                                    "ops_per_s": len(times) / (sum(times) / 1e9),
+                                    "p50_us": times[len(times) // 2] / 1000,
+                                    "p99_us": times[min(len(times) - 1, len(times) * 99 // 100)] / 1000,
+                                    "peak_bytes": peaks[name]}
+        for step, action in (("save_data_s", lambda: (app.save_data(), app.flush())),
+                             ("load_everything_s", app.load_everything)):
+            began = time.perf_counter()
+            action()
+            results["steps"][step] = time.perf_counter() - began
+        app.close()
+        began = time.perf_counter()
+        SocialMediaApp(path, background_writes=False).close()
+        results["steps"]["reload_s"] = time.perf_counter() - began
+        shutil.rmtree(folder)
+
+        keys = [f"user{i}" for i in range(users)]
+        table = HashTable()
+        values = [rng.random() for _ in range(users * 10)]
+        for name, action in (("hashtable_insert", lambda: [table.insert(key, key) for key in keys]),
+                             ("hashtable_get", lambda: [table.get(key) for key in keys]),
+                             ("merge_sort", lambda: Sorter.merge_sort(values)),
+                             ("binary_search", lambda: [Search.binary_search(keys, key) for key in keys])):
+            if name == "binary_search":
+                keys.sort()
+            began = time.perf_counter_ns()
+            action()
+            results["components"][name + "_ns_per_item"] = (time.perf_counter_ns() - began) / (len(values) if name == "merge_sort" else users)
+
+        with open(out, "w") as f:
+            json.dump(results, f, indent=4)
+        Benchmarks.report(results)
+        return results
+
+    @staticmethod
+    def report(results):
+        print(f"{results['config']} python {results['python']}")
+        print(f"{'operation':>26} {'count':>7} {'ops/s':>10} {'p50 us':>9} {'p99 us':>9} {'peak KB':>9}")
+        for name, r in results["ops"].items():
+            print(f"{name:>26} {r['count']:>7} {r['ops_per_s']:>10.0f} {r['p50_us']:>9.1f} {r['p99_us']:>9.1f} {r['peak_bytes'] / 1024:>9.1f}")
+        for group in ("steps", "components"):
+            print(", ".join(f"{key} {value:.3g}" for key, value in results[group].items()))
+
+    # compare two saved runs, ratios above 1 mean the new run is slower (or uses more memory)
+    # python "Social Media Project.py" bench compare old.json new.json
+    @staticmethod
+    def compare(old, new):
+        with open(old) as f:
+            before = json.load(f)
+        with open(new) as f:
+            after = json.load(f)
+        print(f"{'operation':>26} {'p50':>7} {'p99':>7} {'peak':>7}")
+        for name, r in after["ops"].items():
+            if name not in before["ops"]:
+                continue
+            b = before["ops"][name]
+            ratios = [r[k] / b[k] if b[k] else float("nan") for k in ("p50_us", "p99_us", "peak_bytes")]
+            print(f"{name:>26} " + " ".join(f"{ratio:>6.2f}x" for ratio in ratios))
+        for group in ("steps", "components"):
+            for key, value in after[group].items():
+                if key in before[group] and before[group][key] and key != "ops_per_s":
+                    print(f"{key:>26} {value / before[group][key]:>6.2f}x")
+
+    # throughput of a mixed workload on one SocialMediaApp and on sharded deployments of the same snapshot
+    # the sharded runs go through run_many, so every shard works on its part of a window of operations at once
+    # speedup is against one shard and needs as many free cores as shards (cpu count is printed)
+    # python "Social Media Project.py" bench shards [users] [ops] [shard counts, like 1,2,4]
+    @staticmethod
+    def shards(users=20000, ops=50000, counts="1,2,4", posts_per_user=10, seed=1):
+        users, ops = int(users), int(ops)
+        rng = random.Random(seed)
+        folder = tempfile.mkdtemp()
+        path = os.path.join(folder, "bench.json")
+        names, degrees, _ = Benchmarks.generate(path, users, posts_per_user, seed=seed)
+        cum = list(accumulate(d + 1 for d in degrees))
+        words = [f"word{i}" for i in range(50)]
+        mix = {"get_feed": 45, "create_post": 20, "login": 10, "search_user_posts": 10, "get_notifications": 10,
+               "send_friend_request": 5}
+        workload = []
+        for name in rng.choices(list(mix), cum_weights=list(accumulate(mix.values())), k=ops):
+            u = rng.choices(names, cum_weights=cum)[0]
+            args = {"get_feed": (u, 20), "create_post": (u, " ".join(rng.sample(words, 3))), "login": (u, "pw"),
+                    "search_user_posts": (u, rng.choice(words)), "get_notifications": (u,),
+                    "send_friend_request": (u, rng.choices(names, cum_weights=cum)[0])}[name]
+            workload.append((name,) + args)
+        print(f"{users} users, {ops} ops, {os.cpu_count()} cpus")
+
+        app = SocialMediaApp(path)
+        app.load_everything()
+        began = time.perf_counter()
+        for name, *args in workload:
+            getattr(app, name)(*args)
+        app.flush()
+        print(f"{'single process':>16} {ops / (time.perf_counter() - began):>10.0f} ops/s")
+        app.close()
+
+        base = None
+        for count in [int(c) for c in str(counts).split(",")]:
+            sharded_path = os.path.join(folder, f"sharded{count}.json")
+            ShardedSocialMediaApp.split(path, sharded_path, count)
+            app = ShardedSocialMediaApp(sharded_path, count)
+            app.run_many([("get_feed", name) for name in names]) # load every user before timing
+            began = time.perf_counter()
+            app.run_many(workload)
+            app.flush()
+            rate = ops / (time.perf_counter() - began)
+            base = base or rate
+            print(f"{count:>9} shards {rate:>10.0f} ops/s {rate / base:>6.2f}x")
+            app.close()
+        shutil.rmtree(folder)
+
+    # cost of keeping Analytics up to date, its memory, query times and how close its top words are to exact counts
+    # posts are spread over the last three hours of a generated stream with zipf distributed words
+    # python "Social Media Project.py" bench analytics [posts]
+    @staticmethod
+    def analytics(posts=100000, seed=1):
+        posts = int(posts)
+        rng = random.Random(seed)
+        vocabulary = [f"word{i}" for i in range(5000)] + [f"#tag{i}" for i in range(200)]
+        weights = list(accumulate(1 / (i + 1) for i in range(len(vocabulary))))
+        now = Analytics.now()
+        stream = [(now - 3 * 3600 + i * 3 * 3600 // posts, f"user{rng.randrange(1000)}",
+                   " ".join(rng.choices(vocabulary, cum_weights=weights, k=8))) for i in range(posts)]
+        analytics = Analytics()
+        began = time.perf_counter()
+        for epoch, author, content in stream:
+            analytics.add("posts", epoch, author, content)
+        took = time.perf_counter() - began
+        tracemalloc.start() # memory of a second copy fed every tenth post, it has the same buckets
+        sample = Analytics()
+        for epoch, author, content in stream[::10]:
+            sample.add("posts", epoch, author, content)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"add {took / posts * 1e6:.1f} us per post, about {memory / 1e6:.1f} MB for {len(sample.minute_buckets)} minute"
+              f" and {len(sample.hour_buckets)} hour buckets")
+        for minutes in (5, 60, 180):
+            began = time.perf_counter()
+            top = analytics.top("words", minutes, 10, now)
+            took = time.perf_counter() - began
+            seconds = 60 if minutes <= 60 else 3600
+            since = now - now % seconds - (minutes * 60 - 1) // seconds * seconds
+            exact = {}
+            for epoch, author, content in stream:
+                if epoch >= since:
+                    for word in set(InvertedIndex.tokenize(Analytics.HASHTAG.sub(" ", content))):
+                        exact[word] = exact.get(word, 0) + 1
+            best = Sorter.top_k(exact.items(), 10, key=lambda item: item[1])
+            error = max(abs(count - exact[word]) / exact[word] for word, count in top)
+            print(f"top words over {minutes:>3} min: {took * 1e3:.2f} ms, {len({word for word, _ in top} & {word for word, _ in best})}/10"
+                  f" of the exact top 10, counts off by at most {error:.1%}")
+
+        folder = tempfile.mkdtemp()
+        for enabled in (False, True):
+            app = SocialMediaApp(os.path.join(folder, f"app{enabled}.json"), analytics=enabled)
+            for u in range(1000):
+                app.register(f"user{u}", "pw")
+            began = time.perf_counter()
+            for epoch, author, content in stream[:20000]:
+                app.create_post(author, content)
+            app.flush()
+            print(f"create_post with analytics {'on' if enabled else 'off'}: {(time.perf_counter() - began) / 20000 * 1e6:.1f} us")
+            app.close()
+        shutil.rmtree(folder)
+
+    # how long save_data holds up the app against building the whole snapshot on the caller like it used to,
+    # then reader threads doing feeds and searches of active users with and without a writer thread posting
+    # python "Social Media Project.py" bench snapshots [users] [posts] [readers] [seconds] [active users]
+    @staticmethod
+    def snapshots(users=20000, posts=200000, readers=4, seconds=3, active=2000, seed=1):
+        users, posts, readers, seconds, active = int(users), int(posts), int(readers), float(seconds), int(active)
+        rng = random.Random(seed)
+        folder = tempfile.mkdtemp()
+        app = SocialMediaApp(os.path.join(folder, "bench.json"), compact_every=10**9)
+        with app.batch():
+            for u in range(users):
+                app.register(f"user{u}", "pw")
+            for u in range(users):
+                for f in rng.sample(range(users), 5):
+                    if app.send_friend_request(f"user{u}", f"user{f}") == "Friend Request sent":
+                        app.accept_friend_request(f"user{f}", f"user{u}")
+            for i in range(posts):
+                app.create_post(f"user{rng.randrange(users)}", f"post {i} word{rng.randrange(1000)} hello")
+        app.flush()
+        began = time.perf_counter()
+        data = app.snapshot_data()
+        entries = list(data["users"]) # what save_data used to build before returning
+        inline = time.perf_counter() - began
+        began = time.perf_counter()
+        app.save_data()
+        pause = time.perf_counter() - began
+        app.flush()
+        written = time.perf_counter() - began
+        print(f"save_data: {pause * 1e3:.3f} ms on the caller, {written:.2f} s until written;"
+              f" building {len(entries)} users inline took {inline * 1e3:.0f} ms")
+
+        for u in range(active): # home timelines are built on the first read, not measured
+            app.get_feed(f"user{u}", 20)
+
+        def read(name, stop, counts, latencies):
+            local = random.Random(name)
+            done = 0
+            while not stop.is_set():
+                username = f"user{local.randrange(active)}"
+                began = time.perf_counter()
+                app.get_feed(username, 20)
+                app.search_user_posts(username, "hel")
+                latencies.append(time.perf_counter() - began)
+                done += 1
+            counts[name] = done
+
+        def write(stop, counts):
+            local = random.Random(seed)
+            done = 0
+            while not stop.is_set():
+                app.create_post(f"user{local.randrange(users)}", f"new post word{local.randrange(1000)}")
+                done += 1
+                if done % 5000 == 0:
+                    app.save_data() # snapshots are walked by the worker while everyone carries on
+            counts["writer"] = done
+
+        for with_writer in (False, True):
+            stop = threading.Event()
+            counts = {}
+            latencies = []
+            threads = [threading.Thread(target=read, args=(n, stop, counts, latencies)) for n in range(readers)]
+            if with_writer:
+                threads.append(threading.Thread(target=write, args=(stop, counts)))
+            for thread in threads:
+                thread.start()
+            time.sleep(seconds)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            latencies.sort()
+            reads = sum(count for name, count in counts.items() if name != "writer")
+            print(f"{readers} readers {'with' if with_writer else 'without'} a writer: {reads / seconds:.0f} reads/s,"
+                  f" {counts.get('writer', 0) / seconds:.0f} writes/s, read p50 {latencies[len(latencies) // 2] * 1e3:.2f} ms"
+                  f" p99 {latencies[len(latencies) * 99 // 100] * 1e3:.2f} ms")
+        app.close()
+        shutil.rmtree(folder)
+
 #run the app/system
 if __name__ == "__main__":
-    app = SocialMediaApp()
-    gui = SocialMediaGUI(app)
+    if len(sys.argv) > 2 and sys.argv[1] == "bench":
+        getattr(Benchmarks, sys.argv[2])(*sys.argv[3:])
+    elif len(sys.argv) > 3 and sys.argv[1] == "convert": # convert <src> <dst> [lines|binary|json]
+        SocialMediaApp.convert(*sys.argv[2:5])
+    elif len(sys.argv) > 4 and sys.argv[1] == "split": # split <src> <dst> <shards>
+        ShardedSocialMediaApp.split(*sys.argv[2:5])
+    elif len(sys.argv) > 1 and sys.argv[1] == "serve": # serve [port]
+        app = SocialMediaApp(metrics=True, analytics=True)
+        ApiServer(app, port=int(sys.argv[2]) if len(sys.argv) > 2 else 8080).run()
+        app.close()
+    else:
+        # python "Social Media Project.py" sqlite [path] keeps everything in a sqlite database instead
+        app = SqliteSocialMediaApp(*sys.argv[2:3]) if sys.argv[1:2] == ["sqlite"] else SocialMediaApp()
+        gui = SocialMediaGUI(app)
+        app.close() # window closed, release the log file
@@ -0,0 +1,1402 @@
+import asyncio
+import collections
+import importlib.util
+import itertools
+import json
+import os
+import random
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# the app is one script with spaces in its name, so it is loaded from its path
+PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Social Media Project.py")
+spec = importlib.util.spec_from_file_location("social_media_project", PATH)
+smp = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = smp # posts pickled by the shard processes name it
+spec.loader.exec_module(smp)
+
+
+# every test gets its own folder, apps opened with self.open are closed after it
+class AppTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "database.json")
+        self.apps = []
+
+    def tearDown(self):
+        for app in self.apps:
+            app.close()
+        shutil.rmtree(self.folder)
+
+    def open(self, **options):
+        app = smp.SocialMediaApp(self.path, **options)
+        self.apps.append(app)
+        return app
+
+    @staticmethod
+    def contents(posts):
+        return [post.content for post in posts]
+
+
+class WriteAheadLogTest(AppTest):
+    # the app is dropped without close or save_data, the next one rebuilds it from the log alone
+    def test_replay_after_crash(self):
+        app = self.open(background_writes=False)
+        app.register("ann", "pw")
+        app.register("bob", "pw")
+        app.create_post("ann", "hello world")
+        app.send_friend_request("ann", "bob")
+        app.accept_friend_request("bob", "ann")
+        self.assertFalse(os.path.exists(self.path)) # no snapshot was ever written
+
+        again = self.open(background_writes=False)
+        self.assertEqual(again.seq, app.seq)
+        self.assertEqual(again.users.get("bob").friends, {"ann"})
+        self.assertEqual(self.contents(again.get_feed("bob")), ["hello world"])
+
+    # a crash in the middle of an append leaves a torn line, it is cut off and the log carries on after it
+    def test_torn_last_record(self):
+        app = self.open(background_writes=False)
+        app.register("ann", "pw")
+        app.create_post("ann", "kept")
+        app.wal.close()
+        with open(app.wal.path, "a") as f:
+            f.write('{"op": "post", "author": "ann", "cont')
+
+        again = self.open(background_writes=False)
+        self.assertEqual(self.contents(again.get_feed("ann")), ["kept"])
+        again.create_post("ann", "after")
+        third = self.open(background_writes=False)
+        self.assertEqual(self.contents(third.get_feed("ann")), ["after", "kept"])
+
+    # a crash after the snapshot was written but before the log was emptied, records it holds are skipped
+    def test_snapshot_without_truncated_log(self):
+        app = self.open(background_writes=False)
+        app.register("ann", "pw")
+        app.create_post("ann", "once")
+        app.write_snapshot(app.snapshot_data())
+        app.create_post("ann", "twice")
+
+        again = self.open(background_writes=False)
+        self.assertEqual(self.contents(again.get_feed("ann")), ["twice", "once"])
+        self.assertEqual(again.total_posts(), 2)
+
+
+class FeedTest(AppTest):
+    # own and friends' posts newest first, read straight from every author's posts
+    @staticmethod
+    def merged(app, username):
+        user = app.users.get(username)
+        posts = [post for name in [username, *user.friends] for post in app.users.get(name).posts]
+        return sorted(posts, key=smp.TimelineIndex.key, reverse=True)
+
+    def make_app(self, **options):
+        app = self.open(background_writes=False, **options)
+        for name in ("ann", "bob", "cat", "dan"):
+            app.register(name, "pw")
+        for sender, receiver in (("bob", "ann"), ("cat", "ann"), ("cat", "dan")):
+            app.send_friend_request(sender, receiver)
+            app.accept_friend_request(receiver, sender)
+        for i in range(12):
+            app.create_post(("ann", "bob", "cat", "dan")[i % 4], f"post {i}")
+        return app
+
+    # cat has more friends than fanout_limit, their posts are merged in on read instead of pushed
+    def test_heavy_poster_is_pulled(self):
+        app = self.make_app(fanout_limit=1)
+        self.assertTrue(app.is_heavy(app.users.get("cat")))
+        for name in ("ann", "bob", "cat", "dan"):
+            self.assertEqual(app.get_feed(name), self.merged(app, name))
+
+    # pages reaching past the small home timeline are pulled from every author
+    def test_pages_past_the_inbox(self):
+        app = self.make_app(inbox_limit=2)
+        expected = self.merged(app, "ann")
+        pages = []
+        page = app.get_feed("ann", 4)
+        while page:
+            pages += page
+            page = app.get_feed("ann", 4, page[-1])
+        self.assertEqual(pages, expected)
+        self.assertEqual(self.contents(app.get_feed("ann", 3)), self.contents(expected[:3]))
+
+    def test_feed_after_reload(self):
+        app = self.make_app(fanout_limit=1, inbox_limit=3)
+        app.save_data()
+        app.create_post("bob", "after the snapshot")
+        again = self.open(background_writes=False, fanout_limit=1, inbox_limit=3)
+        self.assertEqual(self.contents(again.get_feed("ann")), self.contents(self.merged(app, "ann")))
+
+
+class SearchTest(AppTest):
+    def make_app(self):
+        app = self.open(background_writes=False)
+        app.register("ann", "pw")
+        app.register("bob", "pw")
+        for i in range(30): # bob has many posts with the words ann searches for
+            app.create_post("bob", f"hello help {i}")
+        app.create_post("ann", "Hello there")
+        app.create_post("ann", "helping out, no greeting")
+        app.create_post("ann", "nothing to see")
+        return app
+
+    # every word has to match, the last one (or all of them with prefix) as the start of a word
+    def test_search_user_posts(self):
+        app = self.make_app()
+        self.assertEqual(self.contents(app.search_user_posts("ann", "hel")), ["helping out, no greeting", "Hello there"])
+        self.assertEqual(self.contents(app.search_user_posts("ann", "hel gree")), ["helping out, no greeting"])
+        self.assertEqual(self.contents(app.search_user_posts("ann", "there")), ["Hello there"])
+        self.assertEqual(len(app.search_user_posts("ann", "")), 3) # no words, every post of theirs
+        self.assertEqual(app.search_user_posts("ann", "zzz"), [])
+        self.assertEqual(app.search_user_posts("nobody", "hel"), [])
+
+    def test_global_search(self):
+        app = self.make_app()
+        self.assertEqual(self.contents(app.search_posts("hello 29")), ["hello help 29"])
+        self.assertEqual(len(app.search_posts("hello")), 31)
+        self.assertEqual(self.contents(app.search_posts("hel*", limit=2)), ["helping out, no greeting", "Hello there"])
+        self.assertEqual(len(app.search_posts("hel*", author="bob")), 30)
+
+    def test_deleted_posts_are_not_found(self):
+        app = self.make_app()
+        post = app.search_user_posts("ann", "there")[0]
+        self.assertEqual(app.delete_post_by_id("ann", post.id), "post has been delete")
+        self.assertEqual(app.search_user_posts("ann", "there"), [])
+        self.assertEqual(self.contents(app.search_user_posts("ann", "hel")), ["helping out, no greeting"])
+
+    # prefixes are either merged into one list or looked up per candidate, both give the brute force answer
+    def test_index_against_brute_force(self):
+        rng = random.Random(5)
+        words = ["apple", "apricot", "banana", "band", "cherry", "ant"] + [f"w{i}" for i in range(40)]
+        index = smp.InvertedIndex()
+        posts = {}
+        for post_id in range(1, 600):
+            terms = rng.sample(words, 4) + ["@" + rng.choice(["ann", "bob", "cat"])]
+            if rng.random() < 0.02:
+                terms.append("@rare")
+            posts[post_id] = set(terms)
+            index.add(post_id, terms)
+        for _ in range(300):
+            terms = rng.sample(words + ["@ann", "@rare", "missing"], rng.randint(0, 2))
+            prefixes = rng.sample(["a", "ap", "ban", "w1", "c", "zz"], rng.randint(0 if terms else 1, 2))
+            limit = rng.choice([None, 1, 5])
+            expected = [post_id for post_id in sorted(posts, reverse=True)
+                        if all(term in posts[post_id] for term in terms)
+                        and all(any(word.startswith(p) for word in posts[post_id]) for p in prefixes)]
+            self.assertEqual(index.search(terms, prefixes, limit), expected[:limit], (terms, prefixes, limit))
+
+
+class NotificationTest(AppTest):
+    SENDERS = ("bob", "cat", "dan", "eve", "fay")
+
+    # five friend requests to ann, each one is a notification of hers
+    def make_app(self, **options):
+        app = self.open(background_writes=False, notification_limit=3, **options)
+        for name in ("ann",) + self.SENDERS:
+            app.register(name, "pw")
+        for name in self.SENDERS:
+            app.send_friend_request(name, "ann")
+        return app
+
+    def test_bounded_inbox(self):
+        app = self.make_app()
+        self.assertEqual(app.unread_notifications("ann"), 3)
+        self.assertEqual([seq for seq, message in app.get_notifications("ann", since=0)], [3, 4, 5])
+        self.assertEqual(app.get_notifications("ann", since=0)[-1][1], "fay sent a friend request to ann")
+
+    # the inbox and its read cursor come back from the log and from a snapshot
+    def test_persisted(self):
+        app = self.make_app()
+        self.assertEqual(len(app.get_notifications("ann")), 3) # reads and marks them
+        app.accept_friend_request("ann", "bob")
+        again = self.open(background_writes=False, notification_limit=3)
+        self.assertEqual(again.get_notifications("ann", since=0), app.get_notifications("ann", since=0))
+        self.assertEqual(again.unread_notifications("ann"), 0)
+        self.assertEqual(again.get_notifications("bob", since=0), [(1, "ann accepted bob's friend request")])
+
+        again.save_data()
+        again.decline_friend_request("ann", "cat")
+        third = self.open(background_writes=False, notification_limit=3)
+        self.assertEqual(third.get_notifications("ann", since=0), app.get_notifications("ann", since=0))
+        self.assertEqual(third.get_notifications("cat"), [(1, "ann declined cat's friend request")])
+        self.assertEqual(third.unread_notifications("cat"), 0)
+
+    # the sqlite engine keeps the same numbering and bound in its notifications table
+    def test_persisted_in_sqlite(self):
+        app = smp.SqliteSocialMediaApp(os.path.join(self.folder, "database.db"), notification_limit=3)
+        for name in ("ann",) + self.SENDERS:
+            app.register(name, "pw")
+        for name in self.SENDERS:
+            app.send_friend_request(name, "ann")
+        self.assertEqual(len(app.get_notifications("ann", limit=2)), 2)
+        app.close()
+        again = smp.SqliteSocialMediaApp(os.path.join(self.folder, "database.db"), notification_limit=3)
+        self.addCleanup(again.close)
+        self.assertEqual([seq for seq, message in again.get_notifications("ann", since=0)], [3, 4, 5])
+        self.assertEqual(again.unread_notifications("ann"), 1)
+
+
+# stands in for the WriteAheadLog and the snapshot writer, records the order things reach the "disk" in
+class FakeDisk:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def write_snapshot(self, data):
+        if self.fail:
+            raise OSError("disk full")
+        self.calls.append(("snapshot", data))
+
+    def reset(self):
+        self.calls.append(("reset", None))
+
+    def append_many(self, records):
+        self.calls.append(("append", records))
+
+
+class PersistenceWorkerTest(AppTest):
+    # only the newest snapshot is written, then the log is emptied, then the records after it are appended
+    def test_snapshot_then_truncate(self):
+        disk = FakeDisk()
+        worker = smp.PersistenceWorker(disk, disk.write_snapshot, debounce=10) # flush skips the debounce
+        for kind, item in (("record", 1), ("snapshot", "a"), ("record", 2), ("snapshot", "b"), ("record", 3), ("record", 4)):
+            worker.submit(kind, item)
+        worker.stop()
+        self.assertEqual(disk.calls, [("snapshot", "b"), ("reset", None), ("append", [3, 4])])
+
+    # the rename of a new snapshot reaches the disk, by an fsync of its folder, before the log is emptied
+    def test_folder_synced_before_truncate(self):
+        events = []
+        replace, fsync = os.replace, os.fsync
+        def recording_replace(src, dst):
+            replace(src, dst)
+            events.append(("replace", dst))
+        def recording_fsync(fd):
+            fsync(fd)
+            info = os.fstat(fd)
+            events.append(("fsync", "folder" if stat.S_ISDIR(info.st_mode) else info.st_ino))
+        self.addCleanup(setattr, os, "replace", replace)
+        self.addCleanup(setattr, os, "fsync", fsync)
+        os.replace, os.fsync = recording_replace, recording_fsync
+        for background_writes in (False, True):
+            with self.subTest(background_writes=background_writes):
+                self.path = os.path.join(self.folder, f"sync{background_writes}.json")
+                app = self.open(background_writes=background_writes)
+                app.register("ann", "pw")
+                app.flush()
+                del events[:]
+                app.save_data()
+                app.flush()
+                log = os.stat(app.wal.path).st_ino
+                self.assertIn(("replace", self.path), events)
+                replaced = events.index(("replace", self.path))
+                self.assertEqual(events[replaced + 1], ("fsync", "folder"))
+                self.assertGreater(events.index(("fsync", log), replaced), replaced)
+
+    # a snapshot that failed must leave the log alone and still get every record of its batch into it
+    def test_failed_snapshot_keeps_the_log(self):
+        disk = FakeDisk(fail=True)
+        worker = smp.PersistenceWorker(disk, disk.write_snapshot, debounce=10)
+        for kind, item in (("record", 1), ("snapshot", "a"), ("record", 2)):
+            worker.submit(kind, item)
+        with self.assertRaises(OSError):
+            worker.flush()
+        worker.stop()
+        self.assertEqual(disk.calls, [("append", [1, 2])])
+
+    # the snapshot file holds everything up to its seq and the log only what came after
+    def test_background_save(self):
+        app = self.open()
+        app.register("ann", "pw")
+        app.create_post("ann", "one")
+        app.save_data()
+        saved = app.seq
+        app.create_post("ann", "two")
+        app.flush()
+        self.assertEqual([record["seq"] for record in app.wal.read()], [saved + 1])
+        app.close()
+        again = self.open(background_writes=False)
+        self.assertEqual(self.contents(again.get_feed("ann")), ["two", "one"])
+
+    # a snapshot write that fails halfway leaves the old snapshot and a log that still rebuilds everything
+    def test_failed_save_loses_nothing(self):
+        app = self.open()
+        app.register("ann", "pw")
+        app.create_post("ann", "one")
+        app.save_data()
+        app.flush()
+
+        def broken(path, data):
+            with open(path, "w") as f:
+                f.write("half a snap")
+            raise OSError("disk full")
+        app.storage.write = broken
+        app.create_post("ann", "two")
+        app.save_data()
+        app.create_post("ann", "three")
+        with self.assertRaises(OSError):
+            app.flush()
+        app.close()
+        again = self.open(background_writes=False)
+        self.assertEqual(self.contents(again.get_feed("ann")), ["three", "two", "one"])
+
+
+class LazyLoadTest(AppTest):
+    FRIENDS = [f"friend{i}" for i in range(10)]
+
+    # users only split out of the snapshot, parsed on their first lookup
+    @staticmethod
+    def lazy_names(app):
+        return sorted(name for name, value in app.users.items() if value.__class__ is smp.LazyRecord)
+
+    def make_snapshot(self, storage):
+        app = self.open(background_writes=False, storage=storage)
+        for name in ("ann", "bob", "cat"):
+            app.register(name, "pw")
+        app.send_friend_request("ann", "bob")
+        app.accept_friend_request("bob", "ann")
+        app.send_friend_request("cat", "ann")
+        app.create_post("ann", "hello from ann")
+        app.create_post("bob", "hello from bob")
+        app.save_data()
+        app.create_post("cat", "after the snapshot") # replayed from the log onto cat, who is loaded for it
+        app.close()
+
+    def test_hydrated_on_first_lookup(self):
+        for storage in (smp.JsonLinesStorage, smp.BinaryStorage):
+            with self.subTest(storage=storage.__name__):
+                self.path = os.path.join(self.folder, storage.__name__)
+                self.make_snapshot(storage())
+                app = self.open(background_writes=False)
+                self.assertEqual(self.lazy_names(app), ["ann", "bob"])
+                self.assertEqual(app.total_users(), 3)
+                self.assertEqual(app.total_posts(), 3) # counted without parsing anyone
+
+                ann = app.users.get("ann")
+                self.assertEqual(self.lazy_names(app), ["bob"])
+                self.assertIs(app.users.get("ann"), ann) # built once
+                self.assertEqual(ann.friends, {"bob"})
+                self.assertEqual([request.sender for request in ann.friend_requests], ["cat"])
+                self.assertEqual(self.contents(ann.posts), ["hello from ann"])
+                self.assertEqual(app.login("ann", "pw"), "Log in succesful")
+
+    # a feed or search needing other users parses them on the way, a global one parses everybody
+    def test_hydrated_by_reads(self):
+        self.make_snapshot(smp.JsonLinesStorage())
+        app = self.open(background_writes=False)
+        self.assertEqual(self.contents(app.search_user_posts("bob", "hel")), ["hello from bob"])
+        self.assertEqual(self.lazy_names(app), ["ann"])
+        self.assertEqual(self.contents(app.get_feed("bob")), ["hello from bob", "hello from ann"])
+        self.assertEqual(self.lazy_names(app), [])
+
+        again = self.open(background_writes=False)
+        self.assertEqual(len(again.search_posts("hello")), 2)
+        self.assertEqual(self.lazy_names(again), [])
+        self.assertEqual(self.contents(again.get_global_feed()), ["after the snapshot", "hello from bob", "hello from ann"])
+
+    # a snapshot taken before anyone was looked up copies their unparsed records as they are
+    def test_saved_while_lazy(self):
+        self.make_snapshot(smp.JsonLinesStorage())
+        app = self.open(background_writes=False)
+        app.save_data()
+        app.close()
+        again = self.open(background_writes=False)
+        self.assertEqual(self.contents(again.get_global_feed()), ["after the snapshot", "hello from bob", "hello from ann"])
+        self.assertEqual(again.users.get("bob").friends, {"ann"})
+
+    def make_graph(self):
+        app = self.open(background_writes=False)
+        app.register("ann", "pw")
+        for name in self.FRIENDS:
+            app.register(name, "pw")
+            app.send_friend_request(name, "ann")
+            app.accept_friend_request("ann", name)
+        app.save_data()
+        app.create_post("ann", "replayed from the log")
+        app.close()
+
+    # a new post is only pushed to home timelines already built, friends still unparsed are left alone
+    def test_posting_leaves_friends_lazy(self):
+        self.make_graph()
+        app = self.open(background_writes=False)
+        self.assertEqual(self.lazy_names(app), sorted(self.FRIENDS)) # replaying ann's post parsed only her
+        app.get_feed("friend0") # builds friend0's home timeline
+        app.create_post("ann", "new")
+        self.assertEqual(self.lazy_names(app), sorted(self.FRIENDS[1:]))
+        self.assertEqual(self.contents(app.get_feed("friend0")), ["new", "replayed from the log"])
+        self.assertEqual(self.contents(app.get_feed("friend5")), ["new", "replayed from the log"])
+
+        post = app.search_user_posts("ann", "new")[0]
+        app.delete_post_by_id("ann", post.id)
+        self.assertEqual(self.lazy_names(app), sorted(self.FRIENDS[1:5] + self.FRIENDS[6:]))
+        self.assertEqual(self.contents(app.get_feed("friend0")), ["replayed from the log"])
+        self.assertEqual(self.contents(app.get_feed("friend9")), ["replayed from the log"])
+
+
+class BatchTest(AppTest):
+    def make_app(self):
+        app = self.open(background_writes=False)
+        app.register("ann", "pw")
+        app.register("bob", "pw")
+        app.create_post("ann", "before")
+        return app
+
+    def test_one_log_record(self):
+        app = self.make_app()
+        with app.batch():
+            app.create_post("ann", "one")
+            app.send_friend_request("ann", "bob")
+            app.accept_friend_request("bob", "ann")
+        self.assertEqual(app.wal.read()[-1]["op"], "batch")
+        again = self.open(background_writes=False)
+        self.assertEqual(self.contents(again.get_feed("bob")), ["one", "before"])
+
+    # an error in the block undoes every mutation made in it, in memory and on disk
+    def test_rollback(self):
+        app = self.make_app()
+        with self.assertRaises(ValueError):
+            with app.batch():
+                app.create_post("ann", "undone")
+                app.send_friend_request("ann", "bob")
+                app.accept_friend_request("bob", "ann")
+                raise ValueError("stop")
+        self.assertEqual(self.contents(app.get_feed("ann")), ["before"])
+        self.assertEqual(app.users.get("bob").friends, set())
+        self.assertEqual(app.get_notifications("ann", since=0), [])
+        app.create_post("ann", "after")
+        again = self.open(background_writes=False)
+        self.assertEqual(self.contents(again.get_feed("ann")), ["after", "before"])
+
+    # everything the users can see, to compare an app before a failed batch with after it
+    @staticmethod
+    def state(app, names):
+        view = lambda posts: [(post.id, post.author, post.content) for post in posts]
+        users = {}
+        for name in names:
+            user = app.users.get(name)
+            if user:
+                users[name] = (sorted(user.friends), [fr.sender for fr in user.friend_requests], view(app.get_feed(name)),
+                               app.get_notifications(name, since=0), app.unread_notifications(name))
+        return (users, view(app.get_global_feed()), view(app.search_posts("word")), app.total_users(), app.total_posts(),
+                sorted(app.graph.requests))
+
+    # random failed batches leave no trace, with full notification rings and trimmed home timelines too
+    def test_rollback_restores_everything(self):
+        rng = random.Random(19)
+        app = self.open(background_writes=False, notification_limit=3, inbox_limit=4)
+        names = [f"user{i}" for i in range(8)]
+        everyone = names + ["new0", "new1"]
+        for name in names:
+            app.register(name, "pw")
+        def random_op():
+            a, b = rng.sample(everyone, 2)
+            kind = rng.randrange(6)
+            if kind == 0:
+                return "register", a, "pw"
+            if kind == 1:
+                return "create_post", a, f"word {rng.randrange(100)}"
+            if kind == 2 and app.posts_by_id:
+                post = app.posts_by_id[rng.choice(list(app.posts_by_id))]
+                return "delete_post_by_id", post.author, post.id
+            return rng.choice(["send_friend_request", "accept_friend_request", "decline_friend_request"]), a, b
+        for _ in range(150):
+            op = random_op()
+            getattr(app, op[0])(*op[1:])
+        for _ in range(30):
+            before, next_post_id = self.state(app, everyone), app.next_post_id
+            with self.assertRaises(ValueError):
+                with app.batch():
+                    for _ in range(rng.randrange(1, 20)):
+                        op = random_op()
+                        getattr(app, op[0])(*op[1:])
+                        if rng.random() < 0.2:
+                            app.get_notifications(rng.choice(everyone)) # marks them read
+                    raise ValueError("stop")
+            self.assertEqual(self.state(app, everyone), before)
+            self.assertEqual(app.next_post_id, next_post_id)
+            for _ in range(5):
+                op = random_op()
+                getattr(app, op[0])(*op[1:])
+        again = self.open(background_writes=False, notification_limit=3, inbox_limit=4)
+        self.assertEqual(self.state(again, everyone), self.state(app, everyone))
+
+    # a rollback takes back the batch alone: nothing is read from disk and users it did not touch stay unparsed
+    def test_rollback_touches_only_the_batch(self):
+        app = self.open(background_writes=False)
+        for i in range(50):
+            app.register(f"user{i}", "pw")
+        app.save_data()
+        app.close()
+        app = self.open(background_writes=False)
+        app.load_data = app.reset_state = None # would fail the rollback with a TypeError
+        with self.assertRaises(ValueError):
+            with app.batch():
+                app.create_post("user1", "undone")
+                app.send_friend_request("user2", "user3")
+                raise ValueError("stop")
+        lazy = [name for name, value in app.users.items() if value.__class__ is smp.LazyRecord]
+        self.assertEqual(len(lazy), 47)
+        self.assertEqual((app.total_posts(), app.users.get("user3").friend_requests), (0, ()))
+
+    # a failed inner batch whose error was caught still undoes the outer one
+    def test_swallowed_inner_failure(self):
+        app = self.make_app()
+        with self.assertRaises(smp.BatchError):
+            with app.batch():
+                app.create_post("ann", "outer")
+                try:
+                    with app.batch():
+                        app.create_post("ann", "inner")
+                        raise ValueError("inner")
+                except ValueError:
+                    pass
+        self.assertEqual(self.contents(app.get_feed("ann")), ["before"])
+
+    # save_data inside a batch waits for it, so a rollback leaves nothing of it in the snapshot
+    def test_save_inside_batch(self):
+        for background_writes in (False, True):
+            with self.subTest(background_writes=background_writes):
+                self.path = os.path.join(self.folder, f"save{background_writes}.json")
+                app = self.open(background_writes=background_writes)
+                app.register("ann", "pw")
+                with app.batch():
+                    app.create_post("ann", "kept")
+                    app.save_data()
+                    app.create_post("ann", "kept too")
+                with self.assertRaises(ValueError):
+                    with app.batch():
+                        app.create_post("ann", "undone")
+                        app.save_data()
+                        raise ValueError("stop")
+                app.flush()
+                again = self.open(background_writes=False)
+                self.assertEqual(self.contents(again.get_feed("ann")), ["kept too", "kept"])
+                self.assertEqual(self.contents(app.get_feed("ann")), ["kept too", "kept"])
+
+    def test_rollback_in_sqlite(self):
+        app = smp.SqliteSocialMediaApp(os.path.join(self.folder, "database.db"))
+        self.addCleanup(app.close)
+        app.register("ann", "pw")
+        with self.assertRaises(ValueError):
+            with app.batch():
+                app.create_post("ann", "undone")
+                raise ValueError("stop")
+        self.assertEqual(app.get_feed("ann"), [])
+        with app.batch():
+            app.create_post("ann", "kept")
+        self.assertEqual(self.contents(app.get_feed("ann")), ["kept"])
+
+
+class SnapshotReadTest(AppTest):
+    # a frozen version does not see later adds and removes, chunk boundaries included
+    def test_timeline_snapshot(self):
+        timeline = smp.TimelineIndex()
+        posts = [smp.Post.from_epoch("ann", str(i), 1000 + i // 3, i + 1) for i in range(1500)]
+        for post in posts[:1000]:
+            timeline.add(post)
+        frozen = timeline.snapshot()
+        for post in posts[1000:]:
+            timeline.add(post)
+        for post in posts[:600:2]:
+            timeline.remove(post)
+        self.assertEqual(list(frozen), posts[:1000])
+        self.assertEqual(frozen.newest(3), posts[999:996:-1])
+        self.assertEqual(list(timeline), posts[1:600:2] + posts[600:])
+
+    # snapshot_data is taken in O(1) and written later, what the writer changed meanwhile is not in the file
+    def test_snapshot_is_exact_at_its_seq(self):
+        app = self.open(background_writes=False)
+        for name in ("ann", "bob", "cat"):
+            app.register(name, "pw")
+        app.send_friend_request("ann", "bob")
+        app.accept_friend_request("bob", "ann")
+        app.create_post("ann", "kept")
+        first = app.search_user_posts("ann", "kept")[0]
+        app.create_post("bob", "also kept")
+        data = app.snapshot_data()
+
+        app.create_post("ann", "too late")
+        app.delete_post_by_id("ann", first.id)
+        app.send_friend_request("cat", "ann")
+        app.accept_friend_request("ann", "cat")
+        app.register("dan", "pw")
+
+        copy = os.path.join(self.folder, "copy.json")
+        app.write_snapshot(data, path=copy)
+        saved = smp.SocialMediaApp(copy, background_writes=False)
+        self.apps.append(saved)
+        self.assertEqual(saved.seq, data["header"]["last_seq"])
+        self.assertEqual(self.contents(saved.get_feed("ann")), ["also kept", "kept"])
+        self.assertEqual(saved.users.get("ann").friends, {"bob"})
+        self.assertIsNone(saved.users.get("dan"))
+
+    # readers never wait for the writer or see a feed half changed, while it posts and saves in the background
+    def test_readers_during_save(self):
+        app = self.open(compact_every=50)
+        names = [f"user{i}" for i in range(20)]
+        for name in names:
+            app.register(name, "pw")
+        for i, name in enumerate(names):
+            app.send_friend_request(name, names[(i + 1) % len(names)])
+            app.accept_friend_request(names[(i + 1) % len(names)], name)
+        stop = threading.Event()
+        errors = []
+
+        def read(n):
+            seen = {}
+            try:
+                while not stop.is_set():
+                    name = names[n % len(names)]
+                    n += 1
+                    feed = app.get_feed(name)
+                    keys = [smp.TimelineIndex.key(post) for post in feed]
+                    self.assertEqual(keys, sorted(set(keys), reverse=True))
+                    self.assertGreaterEqual(len(feed), seen.get(name, 0)) # posts are only added
+                    seen[name] = len(feed)
+                    found = app.search_user_posts(name, "post")
+                    self.assertTrue(all(post.author == name for post in found))
+            except Exception as e:
+                errors.append(e)
+
+        readers = [threading.Thread(target=read, args=(n,)) for n in range(3)]
+        for reader in readers:
+            reader.start()
+        for i in range(600):
+            app.create_post(names[i % len(names)], f"post {i}")
+            if i % 100 == 0:
+                app.save_data()
+        stop.set()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(errors, [])
+
+        app.close()
+        again = self.open(background_writes=False)
+        for name in names:
+            self.assertEqual(self.contents(again.get_feed(name)), self.contents(app.get_feed(name)))
+
+    # the sqlite engine gives every other thread a read only connection of its own
+    def test_sqlite_reader_threads(self):
+        app = smp.SqliteSocialMediaApp(os.path.join(self.folder, "database.db"))
+        self.addCleanup(app.close)
+        app.register("ann", "pw")
+        app.create_post("ann", "hello")
+        app.flush()
+        results = []
+
+        def other_thread():
+            results.append(self.contents(app.get_feed("ann")))
+            try:
+                app.create_post("ann", "from another thread")
+            except RuntimeError as e:
+                results.append(e)
+
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        thread.join()
+        self.assertEqual(results[0], ["hello"])
+        self.assertIsInstance(results[1], RuntimeError)
+        self.assertEqual(self.contents(app.get_feed("ann")), ["hello"])
+
+
+
+class AnalyticsTest(AppTest):
+    HOUR = 1_000_000_800 # epoch seconds at the start of an hour
+
+    # never below the true count, and above it by no more than the bound on almost every item
+    def test_count_min_sketch(self):
+        rng = random.Random(7)
+        sketch = smp.CountMinSketch(width=64, depth=4)
+        true = {}
+        for _ in range(5000):
+            item = int(rng.paretovariate(1.2)) # ints hash the same in every run
+            sketch.add(item)
+            true[item] = true.get(item, 0) + 1
+        bound = 2 * sketch.total / sketch.width
+        errors = [sketch.estimate(item) - count for item, count in true.items()]
+        self.assertGreaterEqual(min(errors), 0)
+        self.assertLessEqual(sum(error > bound for error in errors), len(errors) // 10)
+        self.assertEqual(smp.CountMinSketch.estimate_sum([sketch, sketch], sketch.cells(1)), 2 * sketch.estimate(1))
+
+    # every item seen more than total / capacity times keeps a counter, over its true count by at most its error
+    def test_space_saving(self):
+        rng = random.Random(3)
+        summary = smp.SpaceSaving(capacity=10)
+        stream = [0] * 300 + [1] * 200 + [2] * 150 + [rng.randrange(3, 500) for _ in range(350)]
+        rng.shuffle(stream)
+        for item in stream:
+            summary.add(item)
+        for item in (0, 1, 2):
+            self.assertIn(item, summary.counts)
+            true = stream.count(item)
+            self.assertGreaterEqual(summary.counts[item], true)
+            self.assertLessEqual(summary.counts[item] - summary.errors[item], true)
+        self.assertLessEqual(len(summary.counts), 10)
+        count = summary.counts[0]
+        summary.remove(0, 5)
+        self.assertEqual(summary.counts[0], count - 5)
+        summary.remove(0, count)
+        self.assertNotIn(0, summary.counts)
+
+    # minutes leaving the last hour are folded into their hour, hours older than two days are dropped
+    def test_bucket_rollover(self):
+        analytics = smp.Analytics()
+        start = self.HOUR
+        analytics.add("posts", start + 10, "ann", "hello #fun")
+        analytics.add("posts", start + 1800, "bob", "hello world")
+        self.assertEqual(analytics.totals(60, start + 1805)["posts"], 2)
+        self.assertEqual(analytics.top("words", 60, 1, start + 1805), [("hello", 2)])
+
+        analytics.add("posts", start + 7200, "ann", "later")
+        self.assertEqual(sorted(analytics.minute_buckets), [start + 7200])
+        self.assertEqual(analytics.hour_buckets[start].counts["posts"], 2)
+        self.assertEqual(analytics.totals(60, start + 7205)["posts"], 1)
+        self.assertEqual(analytics.totals(180, start + 7205)["posts"], 3)
+        self.assertEqual(analytics.top("posters", 180, 1, start + 7205), [("ann", 2)])
+        self.assertEqual(analytics.top("hashtags", 180, 5, start + 7205), [("fun", 1)])
+        timeline = analytics.timeline("posts", 180, start + 7205)
+        self.assertEqual(timeline, [(start, 2), (start + 3600, 0), (start + 7200, 1)])
+
+        analytics.add("posts", start + 50 * 3600, "cat", "much later")
+        self.assertEqual(analytics.hour_buckets, {})
+        self.assertEqual(analytics.totals(analytics.max_minutes(), start + 50 * 3600)["posts"], 1)
+        analytics.add("posts", start + 10, "ann", "too old to keep")
+        self.assertEqual(analytics.totals(analytics.max_minutes(), start + 50 * 3600)["posts"], 1)
+
+    # a word that is suddenly everywhere ranks above one that is always there
+    def test_trending(self):
+        analytics = smp.Analytics()
+        for minute in range(120):
+            analytics.add("posts", self.HOUR + minute * 60, "ann", "cat cat")
+        for second in range(20):
+            analytics.add("posts", self.HOUR + 110 * 60 + second, "bob", "dog")
+        trending = analytics.trending("words", 15, 2, self.HOUR + 119 * 60)
+        self.assertEqual([item for item, count, score in trending], ["dog", "cat"])
+        self.assertEqual(trending[0][1], 20)
+
+    def test_snapshot_window_is_clamped(self):
+        analytics = smp.Analytics()
+        analytics.add("posts", self.HOUR, "ann", "hello")
+        for minutes, kept in ((0, 1), (-5, 1), (30, 30), (10 ** 6, analytics.max_minutes())):
+            snapshot = analytics.snapshot(minutes, now=self.HOUR + 5)
+            self.assertEqual(snapshot["minutes"], kept)
+            self.assertEqual(snapshot["totals"]["posts"], 1)
+
+    # a deleted post is taken back out of its bucket, and only counted as a deletion
+    def test_deleted_post_is_taken_back(self):
+        app = self.open(background_writes=False, analytics=True)
+        app.register("ann", "pw")
+        app.create_post("ann", "hello #fun")
+        app.create_post("ann", "hello again")
+        self.assertEqual(app.analytics.totals()["posts"], 2)
+        self.assertEqual(app.analytics.top("words", k=1), [("hello", 2)])
+        post = app.search_user_posts("ann", "fun")[0]
+        app.delete_post_by_id("ann", post.id)
+        totals = app.analytics.totals()
+        self.assertEqual((totals["posts"], totals["deleted_posts"]), (1, 1))
+        self.assertEqual(app.analytics.top("hashtags"), [])
+        self.assertEqual(app.analytics.top("words", k=1), [("hello", 1)])
+
+    def test_api_rejects_bad_windows(self):
+        server = smp.ApiServer(self.open(background_writes=False, analytics=True))
+        for minutes, status in (("0", 400), ("-5", 400), ("abc", 400), ("60", 200), ("2880", 200), ("2881", 400)):
+            self.assertEqual(server.dispatch("GET", f"/analytics?minutes={minutes}", {}, b"")[0], status, minutes)
+
+
+# every datetime.now() of the app answers the same second, so posts tie on their time and order by id alone
+class FrozenClock(smp.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2024, 1, 1, 12, 0, 0)
+
+
+class ShardTest(AppTest):
+    NAMES = [f"user{i}" for i in range(12)]
+
+    def open_sharded(self, shards=3):
+        app = smp.ShardedSocialMediaApp(os.path.join(self.folder, "sharded.json"), shards=shards, background_writes=False)
+        self.apps.append(app)
+        return app
+
+    # a router task asking one shard
+    @staticmethod
+    def ask(shard, name, *args):
+        answer, = yield [(shard, name, args)]
+        return answer
+
+    # two users living on different shards
+    def pair(self, app):
+        first = self.NAMES[0]
+        return first, next(name for name in self.NAMES if app.home(name) != app.home(first))
+
+    # every user is kept by the shard their name hashes to, and only there
+    def test_routing(self):
+        app = self.open_sharded()
+        for name in self.NAMES:
+            self.assertEqual(app.register(name, "pw"), "User registered")
+        self.assertEqual(app.total_users(), len(self.NAMES))
+        for shard in range(app.shards):
+            held = app.call(self.ask(shard, "friend_info", self.NAMES))
+            self.assertEqual(sorted(held), sorted(name for name in self.NAMES if app.home(name) == shard))
+        self.assertEqual(app.login("user3", "pw"), "Log in succesful")
+        self.assertEqual(app.register("user3", "pw"), "Username already taken")
+        self.assertEqual(app.create_post("nobody", "hello"), "user not found")
+
+    def test_cross_shard_accept(self):
+        app = self.open_sharded()
+        for name in self.NAMES:
+            app.register(name, "pw")
+        a, b = self.pair(app)
+        self.assertEqual(app.send_friend_request(a, b), "Friend Request sent")
+        self.assertEqual(app.send_friend_request(a, b), "Friend request already sent")
+        self.assertEqual(app.accept_friend_request(b, a), "friend request accepted")
+        self.assertEqual(app.accept_friend_request(b, a), "friend request not found")
+        self.assertEqual(app.degrees_of_separation(a, b), 1)
+        self.assertEqual(app.get_notifications(a), [(1, f"{b} accepted {a}'s friend request")])
+        app.create_post(b, "hello from the other shard")
+        self.assertEqual(self.contents(app.get_feed(a)), ["hello from the other shard"])
+        self.assertEqual(os.path.getsize(app.intents.path), 0) # nothing left in flight
+
+    # the router died after the receiver's shard accepted, the restart finishes the sender's side
+    def test_resume_after_crash(self):
+        app = self.open_sharded(2)
+        for name in self.NAMES:
+            app.register(name, "pw")
+        a, b = self.pair(app)
+        app.send_friend_request(a, b)
+        app.open_intent({"op": "accept", "receiver": b, "sender": a})
+        self.assertEqual(app.call(app.routed("accept_incoming", b, a)), "friend request accepted")
+        self.assertEqual(app.mutual_friends(a, b), []) # only b's side is done
+        app.close()
+
+        again = self.open_sharded(2)
+        self.assertEqual(again.degrees_of_separation(a, b), 1)
+        self.assertEqual(again.get_notifications(a), [(1, f"{b} accepted {a}'s friend request")])
+        self.assertEqual(os.path.getsize(again.intents.path), 0)
+        self.assertEqual(again.accept_friend_request(b, a), "friend request not found")
+
+    # the same workload, posts all in one second, gives the same pages sharded as in one app
+    def test_parity_with_one_app(self):
+        self.addCleanup(setattr, smp, "datetime", smp.datetime)
+        smp.datetime = FrozenClock
+        single = self.open(background_writes=False)
+        sharded = self.open_sharded()
+        rng = random.Random(11)
+        ops = [("register", name, "pw") for name in self.NAMES]
+        for _ in range(40):
+            ops.append(("send_friend_request", *rng.sample(self.NAMES, 2)))
+        ops += [("accept_friend_request", receiver, sender) for op, sender, receiver in ops[len(self.NAMES):]]
+        words = ["alpha", "beta", "gamma"]
+        ops += [("create_post", rng.choice(self.NAMES), f"{i} {rng.choice(words)}") for i in range(150)]
+        for op in ops:
+            self.assertEqual(sharded.run_many([op]), [getattr(single, op[0])(*op[1:])], op)
+
+        view = lambda posts: [(post.author, post.content, post.epoch) for post in posts]
+        for name in self.NAMES:
+            self.assertEqual(view(sharded.get_feed(name, 7)), view(single.get_feed(name, 7)), name)
+            page = single.get_feed(name, 5)
+            if page:
+                self.assertEqual(view(sharded.get_feed(name, 5, page[-1])), view(single.get_feed(name, 5, page[-1])))
+        for word in words:
+            self.assertEqual(view(sharded.search_posts(word, limit=6)), view(single.search_posts(word, limit=6)))
+        self.assertEqual(view(sharded.get_global_feed(20)), view(single.get_global_feed(20)))
+
+
+class SorterTest(unittest.TestCase):
+    # (key, position) pairs, the position shows whether equal keys kept their order
+    @staticmethod
+    def tagged(keys):
+        return [(key, i) for i, key in enumerate(keys)]
+
+    def check(self, items):
+        self.assertEqual(smp.Sorter.merge_sort(items, key=lambda x: x[0]), sorted(items, key=lambda x: x[0]))
+
+    def test_random_against_sorted(self):
+        rng = random.Random(18)
+        for _ in range(300):
+            n = rng.randrange(200)
+            self.check(self.tagged(rng.randrange(rng.choice([2, 10, 1000])) for _ in range(n)))
+
+    # runs longer than MIN_RUN, up and down, with ties inside and across them
+    def test_runs(self):
+        rng = random.Random(19)
+        up = list(range(100))
+        down = up[::-1]
+        self.check(self.tagged(up))
+        self.check(self.tagged(down))
+        self.check(self.tagged(up + down + up))
+        self.check(self.tagged([5] * 70 + down + [5] * 40))
+        self.check(self.tagged(sorted(rng.randrange(20) for _ in range(300))[::-1])) # descending with ties
+
+    def test_stable_on_equal_keys(self):
+        items = self.tagged([1] * 50 + [0] * 50)
+        self.assertEqual(smp.Sorter.merge_sort(items, key=lambda x: x[0]), items[50:] + items[:50])
+
+    def test_small(self):
+        self.assertEqual(smp.Sorter.merge_sort([]), [])
+        self.assertEqual(smp.Sorter.merge_sort([3]), [3])
+        self.assertEqual(smp.Sorter.merge_sort((2, 1)), [1, 2])
+        items = [3, 1]
+        smp.Sorter.merge_sort(items)
+        self.assertEqual(items, [3, 1]) # a new list is returned, the argument is left alone
+
+    def test_top_k(self):
+        rng = random.Random(20)
+        items = self.tagged(rng.randrange(10) for _ in range(100))
+        key = lambda x: x[0]
+        for k in (0, 1, 7, 100, 150):
+            self.assertEqual(smp.Sorter.top_k(items, k, key), sorted(items, key=key, reverse=True)[:k], k)
+        self.assertEqual(smp.Sorter.top_k(self.tagged([4, 4, 4]), 2, key), [(4, 0), (4, 1)]) # ties keep their order
+        self.assertEqual(smp.Sorter.top_k([], 3), [])
+
+
+class ApiServerTest(AppTest):
+    def setUp(self):
+        super().setUp()
+        self.server = smp.ApiServer(self.open(background_writes=False), port=0)
+
+    @staticmethod
+    def request(method, target, body=None, token=None, headers=""):
+        data = json.dumps(body).encode() if body is not None else b""
+        if token:
+            headers += f"Authorization: Bearer {token}\r\n"
+        return f"{method} {target} HTTP/1.1\r\nContent-Length: {len(data)}\r\n{headers}\r\n".encode() + data
+
+    # (status, json) of the next answer, None once the server has closed the connection
+    @staticmethod
+    async def answer(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        length = 0
+        while (header := await reader.readline()) != b"\r\n":
+            name, _, value = header.decode().partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        return int(line.split()[1]), json.loads(await reader.readexactly(length))
+
+    # send the raw requests one after another on one connection, the answers end with None if it was closed
+    def exchange(self, *requests):
+        async def run():
+            await self.server.start()
+            try:
+                reader, writer = await asyncio.open_connection(self.server.host, self.server.port)
+                answers = []
+                for request in requests:
+                    writer.write(request)
+                    await writer.drain()
+                    answers.append(await self.answer(reader))
+                    if answers[-1] is None:
+                        break
+                else:
+                    writer.write_eof()
+                    await reader.read() # the server closes its side once it has seen the end, so its handler is done
+                writer.close()
+                return answers
+            finally:
+                self.server.server.close()
+                await self.server.server.wait_closed()
+        return asyncio.run(run())
+
+    def login(self, username="ann"):
+        (status, payload), = self.exchange(self.request("POST", "/login", {"username": username, "password": "pw"}))
+        self.assertEqual(status, 200, payload)
+        return payload["token"]
+
+    def test_endpoints(self):
+        answers = self.exchange(self.request("POST", "/register", {"username": "ann", "password": "pw"}),
+                                self.request("POST", "/register", {"username": "ann", "password": "pw"}),
+                                self.request("POST", "/login", {"username": "ann", "password": "nope"}))
+        self.assertEqual([status for status, payload in answers], [200, 400, 401])
+        token = self.login()
+        answers = self.exchange(*(self.request("POST", "/posts", {"content": f"post {i}"}, token) for i in range(3)))
+        self.assertEqual([status for status, payload in answers], [200] * 3)
+
+        (status, first), = self.exchange(self.request("GET", "/feed?limit=2", token=token))
+        self.assertEqual([post["content"] for post in first["posts"]], ["post 2", "post 1"])
+        (status, rest), = self.exchange(self.request("GET", f"/feed?limit=2&cursor={first['next']}", token=token))
+        self.assertEqual(([post["content"] for post in rest["posts"]], rest["next"]), (["post 0"], None))
+        (status, found), = self.exchange(self.request("GET", "/search?q=post&limit=5"))
+        self.assertEqual(len(found["posts"]), 3)
+        post_id = found["posts"][0]["id"]
+        self.assertEqual(self.exchange(self.request("DELETE", f"/posts/{post_id}", token=token))[0][0], 200)
+        self.assertEqual(self.exchange(self.request("GET", "/nowhere"), self.request("GET", "/posts")),
+                         [(404, {"error": "no such endpoint"}), (405, {"error": "method not allowed"})])
+
+    def test_paging_limits(self):
+        self.server.app.register("ann", "pw")
+        token = self.login()
+        for i in range(3):
+            self.server.app.create_post("ann", f"post {i}")
+        statuses = [answer[0] for answer in self.exchange(self.request("GET", "/feed?limit=0", token=token),
+                                                           self.request("GET", "/feed?limit=-3", token=token),
+                                                           self.request("GET", "/feed?limit=ten", token=token),
+                                                           self.request("GET", "/feed?cursor=junk", token=token))]
+        self.assertEqual(statuses, [400] * 4)
+        self.assertEqual(smp.ApiServer.limit({"limit": "5000"}), smp.ApiServer.MAX_PAGE)
+        (status, page), = self.exchange(self.request("GET", "/feed?limit=5000", token=token))
+        self.assertEqual((len(page["posts"]), page["next"]), (3, None))
+
+    def test_auth_rejected(self):
+        self.server.app.register("ann", "pw")
+        token = self.login()
+        answers = self.exchange(self.request("GET", "/feed"),
+                                self.request("GET", "/feed", token="not-a-token"),
+                                self.request("GET", "/feed", token=token),
+                                self.request("POST", "/logout", token=token),
+                                self.request("GET", "/feed", token=token))
+        self.assertEqual([status for status, payload in answers], [401, 401, 200, 200, 401])
+        self.assertEqual(self.server.sessions, {})
+
+    def test_sessions_are_bounded(self):
+        self.server.app.register("ann", "pw")
+        self.server.MAX_SESSIONS = 2
+        tokens = [self.login() for _ in range(3)]
+        self.assertEqual(list(self.server.sessions), tokens[1:]) # the oldest was dropped
+        self.assertEqual([self.server.session_user(token) for token in tokens], [None, "ann", "ann"])
+
+    def test_sessions_expire(self):
+        self.server.app.register("ann", "pw")
+        self.server.SESSION_SECONDS = 0 # a session is over as soon as it starts
+        first = self.login()
+        token = self.login()
+        self.assertEqual(list(self.server.sessions), [token]) # the expired one went when the next was added
+        self.assertEqual(self.exchange(self.request("GET", "/feed", token=token))[0][0], 401)
+
+    def test_username_is_stored_as_a_string(self):
+        self.server.app.register("123", "pw")
+        (status, payload), = self.exchange(self.request("POST", "/login", {"username": 123, "password": "pw"}))
+        self.assertEqual(self.server.session_user(payload["token"]), "123")
+
+    # a bad request gets a 400 and the connection is closed, since the rest of the stream can not be trusted
+    def test_malformed_requests(self):
+        for request in (b"GARBAGE\r\n\r\n",
+                        b"GET /feed\r\n\r\n",
+                        b"GET /search HTTP/1.1\r\nContent-Length: -1\r\n\r\n",
+                        b"GET /search HTTP/1.1\r\nContent-Length: ten\r\n\r\n"):
+            (status, payload), closed = self.exchange(request, self.request("GET", "/search"))
+            self.assertEqual((status, closed), (400, None), request)
+        (status, payload), = self.exchange(b"POST /login HTTP/1.1\r\nContent-Length: 7\r\n\r\n{oops}\n")
+        self.assertEqual(status, 400)
+
+
+class HashTableTest(unittest.TestCase):
+    def check(self, table, expected):
+        self.assertEqual(len(table), len(expected))
+        self.assertEqual(sorted(table.items()), sorted(expected.items())) # every key once, even while moving
+        for key, value in expected.items():
+            self.assertEqual(table.get(key), value)
+
+    # random inserts, updates and deletes compared with a dict, looked at after every write
+    def test_against_dict(self):
+        rng = random.Random(2)
+        table, expected = smp.HashTable(size=4), {}
+        resizing = 0
+        for _ in range(3000):
+            key = rng.randrange(400)
+            if rng.random() < 0.6:
+                table.insert(key, key * 10 + rng.randrange(10))
+                expected[key] = table.get(key)
+            else:
+                self.assertEqual(table.delete(key), expected.pop(key, None) is not None)
+            resizing += table.old_table is not None
+            self.assertEqual(table.count, len(expected)) # right while a resize is half done too
+            self.assertIsNone(table.get(-1))
+        self.assertGreater(resizing, 0)
+        self.check(table, expected)
+
+    # a resize moves a few buckets per write, inserts and deletes alike, until the old table is gone
+    def test_rehash_progress(self):
+        table = smp.HashTable(size=8)
+        for key in range(7):
+            table.insert(key, key)
+        self.assertIsNotNone(table.old_table)
+        self.assertEqual((table.size, table.rehash_index), (16, 0))
+        table.insert(100, 100)
+        self.assertEqual(table.rehash_index, 4)
+        table.get(3)
+        self.assertEqual(table.rehash_index, 4) # lookups leave it alone
+        table.delete(100)
+        self.assertIsNone(table.old_table)
+        self.check(table, {key: key for key in range(7)})
+
+    def test_shrinks_back(self):
+        table = smp.HashTable(size=8)
+        for key in range(1000):
+            table.insert(key, key)
+        grown = table.size
+        sizes = set()
+        for key in range(1000):
+            table.delete(key)
+            self.assertEqual(table.count, 999 - key)
+            sizes.add(table.size)
+        writes = 0
+        while table.size > 8 or table.old_table is not None: # each halving is moved along by later writes
+            table.insert(writes, writes)
+            table.delete(writes)
+            writes += 1
+            sizes.add(table.size)
+        self.assertLess(writes, grown)
+        self.assertGreater(grown, 1000)
+        self.assertTrue({16, 32, 64, grown // 2} <= sizes)
+        self.assertIsNone(table.old_table)
+        self.check(table, {})
+
+    def test_not_resizable(self):
+        table = smp.HashTable(size=4, resizable=False)
+        for key in range(100):
+            table.insert(key, key)
+        self.assertEqual((table.size, table.stats()["longest_chain"] >= 25), (4, True))
+        self.check(table, {key: key for key in range(100)})
+
+    # a snapshot keeps what it saw, taken in the middle of a resize too
+    def test_snapshot_unchanged_by_writes(self):
+        table = smp.HashTable(size=8)
+        for key in range(7):
+            table.insert(key, str(key))
+        self.assertIsNotNone(table.old_table)
+        view = table.snapshot()
+        expected = {key: str(key) for key in range(7)}
+        for key in range(0, 200, 2):
+            table.insert(key, "new")
+        for key in range(1, 7, 2):
+            table.delete(key)
+        self.check(view, expected)
+        self.assertEqual(len(table), 100)
+        self.assertEqual(table.get(2), "new")
+        self.check(table.snapshot(), {key: "new" for key in range(0, 200, 2)})
+
+
+class SocialGraphTest(AppTest):
+    def befriend(self, app, a, b):
+        app.send_friend_request(a, b)
+        self.assertEqual(app.accept_friend_request(b, a), "friend request accepted")
+
+    # a -- b -- c -- d   e -- f   g alone
+    def make_chain(self):
+        app = self.open(background_writes=False)
+        for name in "abcdefg":
+            app.register(name, "pw")
+        for a, b in ("ab", "bc", "cd", "ef"):
+            self.befriend(app, a, b)
+        return app
+
+    def test_degrees_of_separation(self):
+        app = self.make_chain()
+        self.assertEqual(app.degrees_of_separation("a", "a"), 0)
+        self.assertEqual(app.degrees_of_separation("a", "b"), 1)
+        self.assertEqual(app.degrees_of_separation("a", "c"), 2)
+        self.assertEqual(app.degrees_of_separation("d", "a"), 3)
+        self.assertEqual(app.degrees_of_separation("a", "e"), -1)
+        self.assertEqual(app.degrees_of_separation("a", "g"), -1)
+        self.assertEqual(app.degrees_of_separation("g", "g"), 0)
+        self.assertEqual(app.degrees_of_separation("a", "nobody"), -1)
+        app.close()
+        again = self.open(background_writes=False) # friends that are loaded lazily are found as well
+        self.assertEqual(again.degrees_of_separation("a", "d"), 3)
+
+    # the bidirectional search against a plain one from a, on random graphs
+    def test_degrees_against_bfs(self):
+        rng = random.Random(8)
+        graph = self.open(background_writes=False).graph
+        names = [f"user{i}" for i in range(60)]
+        graph.adjacency = {name: set() for name in names}
+        for _ in range(70):
+            a, b = rng.sample(names, 2)
+            graph.adjacency[a].add(b)
+            graph.adjacency[b].add(a)
+        for a in names[:10]:
+            depths, queue = {a: 0}, collections.deque([a])
+            while queue:
+                name = queue.popleft()
+                for friend in graph.adjacency[name]:
+                    if friend not in depths:
+                        depths[friend] = depths[name] + 1
+                        queue.append(friend)
+            for b in names:
+                self.assertEqual(graph.degrees_of_separation(a, b), depths.get(b, -1), (a, b))
+
+    def test_mutual_friends(self):
+        app = self.make_chain()
+        self.befriend(app, "a", "c")
+        self.befriend(app, "d", "b")
+        self.assertEqual(app.mutual_friends("a", "c"), ["b"])
+        self.assertEqual(app.mutual_friends("b", "c"), ["a", "d"])
+        self.assertEqual(app.mutual_friends("a", "e"), [])
+        self.assertEqual(app.mutual_friends("a", "nobody"), [])
+
+    def test_suggestions(self):
+        app = self.make_chain()
+        self.befriend(app, "b", "e")
+        self.befriend(app, "c", "e")
+        self.befriend(app, "a", "c") # a's friends b and c both know e, only c knows d
+        self.assertEqual(app.suggest_friends("a"), [("e", 2), ("d", 1)])
+        self.assertEqual(app.suggest_friends("a", limit=1), [("e", 2)])
+        app.send_friend_request("a", "e") # pending either way, so not suggested
+        app.send_friend_request("d", "a")
+        self.assertEqual(app.suggest_friends("a"), [])
+        self.assertEqual(app.suggest_friends("g"), [])
+        self.assertEqual(app.suggest_friends("nobody"), [])
+        for name, count in app.suggest_friends("e"):
+            self.assertFalse(app.graph.are_friends("e", name))
+            self.assertNotEqual(name, "e")
+
+
+class TimelineIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, smp.TimelineIndex, "CHUNK", smp.TimelineIndex.CHUNK)
+        smp.TimelineIndex.CHUNK = 4 # small chunks, so a few posts already split them
+        self.next_id = 0
+
+    def post(self, epoch):
+        self.next_id += 1
+        return smp.Post.from_epoch("ann", f"post {self.next_id}", epoch, self.next_id)
+
+    def check(self, index, posts):
+        expected = sorted(posts, key=smp.TimelineIndex.key)
+        self.assertEqual(list(index), expected)
+        self.assertEqual(len(index), len(expected))
+        self.assertEqual(list(index.iter_newest()), expected[::-1])
+        keys, chunks, firsts, starts, length, trimmed = index.version
+        for chunk in range(len(chunks)):
+            self.assertLessEqual(index.size(index.version, chunk), smp.TimelineIndex.CHUNK)
+            self.assertEqual(firsts[chunk], keys[chunk][0])
+
+    # posts arriving out of order land inside full chunks, which split in two
+    def test_chunks_split(self):
+        rng = random.Random(3)
+        index, posts = smp.TimelineIndex(), []
+        for _ in range(200):
+            post = self.post(rng.randrange(50))
+            index.add(post)
+            posts.append(post)
+            self.check(index, posts)
+        self.assertGreater(len(index.version[0]), 200 // smp.TimelineIndex.CHUNK)
+        for post in rng.sample(posts, 150):
+            self.assertTrue(index.remove(post))
+            posts.remove(post)
+            self.check(index, posts)
+        self.assertFalse(index.remove(self.post(7)))
+
+    def test_snapshot_is_frozen(self):
+        index = smp.TimelineIndex.from_sorted([self.post(epoch) for epoch in range(10)])
+        before = list(index)
+        view = index.snapshot()
+        index.add(self.post(20)) # appended to the last chunk in place
+        index.add(self.post(3)) # splits a chunk
+        index.remove(before[0])
+        index.trim(5)
+        self.assertEqual(list(view), before)
+        self.assertEqual(list(view.iter_newest()), before[::-1])
+        self.assertEqual(len(index), 5)
+        self.assertTrue(index.trimmed)
+        self.assertFalse(view.trimmed)
+
+    # pages of every size walk the posts exactly once, also where the page ends inside a run of equal timestamps
+    def test_cursor_pages_on_equal_timestamps(self):
+        posts = [self.post(epoch) for epoch in [1] * 9 + [2] * 3 + [3] * 10]
+        index = smp.TimelineIndex()
+        for post in reversed(posts): # every add goes before the existing posts
+            index.add(post)
+        newest = sorted(posts, key=smp.TimelineIndex.key, reverse=True)
+        for limit in range(1, 8):
+            walked, cursor = [], None
+            while True:
+                page = index.newest(limit, cursor)
+                self.assertEqual(list(itertools.islice(index.iter_newest(cursor), limit)), page)
+                if not page:
+                    break
+                walked += page
+                cursor = page[-1]
+            self.assertEqual(walked, newest, limit)
+
+    # both ends are whole seconds and included, a fraction of a second moves start up and end down
+    def test_between_bounds(self):
+        rng = random.Random(6)
+        base = smp.Epoch.from_datetime(smp.datetime(2024, 1, 1))
+        posts = [self.post(base + rng.randrange(20)) for _ in range(100)]
+        index = smp.TimelineIndex.from_sorted(sorted(posts, key=smp.TimelineIndex.key))
+        at = lambda seconds, micro=0: smp.Epoch.to_datetime(base + seconds) + smp.timedelta(microseconds=micro)
+        for low in range(-2, 22):
+            for high in range(low - 1, 22):
+                expected = [post for post in index if base + low <= post.epoch <= base + high]
+                self.assertEqual(index.between(at(low), at(high)), expected, (low, high))
+        self.assertEqual(index.between(at(4, 1), at(6, 999999)), [post for post in index if base + 5 <= post.epoch <= base + 6])
+        self.assertEqual(index.between(at(5, 1), at(5, 2)), [])
+        self.assertEqual(smp.TimelineIndex().between(at(0), at(30)), [])
+
+
+class MetricsTest(AppTest):
+    def test_counters_and_percentiles(self):
+        metrics = smp.Metrics()
+        for _ in range(98):
+            metrics.record("get_feed", 3_000) # 3us, in the bucket under 4us
+        metrics.record("get_feed", 5_000_000, failed=True) # 5ms, under 8192us
+        metrics.record("get_feed", 5_000_000)
+        op = metrics.snapshot()["get_feed"]
+        self.assertEqual((op["calls"], op["failed"], op["max_us"]), (100, 1, 5000))
+        self.assertAlmostEqual(op["total_ms"], 10.294)
+        self.assertEqual((op["p50_us_under"], op["p99_us_under"]), (4, 8192))
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_timed_counts_failures(self):
+        metrics = smp.Metrics()
+        def fail():
+            raise ValueError("no")
+        self.assertEqual(metrics.timed("ok", lambda x: x + 1)(1), 2)
+        with self.assertRaises(ValueError):
+            metrics.timed("fail", fail)()
+        ops = metrics.snapshot()
+        self.assertEqual([(name, op["calls"], op["failed"]) for name, op in ops.items()], [("fail", 1, 1), ("ok", 1, 0)])
+
+    # the app's own calls show up in metrics_snapshot, with its table and persistence numbers
+    def test_app_snapshot(self):
+        app = self.open(background_writes=False, metrics=True)
+        for name in ("ann", "bob"):
+            app.register(name, "pw")
+        app.create_post("ann", "hello")
+        for _ in range(3):
+            app.get_feed("ann", 10)
+        app.save_data()
+        stats = json.loads(json.dumps(app.metrics_snapshot())) # json serialisable
+        self.assertTrue(stats["enabled"])
+        self.assertEqual({name: op["calls"] for name, op in stats["ops"].items()},
+                         {"register": 2, "create_post": 1, "get_feed": 3, "save_data": 1})
+        self.assertEqual((stats["users"], stats["posts"], stats["users_table"]["items"]), (2, 1, 2))
+        self.assertEqual(stats["persistence"]["snapshots"]["writes"], 1)
+        self.assertEqual(stats["persistence"]["snapshots"]["bytes"], os.path.getsize(self.path))
+        self.assertGreaterEqual(stats["persistence"]["log"]["writes"], 1)
+        app.disable_metrics()
+        app.get_feed("ann")
+        self.assertEqual(app.metrics_snapshot()["ops"]["get_feed"]["calls"], 3)
+
+    def spin(self, seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    def test_profiler(self):
+        metrics = smp.Metrics()
+        metrics.start_profiler(0.001, threading.current_thread())
+        self.assertTrue(metrics.profiling)
+        self.spin(0.2)
+        report = metrics.stop_profiler(limit=5)
+        self.assertFalse(metrics.profiling)
+        self.assertIsNone(metrics.profiler)
+        self.assertGreater(report["samples"], 10)
+        self.assertEqual(report["samples"], sum(report["stacks"].values()))
+        self.assertLessEqual(len(report["self"]), 5)
+        self.assertEqual(report["self"][0][0], "MetricsTest.spin") # where the time went
+        self.assertGreater(report["self"][0][1], report["samples"] / 2)
+        samples = report["samples"]
+        self.spin(0.05)
+        self.assertEqual(sum(metrics.samples.values()), samples) # nothing is sampled once stopped
+
+if __name__ == "__main__":
+    unittest.main()